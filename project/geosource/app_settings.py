@@ -3,3 +3,20 @@ from django.conf import settings
 # Max time a task can be running until another one can be runned.
 # This is to prevent when a task is blocked.
 MAX_TASK_RUNTIME = getattr(settings, "GEOSOURCE_MAX_TASK_RUNTIME", 24)
+
+# Number of features removed per query when purging the data of a deleted source.
+DELETE_BATCH_SIZE = getattr(settings, "GEOSOURCE_DELETE_BATCH_SIZE", 10000)
+
+# Give new layers their own feature partition, once features are partitioned by layer.
+PARTITION_NEW_LAYERS = getattr(settings, "GEOSOURCE_PARTITION_NEW_LAYERS", False)
+
+# Number of records checked and written together when refreshing a source.
+INGESTION_CHUNK_SIZE = getattr(settings, "GEOSOURCE_INGESTION_CHUNK_SIZE", 1000)
+
+# Max zooms of the bands for which simplified geometries of polygon and line
+# layers are stored after each refresh, e.g. [6, 9, 12]. Disabled when empty.
+GENERALIZATION_ZOOMS = getattr(settings, "GEOSOURCE_GENERALIZATION_ZOOMS", [])
+
+# Max number of values of a field sampled to compute its quantiles at ingestion.
+# Default bounds their rank error to 1%, the default approx_quantile_error of styles.
+STATISTICS_SAMPLE_SIZE = getattr(settings, "GEOSOURCE_STATISTICS_SAMPLE_SIZE", 40000)
@@ -8,3 +8,7 @@ class AppConfig(PermissionRegistrationMixin, BaseAppConfig):
     name = "project.geosource"
     verbose_name = "Geosource"
     permissions = (("DataSource", "can_manage_sources", "Can manage sources"),)
+
+    def ready(self):
+        super().ready()
+        from . import receivers  # NOQA
@@ -0,0 +1,115 @@
+"""
+Precomputed generalized geometries of polygon and line layers.
+
+After each refresh, features of these layers are simplified once for every zoom
+band of GEOSOURCE_GENERALIZATION_ZOOMS, with the tolerance vector tiles would
+use at the highest zoom of the band. Tiles of low zooms are then built from
+these light geometries instead of simplifying full detail geometries on the fly.
+"""
+import logging
+from bisect import bisect_left
+from math import pi
+
+from django.contrib.gis.db.models import GeometryField
+from django.db import connection, transaction
+from django.db.models import F, FilteredRelation, Q
+from django.db.models.functions import Coalesce
+from geostore.models import Feature, Layer
+from geostore.tiles import EARTH_RADIUS, EPSG_3857
+from geostore.tiles.helpers import VectorTile
+
+from .app_settings import GENERALIZATION_ZOOMS
+from .models import GeneralizedGeometry
+
+logger = logging.getLogger(__name__)
+
+
+def get_zoom_band(zoom, zooms=None):
+    """Return the max zoom of the band containing `zoom`, None above all bands"""
+    zooms = sorted(GENERALIZATION_ZOOMS if zooms is None else zooms)
+    index = bisect_left(zooms, zoom)
+    return zooms[index] if index < len(zooms) else None
+
+
+def get_tolerance(zoom):
+    """Half pixel width of vector tiles at this zoom, in web mercator units"""
+    return 2 * pi * EARTH_RADIUS / 2**zoom / VectorTile.TILE_WIDTH_PIXEL / 2
+
+
+def is_generalizable(layer):
+    return layer.is_polygon or layer.is_linestring
+
+
+@transaction.atomic
+def generalize_layer(layer_pk, zooms=None):
+    """(Re)compute generalized geometries of all features of a layer"""
+    zooms = sorted(GENERALIZATION_ZOOMS if zooms is None else zooms)
+    layer = Layer.objects.get(pk=layer_pk)
+
+    GeneralizedGeometry.objects.filter(feature__layer=layer).delete()
+    if not zooms or not is_generalizable(layer):
+        return {"count": 0}
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {GeneralizedGeometry._meta.db_table} (feature_id, zoom, geom)
+            SELECT
+                feature.id,
+                band.zoom,
+                generalized.geom
+            FROM
+                {Feature._meta.db_table} AS feature
+                CROSS JOIN unnest(%(zooms)s::integer[], %(tolerances)s::double precision[])
+                    AS band(zoom, tolerance),
+                LATERAL (
+                    SELECT ST_SimplifyPreserveTopology(
+                        ST_Transform(feature.geom, {EPSG_3857}), band.tolerance
+                    ) AS geom
+                ) AS generalized
+            WHERE
+                feature.layer_id = %(layer)s AND NOT ST_IsEmpty(generalized.geom)
+            """,
+            {
+                "layer": layer.pk,
+                "zooms": zooms,
+                "tolerances": [get_tolerance(zoom) for zoom in zooms],
+            },
+        )
+        count = cursor.rowcount
+
+    logger.info(f"{count} generalized geometries computed for layer {layer}")
+    return {"count": count}
+
+
+class GeneralizedVectorTile(VectorTile):
+    """Vector tile using the generalized geometries of the tile zoom band.
+
+    Geostore has no extension point for this, so `get_tile` and `_simplify`
+    are overridden: their signatures are checked by tests, with geostore
+    version pinned in requirements.
+    """
+
+    def get_tile(self, x, y, z, *args, **kwargs):
+        self.zoom = z
+        return super().get_tile(x, y, z, *args, **kwargs)
+
+    def _simplify(self, layer_query, pixel_width_x, pixel_width_y):
+        layer_query = super()._simplify(layer_query, pixel_width_x, pixel_width_y)
+        band = get_zoom_band(self.zoom)
+        if band is None or not is_generalizable(self.layer):
+            return layer_query
+
+        # Joined on (feature_id, zoom), features without generalized geometry
+        # yet fall back on the full one
+        return layer_query.annotate(
+            band_geometry=FilteredRelation(
+                "generalized_geometries",
+                condition=Q(generalized_geometries__zoom=band),
+            ),
+            outgeom3857=Coalesce(
+                F("band_geometry__geom"),
+                F("outgeom3857"),
+                output_field=GeometryField(srid=EPSG_3857),
+            ),
+        )
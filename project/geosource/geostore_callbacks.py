@@ -2,7 +2,11 @@ import logging
 
 from django.contrib.auth.models import Group
 from django.contrib.gis.geos import GEOSGeometry
-from geostore.models import Layer, LayerGroup
+from django.db import transaction
+from geostore.models import Feature, Layer, LayerGroup
+
+from . import partitioning
+from .app_settings import DELETE_BATCH_SIZE, PARTITION_NEW_LAYERS
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +19,12 @@ def layer_callback(geosource):
         "settings": geosource.settings,
     }
 
-    layer, _ = Layer.objects.get_or_create(name=geosource.slug, defaults=defaults)
+    layer, created = Layer.objects.get_or_create(name=geosource.slug, defaults=defaults)
+
+    if created and PARTITION_NEW_LAYERS and partitioning.is_partitioned():
+        from .tasks import run_create_layer_partition
+
+        transaction.on_commit(lambda: run_create_layer_partition.delay(layer.pk))
 
     layer_groups = Group.objects.filter(pk__in=geosource.settings.get("groups", []))
 
@@ -48,6 +57,82 @@ def clear_features(geosource, layer, begin_date):
     return layer.features.filter(updated_at__lt=begin_date).delete()
 
 
+# Prefix of geostore layers detached from their deleted source, waiting for purge
+DELETED_LAYER_PREFIX = "__deleted__"
+
+
 def delete_layer(geosource):
-    geosource.get_layer().features.all().delete()
-    return geosource.get_layer().delete()
+    """Detach the layer from the source, then purge its features in background.
+
+    The layer is renamed and removed from its groups, so it is not served
+    anymore and its name can be reused by a new source right away.
+    """
+    from .tasks import run_delete_layer_features
+
+    layer = geosource.get_layer()
+    layer.name = f"{DELETED_LAYER_PREFIX}{layer.pk}-{layer.name}"[:256]
+    layer.settings["deletion"] = {
+        "source": geosource.pk,
+        "state": "PENDING",
+        "deleted": 0,
+        "total": None,
+    }
+    layer.save()
+    layer.layer_groups.clear()
+    layer.authorized_groups.clear()
+
+    # Once the source deletion is committed, so the task finds the detached layer
+    transaction.on_commit(lambda: run_delete_layer_features.delay(layer.pk))
+
+
+def delete_layer_features(layer_pk, batch_size=DELETE_BATCH_SIZE, progress=None):
+    """Delete features of a detached layer by batches of `batch_size`, then the layer.
+
+    `progress` is called after each batch with the deleted and total counts.
+    """
+    try:
+        layer = Layer.objects.get(pk=layer_pk)
+    except Layer.DoesNotExist:
+        # Already purged, e.g. when the task is retried
+        return {"deleted": 0, "total": 0}
+    total = layer.features.count()
+    deleted = 0
+
+    # Features stored in their own partition are dropped at once
+    if partitioning.drop_layer_partition(layer_pk):
+        deleted = total
+
+    while True:
+        batch = list(layer.features.values_list("pk", flat=True)[:batch_size])
+        if not batch:
+            break
+        _, deleted_by_model = Feature.objects.filter(pk__in=batch).delete()
+        deleted += deleted_by_model.get(Feature._meta.label, 0)
+        layer.settings["deletion"] = {
+            **layer.settings.get("deletion", {}),
+            "state": "STARTED",
+            "deleted": deleted,
+            "total": total,
+        }
+        Layer.objects.filter(pk=layer_pk).update(settings=layer.settings)
+        if progress:
+            progress(deleted, total)
+
+    layer.delete()
+    return {"deleted": deleted, "total": total}
+
+
+def get_deletion_status(source_pk):
+    """Return the purge progress of the data of a deleted source, or None once
+    purged or if the source is not deleted"""
+    layer = Layer.objects.filter(
+        name__startswith=DELETED_LAYER_PREFIX, settings__deletion__source=source_pk
+    ).first()
+    if layer is None:
+        return None
+    deletion = layer.settings["deletion"]
+    return {
+        "state": deletion["state"],
+        "deleted": deletion["deleted"],
+        "total": deletion["total"],
+    }
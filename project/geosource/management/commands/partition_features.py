@@ -0,0 +1,56 @@
+from django.core.management import BaseCommand, CommandError
+from django.db.models import Count
+from geostore.models import Layer
+
+from project.geosource import partitioning
+
+
+class Command(BaseCommand):
+    help = "Partition geostore features by layer and move layers to their own partition"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--layer",
+            dest="layers",
+            type=int,
+            action="append",
+            default=[],
+            help="Pk of a geostore layer to move in its own partition",
+        )
+        parser.add_argument(
+            "--min-features",
+            dest="min_features",
+            type=int,
+            help="Move every layer with at least this number of features in its own partition",
+        )
+        parser.add_argument(
+            "--drop-foreign-keys",
+            dest="drop_foreign_keys",
+            action="store_true",
+            help="Drop foreign keys from other tables to features, that can't be kept "
+            "on a partitioned table. Cascade deletions are then only handled by Django",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            partitioned = partitioning.partition_feature_table(
+                drop_foreign_keys=options["drop_foreign_keys"]
+            )
+        except partitioning.PartitioningError as e:
+            raise CommandError(f"{e}. Use --drop-foreign-keys to drop them.")
+        if partitioned:
+            self.stdout.write("Features table is now partitioned by layer")
+
+        layers = set(options["layers"])
+        if options["min_features"]:
+            layers.update(
+                Layer.objects.annotate(count=Count("features"))
+                .filter(count__gte=options["min_features"])
+                .values_list("pk", flat=True)
+            )
+
+        for layer_pk in sorted(layers):
+            if partitioning.create_layer_partition(layer_pk):
+                self.stdout.write(f"Layer {layer_pk} moved to its own partition")
+            else:
+                self.stdout.write(f"Layer {layer_pk} already has its own partition")
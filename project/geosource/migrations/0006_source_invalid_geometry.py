@@ -0,0 +1,22 @@
+# Generated by Django 4.1.6 on 2026-10-19 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("geosource", "0005_alter_source_report_alter_source_settings_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="source",
+            name="invalid_geometry",
+            field=models.CharField(
+                choices=[("fail", "Fail"), ("repair", "Repair"), ("drop", "Drop")],
+                default="repair",
+                max_length=10,
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.1.6 on 2026-10-19 17:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("geosource", "0006_source_invalid_geometry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="source",
+            name="coordinate_precision",
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="source",
+            name="simplify_tolerance",
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
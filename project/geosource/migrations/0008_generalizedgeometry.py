@@ -0,0 +1,43 @@
+# Generated by Django 4.1.6 on 2026-10-19 17:45
+
+import django.contrib.gis.db.models.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("geostore", "0046_auto_20211013_1334"),
+        ("geosource", "0007_source_coordinate_precision_simplify_tolerance"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GeneralizedGeometry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("zoom", models.PositiveSmallIntegerField()),
+                ("geom", django.contrib.gis.db.models.fields.GeometryField(srid=3857)),
+                (
+                    "feature",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="generalized_geometries",
+                        to="geostore.feature",
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("feature", "zoom")},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.6 on 2026-10-19 17:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("geosource", "0008_generalizedgeometry"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="field",
+            name="statistics",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
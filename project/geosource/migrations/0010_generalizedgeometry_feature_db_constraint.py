@@ -0,0 +1,25 @@
+# Generated by Django 4.1.6 on 2026-10-19 18:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("geostore", "0046_auto_20211013_1334"),
+        ("geosource", "0009_field_statistics"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="generalizedgeometry",
+            name="feature",
+            field=models.ForeignKey(
+                db_constraint=False,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="generalized_geometries",
+                to="geostore.feature",
+            ),
+        ),
+    ]
@@ -3,6 +3,7 @@ import sys
 from datetime import datetime, timedelta
 from enum import Enum, auto
 from io import BytesIO
+from itertools import islice
 
 import fiona
 import psycopg2
@@ -10,20 +11,23 @@ import pyexcel
 from celery.result import AsyncResult
 from celery.utils.log import LoggingProxy
 from django.conf import settings
+from django.contrib.gis.db.models import GeometryField
 from django.contrib.gis.gdal.error import GDALException
 from django.contrib.gis.geos import GEOSGeometry
 from django.core.management import call_command
-from django.db import models, transaction
+from django.db import connection, models, transaction
 from django.utils import timezone
 from django.utils.text import slugify
 from geostore import GeometryTypes
 from polymorphic.models import PolymorphicModel
 from psycopg2 import sql
 
+from .app_settings import INGESTION_CHUNK_SIZE
 from .callbacks import get_attr_from_path
 from .fields import LongURLField
 from .mixins import CeleryCallMethodsMixin
 from .signals import refresh_data_done
+from .statistics import StatisticsCollector
 
 # Decimal fields must be returned as float
 DEC2FLOAT = psycopg2.extensions.new_type(
@@ -59,6 +63,30 @@ class FieldTypes(Enum):
         return types.get(type(data), cls.Undefined)
 
 
+class InvalidGeometryPolicy(Enum):
+    Fail = "fail"
+    Repair = "repair"
+    Drop = "drop"
+
+    @classmethod
+    def choices(cls):
+        return [(enum.value, enum.name) for enum in cls]
+
+
+class InvalidGeometriesError(ValueError):
+    pass
+
+
+def chunked(iterable, size):
+    """Yield lists of `size` items from iterable"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
 class Source(PolymorphicModel, CeleryCallMethodsMixin):
     name = models.CharField(max_length=255, unique=True)
     credit = models.TextField(blank=True)
@@ -69,6 +97,14 @@ class Source(PolymorphicModel, CeleryCallMethodsMixin):
     geom_type = models.IntegerField(
         choices=GeometryTypes.choices(), null=True, blank=True
     )
+    invalid_geometry = models.CharField(
+        max_length=10,
+        choices=InvalidGeometryPolicy.choices(),
+        default=InvalidGeometryPolicy.Repair.value,
+    )
+    # Grid size and simplification tolerance, in source projection units
+    coordinate_precision = models.FloatField(null=True, blank=True)
+    simplify_tolerance = models.FloatField(null=True, blank=True)
 
     settings = models.JSONField(default=dict, blank=True)
     report = models.JSONField(default=dict, blank=True)
@@ -122,26 +158,52 @@ class Source(PolymorphicModel, CeleryCallMethodsMixin):
 
     def _refresh_data(self):
         report = {}
-        with transaction.atomic():
-            layer = self.get_layer()
-            begin_date = datetime.now()
-            row_count = 0
-            total = 0
-
-            for i, row in enumerate(self._get_records()):
-                total += 1
-                geometry = row.pop(self.SOURCE_GEOM_ATTRIBUTE)
-                try:
-                    identifier = row[self.id_field]
-                except KeyError:
-                    msg = "Can't find identifier field for this record"
-                    report["status"] = "Warning"
-                    report.setdefault("message", []).append(msg)
-                    report.setdefault("lines", {}).setdefault(f"{i}", []).append(msg)
-                    continue
-                self.update_feature(layer, identifier, geometry, row)
-                row_count += 1
-            self.clear_features(layer, begin_date)
+        try:
+            with transaction.atomic():
+                layer = self.get_layer()
+                begin_date = datetime.now()
+                row_count = 0
+                total = 0
+                statistics = StatisticsCollector(seed=self.pk)
+                # Identifiers already written, a record of an already written
+                # identifier updates the same feature
+                identifiers = set()
+
+                records = enumerate(self._get_records())
+                for chunk in chunked(records, INGESTION_CHUNK_SIZE):
+                    rows = []
+                    for i, row in chunk:
+                        total += 1
+                        geometry = row.pop(self.SOURCE_GEOM_ATTRIBUTE)
+                        try:
+                            identifier = row[self.id_field]
+                        except KeyError:
+                            msg = "Can't find identifier field for this record"
+                            report["status"] = "Warning"
+                            report.setdefault("message", []).append(msg)
+                            report.setdefault("lines", {}).setdefault(
+                                f"{i}", []
+                            ).append(msg)
+                            continue
+                        rows.append((identifier, geometry, row))
+
+                    rows = self._generalize_geometries(rows, report)
+                    for identifier, geometry, row in self._validate_geometries(
+                        rows, report
+                    ):
+                        feature = self.update_feature(layer, identifier, geometry, row)
+                        row_count += 1
+                        # Statistics of stored features only, counted once
+                        if feature is None or f"{identifier}" in identifiers:
+                            continue
+                        identifiers.add(f"{identifier}")
+                        statistics.add(row)
+                self.clear_features(layer, begin_date)
+                self.update_fields_statistics(statistics)
+        except InvalidGeometriesError as err:
+            self.report = {**report, "status": "Error", "message": [f"{err}"]}
+            self.save(update_fields=["report"])
+            raise
 
         self.report = report
         if not row_count:
@@ -154,6 +216,144 @@ class Source(PolymorphicModel, CeleryCallMethodsMixin):
             self.save(update_fields=["report"])
         return {"count": row_count, "total": total}
 
+    @staticmethod
+    def _geometry_to_ewkb(geometry):
+        if isinstance(geometry, GEOSGeometry):
+            return geometry.hexewkb.decode()
+        return None if geometry is None else f"{geometry}"
+
+    def _generalize_geometries(self, rows, report):
+        """Snap a chunk of geometries to the source coordinate precision grid and
+        simplify them, preserving topology, with a single query.
+
+        Valid geometries made invalid by snapping or simplification, e.g. by
+        rings touching themselves, are made valid again. Geometries collapsing
+        to nothing are kept as is.
+
+        :param rows: list of (identifier, geometry, properties) tuples
+        :returns: the rows with generalized geometries
+        """
+        if self.coordinate_precision is None and self.simplify_tolerance is None:
+            return rows
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT
+                    ST_AsHEXEWKB(result),
+                    ST_MemSize(geom),
+                    ST_MemSize(result)
+                FROM
+                    unnest(%(geometries)s::geometry[]) WITH ORDINALITY AS t(geom, idx),
+                    LATERAL (
+                        SELECT COALESCE(
+                            ST_SnapToGrid(geom, %(precision)s::double precision), geom
+                        ) AS snapped
+                    ) AS s,
+                    LATERAL (
+                        SELECT COALESCE(
+                            ST_SimplifyPreserveTopology(
+                                snapped, %(tolerance)s::double precision
+                            ),
+                            snapped
+                        ) AS simplified
+                    ) AS g,
+                    LATERAL (
+                        SELECT
+                            CASE WHEN ST_IsValid(simplified) OR NOT ST_IsValid(geom)
+                            THEN simplified
+                            ELSE ST_CollectionExtract(
+                                ST_MakeValid(simplified), ST_Dimension(geom) + 1
+                            )
+                            END AS valid
+                    ) AS v,
+                    LATERAL (
+                        SELECT
+                            CASE WHEN ST_IsEmpty(valid) THEN geom ELSE valid END
+                            AS result
+                    ) AS r
+                ORDER BY
+                    idx
+                """,
+                {
+                    "geometries": [
+                        self._geometry_to_ewkb(geometry) for _, geometry, _ in rows
+                    ],
+                    "precision": self.coordinate_precision,
+                    "tolerance": self.simplify_tolerance,
+                },
+            )
+            results = cursor.fetchall()
+
+        size = report.setdefault("size", {"before": 0, "after": 0, "saved": 0})
+        generalized_rows = []
+        for (identifier, geometry, row), (generalized, before, after) in zip(
+            rows, results
+        ):
+            if generalized is not None:
+                geometry = generalized
+                size["before"] += before
+                size["after"] += after
+            generalized_rows.append((identifier, geometry, row))
+        size["saved"] = size["before"] - size["after"]
+
+        return generalized_rows
+
+    def _validate_geometries(self, rows, report):
+        """Check validity of a chunk of geometries with a single query, then apply
+        the source invalid geometry policy.
+
+        :param rows: list of (identifier, geometry, properties) tuples
+        :returns: the rows to write, with repaired geometries if needed
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT
+                    idx - 1,
+                    ST_AsHEXEWKB(
+                        ST_CollectionExtract(ST_MakeValid(geom), ST_Dimension(geom) + 1)
+                    )
+                FROM
+                    unnest(%s::geometry[]) WITH ORDINALITY AS t(geom, idx)
+                WHERE
+                    NOT ST_IsValid(geom)
+                """,
+                [[self._geometry_to_ewkb(geometry) for _, geometry, _ in rows]],
+            )
+            invalids = dict(cursor.fetchall())
+
+        if not invalids:
+            return rows
+
+        summary = report.setdefault(
+            "geometries", {"invalid": 0, "repaired": 0, "dropped": 0}
+        )
+        summary["invalid"] += len(invalids)
+
+        if self.invalid_geometry == InvalidGeometryPolicy.Fail.value:
+            raise InvalidGeometriesError(
+                "Source contains invalid geometries for records "
+                f"{[rows[index][0] for index in invalids]}"
+            )
+
+        valid_rows = []
+        for index, (identifier, geometry, row) in enumerate(rows):
+            if index in invalids:
+                repaired = invalids[index]
+                repair = self.invalid_geometry == InvalidGeometryPolicy.Repair.value
+                if not repair or repaired is None or GEOSGeometry(repaired).empty:
+                    summary["dropped"] += 1
+                    continue
+                summary["repaired"] += 1
+                geometry = repaired
+            valid_rows.append((identifier, geometry, row))
+
+        if summary["dropped"]:
+            report["status"] = "Warning"
+
+        return valid_rows
+
     @transaction.atomic
     def update_fields(self):
         records = self._get_records(50)
@@ -207,6 +407,12 @@ class Source(PolymorphicModel, CeleryCallMethodsMixin):
 
         return {"count": len(fields)}
 
+    def update_fields_statistics(self, statistics):
+        fields = list(self.fields.all())
+        for field in fields:
+            field.statistics = statistics.get_statistics(field.name)
+        Field.objects.bulk_update(fields, ["statistics"])
+
     def get_status(self):
         response = {}
 
@@ -243,6 +449,9 @@ class Field(models.Model):
     level = models.IntegerField(default=0)
     sample = models.JSONField(default=list)
     order = models.IntegerField(default=0)
+    # Computed at each data refresh, see project.geosource.statistics. Not
+    # updated by features written outside of a refresh.
+    statistics = models.JSONField(default=dict, blank=True)
 
     def __str__(self):
         return f"{self.name} ({self.source.name} - {self.data_type})"
@@ -643,3 +852,20 @@ class CSVSource(Source):
     @property
     def coordinates_separator(self):
         return self.settings.get("coordinates_separator")
+
+
+class GeneralizedGeometry(models.Model):
+    """Geometry of a feature simplified for the zoom band ending at `zoom`"""
+
+    feature = models.ForeignKey(
+        "geostore.Feature",
+        on_delete=models.CASCADE,
+        related_name="generalized_geometries",
+        # Features may be stored in a partitioned table, see partitioning
+        db_constraint=False,
+    )
+    zoom = models.PositiveSmallIntegerField()
+    geom = GeometryField(srid=3857)
+
+    class Meta:
+        unique_together = ["feature", "zoom"]
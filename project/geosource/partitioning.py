@@ -0,0 +1,252 @@
+"""
+Opt-in list partitioning of geostore features by layer.
+
+Once `partition_feature_table` has been run (see the `partition_features`
+command), `geostore_feature` becomes a table partitioned by `layer_id`, with
+a default partition holding every layer without dedicated storage. Large
+layers can then be moved to their own partition, with their own indexes and
+vacuum cycles.
+
+Note: primary key of a partitioned table must contain the partition key, so
+foreign keys from other tables to geostore features can't be kept at database
+level. Partitioning is refused while such foreign keys exist, unless they are
+explicitly dropped with `drop_foreign_keys`: cascade deletions are then only
+handled by Django. Generalized geometries don't have a database foreign key
+(see migration 0010), so migrations must be applied before partitioning, and
+geostore ones (feature relations and extra geometries) must be dropped.
+"""
+import logging
+
+from django.db import connection, models, transaction
+from geostore.models import Feature
+
+logger = logging.getLogger(__name__)
+
+FEATURE_TABLE = Feature._meta.db_table
+DEFAULT_PARTITION = f"{FEATURE_TABLE}_default"
+FEATURE_SEQUENCE = f"{FEATURE_TABLE}_partitioned_id_seq"
+
+
+class PartitioningError(Exception):
+    pass
+
+
+def get_partition_name(layer_pk):
+    return f"{FEATURE_TABLE}_layer_{int(layer_pk)}"
+
+
+def _table_exists(cursor, table):
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [table])
+    return cursor.fetchone()[0]
+
+
+def is_partitioned():
+    """Whether the feature table is already partitioned by layer"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relkind = 'p' FROM pg_class WHERE oid = %s::regclass",
+            [FEATURE_TABLE],
+        )
+        return cursor.fetchone()[0]
+
+
+def has_partition(layer_pk):
+    """Whether the layer features are stored in their own partition"""
+    with connection.cursor() as cursor:
+        return _table_exists(cursor, get_partition_name(layer_pk))
+
+
+def get_referencing_foreign_keys(cursor):
+    """Return table and name of foreign keys from other tables to features"""
+    cursor.execute(
+        """
+        SELECT conrelid::regclass::text, conname
+        FROM pg_constraint
+        WHERE confrelid = %s::regclass AND contype = 'f'
+        ORDER BY 1, 2
+        """,
+        [FEATURE_TABLE],
+    )
+    return cursor.fetchall()
+
+
+@transaction.atomic
+def partition_feature_table(drop_foreign_keys=False):
+    """Replace the feature table by a table partitioned by layer, keeping all data.
+
+    Every existing feature is copied in the default partition. Unique
+    constraints are kept, but foreign keys from other tables to features can't
+    be: `PartitioningError` is raised if there are any, unless
+    `drop_foreign_keys` is set.
+    """
+    if is_partitioned():
+        return False
+
+    new_table = f"{FEATURE_TABLE}_partitioned"
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {FEATURE_TABLE} IN ACCESS EXCLUSIVE MODE")
+
+        referencing_foreign_keys = get_referencing_foreign_keys(cursor)
+        if referencing_foreign_keys and not drop_foreign_keys:
+            raise PartitioningError(
+                "Foreign keys to features can't be kept on a partitioned table: "
+                + ", ".join(
+                    f"{table}.{name}" for table, name in referencing_foreign_keys
+                )
+            )
+
+        # Keep indexes, unique constraints and foreign keys to restore them
+        cursor.execute(
+            """
+            SELECT indexdef
+            FROM pg_indexes
+            WHERE tablename = %(table)s AND indexname NOT IN (
+                SELECT conname FROM pg_constraint WHERE conrelid = %(table)s::regclass
+            )
+            """,
+            {"table": FEATURE_TABLE},
+        )
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            """
+            SELECT conname, pg_get_constraintdef(oid)
+            FROM pg_constraint
+            WHERE conrelid = %s::regclass AND contype = 'f'
+            """,
+            [FEATURE_TABLE],
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute(
+            """
+            SELECT conname, pg_get_constraintdef(oid)
+            FROM pg_constraint
+            WHERE conrelid = %s::regclass AND contype = 'u'
+            """,
+            [FEATURE_TABLE],
+        )
+        unique_constraints = cursor.fetchall()
+
+        cursor.execute(
+            f"""
+            CREATE TABLE {new_table} (
+                LIKE {FEATURE_TABLE} INCLUDING CONSTRAINTS INCLUDING STORAGE
+            ) PARTITION BY LIST (layer_id)
+            """
+        )
+        cursor.execute(f"ALTER TABLE {new_table} ADD PRIMARY KEY (id, layer_id)")
+        cursor.execute(
+            f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {new_table} DEFAULT"
+        )
+
+        # Ids are kept, a new sequence continue them whether the column was
+        # a serial or an identity one
+        cursor.execute(f"CREATE SEQUENCE {FEATURE_SEQUENCE}")
+        cursor.execute(
+            f"""
+            SELECT setval(%s, COALESCE((SELECT max(id) FROM {FEATURE_TABLE}), 0) + 1, false)
+            """,
+            [FEATURE_SEQUENCE],
+        )
+        cursor.execute(
+            f"""
+            ALTER TABLE {new_table}
+            ALTER COLUMN id SET DEFAULT nextval('{FEATURE_SEQUENCE}')
+            """
+        )
+        cursor.execute(f"INSERT INTO {new_table} SELECT * FROM {FEATURE_TABLE}")
+
+        for table, name in referencing_foreign_keys:
+            logger.warning(f"Drop foreign key {name} from {table} to {FEATURE_TABLE}")
+            cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"')
+        cursor.execute(f"DROP TABLE {FEATURE_TABLE}")
+        cursor.execute(f"ALTER TABLE {new_table} RENAME TO {FEATURE_TABLE}")
+        cursor.execute(f"ALTER SEQUENCE {FEATURE_SEQUENCE} OWNED BY {FEATURE_TABLE}.id")
+
+        # Unique constraints contain the partition key, e.g. (identifier, layer_id)
+        for name, definition in unique_constraints + foreign_keys:
+            cursor.execute(
+                f"ALTER TABLE {FEATURE_TABLE} ADD CONSTRAINT {name} {definition}"
+            )
+        for definition in indexes:
+            cursor.execute(definition)
+
+    logger.info(f"{FEATURE_TABLE} is now partitioned by layer")
+    return True
+
+
+@transaction.atomic
+def create_layer_partition(layer_pk):
+    """Move features of a layer from the default partition to their own partition.
+
+    The default partition is locked while features are moved, so this is run
+    by a task or a command, never during a request.
+    """
+    if has_partition(layer_pk):
+        return False
+
+    layer_pk = int(layer_pk)
+    partition = get_partition_name(layer_pk)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {DEFAULT_PARTITION} IN ACCESS EXCLUSIVE MODE")
+        cursor.execute(
+            f"""
+            CREATE TABLE {partition} (
+                LIKE {FEATURE_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+                CHECK (layer_id = {layer_pk})
+            )
+            """
+        )
+        cursor.execute(
+            f"INSERT INTO {partition} SELECT * FROM {DEFAULT_PARTITION} WHERE layer_id = %s",
+            [layer_pk],
+        )
+        cursor.execute(
+            f"DELETE FROM {DEFAULT_PARTITION} WHERE layer_id = %s", [layer_pk]
+        )
+        cursor.execute(
+            f"""
+            ALTER TABLE {FEATURE_TABLE}
+            ATTACH PARTITION {partition} FOR VALUES IN ({layer_pk})
+            """
+        )
+
+    logger.info(f"Features of layer {layer_pk} moved to {partition}")
+    return True
+
+
+@transaction.atomic
+def drop_layer_partition(layer_pk):
+    """Drop all features of a layer at once by dropping its partition.
+
+    Rows referencing these features with a cascade deletion, and many to many
+    links to them, are deleted first, as foreign keys are not enforced by the
+    database on a partitioned table.
+    """
+    if not has_partition(layer_pk):
+        return False
+
+    for field in Feature._meta.many_to_many:
+        field.remote_field.through.objects.filter(
+            **{f"{field.m2m_field_name()}__layer": layer_pk}
+        ).delete()
+
+    for relation in Feature._meta.related_objects:
+        if relation.many_to_many:
+            relation.through.objects.filter(
+                **{f"{relation.field.m2m_reverse_field_name()}__layer": layer_pk}
+            ).delete()
+        elif (
+            relation.one_to_many or relation.one_to_one
+        ) and relation.on_delete is models.CASCADE:
+            relation.related_model.objects.filter(
+                **{f"{relation.field.name}__layer": layer_pk}
+            ).delete()
+
+    partition = get_partition_name(layer_pk)
+    with connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {FEATURE_TABLE} DETACH PARTITION {partition}")
+        cursor.execute(f"DROP TABLE {partition}")
+
+    return True
@@ -0,0 +1,11 @@
+from django.dispatch import receiver
+
+from .app_settings import GENERALIZATION_ZOOMS
+from .signals import refresh_data_done
+from .tasks import run_generalize_layer
+
+
+@receiver(refresh_data_done)
+def generalize_refreshed_layer(sender, layer, **kwargs):
+    if GENERALIZATION_ZOOMS:
+        run_generalize_layer.delay(layer)
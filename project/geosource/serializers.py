@@ -99,7 +99,7 @@ class FieldSerializer(serializers.ModelSerializer):
     class Meta:
         model = Field
         exclude = ("source",)
-        read_only_fields = ("name", "sample", "source")
+        read_only_fields = ("name", "sample", "source", "statistics")
 
 
 class SourceSerializer(PolymorphicModelSerializer):
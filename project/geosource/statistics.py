@@ -0,0 +1,180 @@
+"""
+Statistics of source fields, collected in the same pass as data ingestion.
+
+They are stored on each `Field` so style generation does not have to scan
+layer features again until the next refresh.
+"""
+import heapq
+import math
+import random
+from hashlib import blake2b
+from numbers import Number
+
+from .app_settings import STATISTICS_SAMPLE_SIZE
+
+# Number of smallest hashes kept to estimate distinct values count
+DISTINCT_SKETCH_SIZE = 1024
+# Quantiles stored, every 0.1 percent
+QUANTILE_RESOLUTION = 1000
+HISTOGRAM_BINS = 20
+
+HASH_SPACE = 2**64
+
+
+def _hash(value):
+    return int.from_bytes(blake2b(repr(value).encode(), digest_size=8).digest(), "big")
+
+
+def _to_number(value):
+    """Numeric value of a property, as cast by the database, or None"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, (Number, str)):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return None
+        return value if math.isfinite(value) else None
+    return None
+
+
+def _percentile_disc(values, ratio):
+    """First of sorted values whose rank ratio is at least `ratio`, as SQL
+    percentile_disc, so quantiles are always actual values"""
+    return values[max(math.ceil(ratio * len(values)) - 1, 0)]
+
+
+class FieldStatisticsCollector:
+    """Collect statistics of a single field values, with bounded memory"""
+
+    def __init__(self, sample_size=STATISTICS_SAMPLE_SIZE, seed=None):
+        self.sample_size = sample_size
+        # Seeded, so the same values give the same sample at each refresh
+        self.random = random.Random(seed)
+        self.not_null_count = 0
+        self.count = 0
+        self.min = self.max = None
+        self.positive_min = self.positive_max = None
+        self.sample = []
+        # Max-heap (negated) of the smallest distinct hashes
+        self._hashes = []
+        self._hashes_set = set()
+
+    def _add_hash(self, value):
+        value_hash = _hash(value)
+        if value_hash in self._hashes_set:
+            return
+        if len(self._hashes) < DISTINCT_SKETCH_SIZE:
+            heapq.heappush(self._hashes, -value_hash)
+            self._hashes_set.add(value_hash)
+        elif value_hash < -self._hashes[0]:
+            removed = -heapq.heapreplace(self._hashes, -value_hash)
+            self._hashes_set.discard(removed)
+            self._hashes_set.add(value_hash)
+
+    def add(self, value):
+        if value is None:
+            return
+        self.not_null_count += 1
+        self._add_hash(value)
+
+        value = _to_number(value)
+        if value is None:
+            return
+
+        self.count += 1
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        if value > 0:
+            self.positive_min = (
+                value if self.positive_min is None else min(self.positive_min, value)
+            )
+            self.positive_max = (
+                value if self.positive_max is None else max(self.positive_max, value)
+            )
+
+        # Reservoir sampling
+        if len(self.sample) < self.sample_size:
+            self.sample.append(value)
+        else:
+            index = self.random.randrange(self.count)
+            if index < self.sample_size:
+                self.sample[index] = value
+
+    @property
+    def distinct(self):
+        if len(self._hashes) < DISTINCT_SKETCH_SIZE:
+            return len(self._hashes)
+        return round((DISTINCT_SKETCH_SIZE - 1) * HASH_SPACE / -self._hashes[0])
+
+    def get_quantiles(self, values):
+        return [
+            _percentile_disc(values, i / QUANTILE_RESOLUTION)
+            for i in range(QUANTILE_RESOLUTION + 1)
+        ]
+
+    def get_histogram(self, values):
+        if self.min == self.max:
+            return [self.count]
+        width = (self.max - self.min) / HISTOGRAM_BINS
+        bins = [0] * HISTOGRAM_BINS
+        for value in values:
+            bins[min(int((value - self.min) / width), HISTOGRAM_BINS - 1)] += 1
+        # Scale sample counts to the whole values
+        scale = self.count / len(values)
+        return [round(count * scale) for count in bins]
+
+    def get_statistics(self, total):
+        statistics = {
+            "total": total,
+            "null_count": total - self.not_null_count,
+            "distinct": self.distinct,
+            "count": self.count,
+        }
+        if self.count:
+            values = sorted(self.sample)
+            statistics.update(
+                {
+                    "min": self.min,
+                    "max": self.max,
+                    "positive_min": self.positive_min,
+                    "positive_max": self.positive_max,
+                    # Number of values quantiles are computed from
+                    "sample_size": len(values),
+                    "quantiles": [
+                        self.min,
+                        *self.get_quantiles(values)[1:-1],
+                        self.max,
+                    ],
+                    "histogram": self.get_histogram(values),
+                }
+            )
+        return statistics
+
+
+class StatisticsCollector:
+    """Collect statistics of every field of the ingested records.
+
+    Fields samples are seeded from `seed`, e.g. the source pk, and their name.
+    """
+
+    def __init__(self, sample_size=STATISTICS_SAMPLE_SIZE, seed=None):
+        self.sample_size = sample_size
+        self.seed = seed
+        self.total = 0
+        self.fields = {}
+
+    def add(self, properties):
+        self.total += 1
+        for name, value in properties.items():
+            if name not in self.fields:
+                self.fields[name] = FieldStatisticsCollector(
+                    self.sample_size, seed=f"{self.seed}-{name}"
+                )
+            self.fields[name].add(value)
+
+    def get_statistics(self, name):
+        collector = self.fields.get(name) or FieldStatisticsCollector(self.sample_size)
+        return collector.get_statistics(self.total)
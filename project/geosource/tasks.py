@@ -59,3 +59,29 @@ def run_auto_refresh_source(*args, **kwargs):
     from project.geosource.periodics import auto_refresh_source
 
     auto_refresh_source()
+
+
+@shared_task(bind=True)
+def run_delete_layer_features(self, layer_pk):
+    from project.geosource.geostore_callbacks import delete_layer_features
+
+    def progress(deleted, total):
+        self.update_state(
+            state=states.STARTED, meta={"deleted": deleted, "total": total}
+        )
+
+    return delete_layer_features(layer_pk, progress=progress)
+
+
+@shared_task
+def run_generalize_layer(layer_pk):
+    from project.geosource.generalization import generalize_layer
+
+    return generalize_layer(layer_pk)
+
+
+@shared_task
+def run_create_layer_partition(layer_pk):
+    from project.geosource.partitioning import create_layer_partition
+
+    return create_layer_partition(layer_pk)
@@ -8,6 +8,7 @@ from geostore import GeometryTypes
 from rest_framework import status
 from rest_framework.test import APITestCase
 
+from project.geosource import geostore_callbacks
 from project.geosource.models import (
     CommandSource,
     Field,
@@ -85,6 +86,29 @@ class ModelSourceViewsetTestCase(APITestCase):
             )
         self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @patch("project.geosource.tasks.run_delete_layer_features.delay")
+    def test_retrieve_deleted_source_status(self, mock_delay):
+        source_pk = self.source_geojson.pk
+        layer = self.source_geojson.get_layer()
+        url = reverse("geosource:geosource-detail", args=[source_pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.source_geojson.delete()
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.json(),
+            {
+                "id": source_pk,
+                "status": {"state": "PENDING", "deleted": 0, "total": None},
+            },
+        )
+
+        # Purged
+        geostore_callbacks.delete_layer_features(layer.pk)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_refresh_view_accepted(self):
         with patch(
             "project.geosource.mixins.CeleryCallMethodsMixin.run_async_method",
@@ -1,9 +1,12 @@
+from io import StringIO
 from unittest import mock
 
-from django.core.management import call_command
+from django.core.management import CommandError, call_command
 from django.test import TestCase
+from geostore.models import Feature
 from rest_framework.exceptions import MethodNotAllowed
 
+from project.geosource import partitioning
 from project.geosource.models import GeoJSONSource, GeometryTypes
 from project.geosource.tests.helpers import get_file
 
@@ -93,3 +96,69 @@ class ResyncAllSourcesTestCase(TestCase):
             ):
                 call_command("resync_all_sources", force=True)
         mocked.assert_called_once()
+
+
+class PartitionFeaturesTestCase(TestCase):
+    def setUp(self):
+        self.source = GeoJSONSource.objects.create(
+            name="test",
+            geom_type=GeometryTypes.Point,
+            file=get_file("test.geojson"),
+        )
+        self.source.refresh_data()
+        self.layer = self.source.get_layer()
+
+    def test_partition_features(self):
+        out = StringIO()
+        call_command(
+            "partition_features",
+            layers=[self.layer.pk],
+            drop_foreign_keys=True,
+            stdout=out,
+        )
+
+        self.assertTrue(partitioning.is_partitioned())
+        self.assertTrue(partitioning.has_partition(self.layer.pk))
+        self.assertIn(
+            f"Layer {self.layer.pk} moved to its own partition", out.getvalue()
+        )
+        self.assertEqual(self.layer.features.count(), 1)
+
+        # Refresh still updates features stored in the partition
+        self.source.refresh_data()
+        self.assertEqual(self.layer.features.count(), 1)
+
+    def test_partition_features_with_foreign_keys(self):
+        # Geostore feature relations and extra geometries reference features
+        with self.assertRaises(CommandError):
+            call_command("partition_features", stdout=StringIO())
+
+        self.assertFalse(partitioning.is_partitioned())
+
+    def test_delete_partitioned_layer(self):
+        call_command(
+            "partition_features",
+            min_features=1,
+            drop_foreign_keys=True,
+            stdout=StringIO(),
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.source.delete()
+        self.assertFalse(partitioning.has_partition(self.layer.pk))
+        self.assertFalse(Feature.objects.filter(layer_id=self.layer.pk).exists())
+
+    def test_partition_new_layer(self):
+        call_command("partition_features", drop_foreign_keys=True, stdout=StringIO())
+        source = GeoJSONSource.objects.create(
+            name="other",
+            geom_type=GeometryTypes.Point,
+            file=get_file("test.geojson"),
+        )
+
+        with mock.patch(
+            "project.geosource.geostore_callbacks.PARTITION_NEW_LAYERS", True
+        ), self.captureOnCommitCallbacks(execute=True):
+            source.refresh_data()
+
+        self.assertTrue(partitioning.has_partition(source.get_layer().pk))
@@ -0,0 +1,100 @@
+import inspect
+from importlib.metadata import version
+from unittest import mock
+
+from django.contrib.gis.geos import GEOSGeometry
+from django.test import SimpleTestCase, TestCase
+from geostore import GeometryTypes
+from geostore.models import Layer
+from geostore.tiles.helpers import VectorTile
+from geostore.tiles.mixins import MVTViewMixin
+
+from project.geosource.generalization import (
+    GeneralizedVectorTile,
+    generalize_layer,
+    get_tolerance,
+    get_zoom_band,
+)
+from project.geosource.models import GeneralizedGeometry
+from project.geosource.signals import refresh_data_done
+
+
+class GeneralizationTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.layer = Layer.objects.create(
+            name="polygons", geom_type=GeometryTypes.Polygon
+        )
+        cls.feature = cls.layer.features.create(
+            identifier="1",
+            geom=GEOSGeometry(
+                "POLYGON ((0 0, 0.5 0.00001, 1 0, 1 1, 0 1, 0 0))", srid=4326
+            ),
+            properties={},
+        )
+
+    def test_get_zoom_band(self):
+        zooms = [12, 6, 9]
+        self.assertEqual(get_zoom_band(3, zooms), 6)
+        self.assertEqual(get_zoom_band(6, zooms), 6)
+        self.assertEqual(get_zoom_band(7, zooms), 9)
+        self.assertIsNone(get_zoom_band(13, zooms))
+        self.assertIsNone(get_zoom_band(3, []))
+
+    def test_get_tolerance(self):
+        self.assertAlmostEqual(get_tolerance(0), 39135.758, places=3)
+        self.assertAlmostEqual(get_tolerance(1), get_tolerance(0) / 2)
+
+    def test_generalize_layer(self):
+        self.assertEqual(generalize_layer(self.layer.pk, [6, 12]), {"count": 2})
+        generalized = GeneralizedGeometry.objects.get(feature=self.feature, zoom=6)
+        self.assertEqual(generalized.geom.srid, 3857)
+        self.assertEqual(generalized.geom.num_points, 5)
+
+        # Previous generalized geometries are replaced
+        self.assertEqual(generalize_layer(self.layer.pk, [6]), {"count": 1})
+        self.assertEqual(self.feature.generalized_geometries.count(), 1)
+
+    def test_generalize_point_layer(self):
+        layer = Layer.objects.create(name="points", geom_type=GeometryTypes.Point)
+        layer.features.create(
+            identifier="1", geom=GEOSGeometry("POINT (0 0)", srid=4326)
+        )
+        self.assertEqual(generalize_layer(layer.pk, [6, 12]), {"count": 0})
+
+    def test_generalized_tile(self):
+        generalize_layer(self.layer.pk, [6])
+        with mock.patch("project.geosource.generalization.GENERALIZATION_ZOOMS", [6]):
+            count, tile = GeneralizedVectorTile(self.layer).get_tile(0, 0, 0)
+        self.assertEqual(count, 1)
+        self.assertTrue(tile)
+
+    @mock.patch("project.geosource.receivers.run_generalize_layer.delay")
+    def test_refresh_data_done(self, mocked_delay):
+        refresh_data_done.send_robust(sender=None, layer=self.layer.pk)
+        mocked_delay.assert_not_called()
+
+        with mock.patch("project.geosource.receivers.GENERALIZATION_ZOOMS", [6]):
+            refresh_data_done.send_robust(sender=None, layer=self.layer.pk)
+        mocked_delay.assert_called_once_with(self.layer.pk)
+
+
+class GeostoreCompatibilityTestCase(SimpleTestCase):
+    """Generalized tiles override geostore internals, that must not change"""
+
+    def test_geostore_version(self):
+        self.assertEqual(version("django-geostore"), "0.7.0")
+
+    def test_overridden_signatures(self):
+        self.assertEqual(
+            str(inspect.signature(VectorTile._simplify)),
+            "(self, layer_query, pixel_width_x, pixel_width_y)",
+        )
+        self.assertEqual(
+            str(inspect.signature(VectorTile.get_tile)),
+            "(self, x, y, z, *args, **kwargs)",
+        )
+        self.assertEqual(
+            str(inspect.signature(MVTViewMixin.get_tile_for_layer)),
+            "(self, layer, z, x, y, name=None, features_pk=None)",
+        )
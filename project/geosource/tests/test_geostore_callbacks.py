@@ -83,4 +83,55 @@ class GeostoreCallBacksTestCase(TestCase):
         )
         layer = Layer.objects.create(name="test")
         Feature.objects.create(layer=layer, geom=GEOSGeometry("POINT (0 0)"))
-        geostore_callbacks.delete_layer(source)
+        with self.captureOnCommitCallbacks(execute=True):
+            geostore_callbacks.delete_layer(source)
+        self.assertFalse(Layer.objects.filter(pk=layer.pk).exists())
+        self.assertEqual(Feature.objects.count(), 0)
+
+    @mock.patch("project.geosource.tasks.run_delete_layer_features.delay")
+    def test_delete_layer_detach(self, mock_delay):
+        source = GeoJSONSource.objects.create(
+            name="test",
+            geom_type=GeometryTypes.Point,
+            file=get_file("test.geojson"),
+        )
+        layer = source.get_layer()
+        with self.captureOnCommitCallbacks(execute=True):
+            geostore_callbacks.delete_layer(source)
+            mock_delay.assert_not_called()
+        mock_delay.assert_called_once_with(layer.pk)
+
+        layer.refresh_from_db()
+        self.assertTrue(layer.name.startswith(geostore_callbacks.DELETED_LAYER_PREFIX))
+        self.assertFalse(layer.layer_groups.exists())
+        self.assertEqual(
+            geostore_callbacks.get_deletion_status(source.pk),
+            {"state": "PENDING", "deleted": 0, "total": None},
+        )
+
+    def test_delete_layer_features_by_batch(self):
+        layer = Layer.objects.create(name="test")
+        for i in range(5):
+            Feature.objects.create(layer=layer, geom=GEOSGeometry(f"POINT ({i} 0)"))
+        progress = mock.MagicMock()
+
+        result = geostore_callbacks.delete_layer_features(
+            layer.pk, batch_size=2, progress=progress
+        )
+
+        self.assertEqual(result, {"deleted": 5, "total": 5})
+        self.assertEqual(
+            [c.args for c in progress.call_args_list], [(2, 5), (4, 5), (5, 5)]
+        )
+        self.assertFalse(Layer.objects.filter(pk=layer.pk).exists())
+
+    def test_delete_layer_features_already_purged(self):
+        layer = Layer.objects.create(name="test")
+        layer_pk = layer.pk
+        geostore_callbacks.delete_layer_features(layer_pk)
+
+        # Retried task
+        self.assertEqual(
+            geostore_callbacks.delete_layer_features(layer_pk),
+            {"deleted": 0, "total": 0},
+        )
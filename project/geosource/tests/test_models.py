@@ -2,6 +2,7 @@ import json
 from io import StringIO
 from unittest import mock
 
+from django.contrib.gis.geos import GEOSGeometry
 from django.test import TestCase
 from geostore.models import Layer
 
@@ -11,6 +12,8 @@ from project.geosource.models import (
     Field,
     GeoJSONSource,
     GeometryTypes,
+    InvalidGeometriesError,
+    InvalidGeometryPolicy,
     PostGISSource,
     ShapefileSource,
     Source,
@@ -112,7 +115,8 @@ class ModelSourceTestCase(TestCase):
     def test_delete(self):
         self.geojson_source.refresh_data()
         self.assertEqual(Layer.objects.count(), 1)
-        self.geojson_source.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.geojson_source.delete()
         self.assertEqual(Layer.objects.count(), 0)
 
     @mock.patch("project.geosource.models.AsyncResult", new=MockAsyncResultSucess)
@@ -412,3 +416,200 @@ class ModelCSVSourceTestCase(TestCase):
         source.update_fields()
         fields = [f.name for f in Field.objects.filter(source=source)]
         self.assertTrue(fields == colnames)
+
+
+@mock.patch(
+    "project.geosource.models.Source._get_records",
+    mock.MagicMock(
+        side_effect=lambda *args: [
+            {
+                "_geom_": GEOSGeometry(
+                    "POLYGON ((0 0, 1 1, 1 0, 0 1, 0 0))", srid=4326
+                ),
+                "id": 1,
+            },
+            {
+                "_geom_": GEOSGeometry("POLYGON ((0 0, 1 0, 1 1, 0 0))", srid=4326),
+                "id": 2,
+            },
+        ]
+    ),
+)
+class ModelSourceInvalidGeometryTestCase(TestCase):
+    def test_refresh_data_repair_invalid_geometry_by_default(self):
+        # Database refuses invalid geometries, existing sources repair them
+        source = Source.objects.create(name="Toto", geom_type=GeometryTypes.Polygon)
+
+        self.assertEqual(source.refresh_data(), {"count": 2, "total": 2})
+        self.assertEqual(
+            source.report["geometries"], {"invalid": 1, "repaired": 1, "dropped": 0}
+        )
+        self.assertEqual(source.get_layer().features.count(), 2)
+
+    def test_refresh_data_fail_on_invalid_geometry(self):
+        source = Source.objects.create(
+            name="Toto",
+            geom_type=GeometryTypes.Polygon,
+            invalid_geometry=InvalidGeometryPolicy.Fail.value,
+        )
+
+        with self.assertRaises(InvalidGeometriesError):
+            source.refresh_data()
+
+        source.refresh_from_db()
+        self.assertEqual(source.report["status"], "Error")
+        self.assertEqual(source.report["geometries"]["invalid"], 1)
+        self.assertFalse(source.get_layer().features.exists())
+
+    def test_refresh_data_repair_invalid_geometry(self):
+        source = Source.objects.create(
+            name="Toto",
+            geom_type=GeometryTypes.Polygon,
+            invalid_geometry=InvalidGeometryPolicy.Repair.value,
+        )
+
+        self.assertEqual(source.refresh_data(), {"count": 2, "total": 2})
+        self.assertEqual(
+            source.report["geometries"], {"invalid": 1, "repaired": 1, "dropped": 0}
+        )
+        self.assertTrue(
+            all(feature.geom.valid for feature in source.get_layer().features.all())
+        )
+
+    def test_refresh_data_drop_invalid_geometry(self):
+        source = Source.objects.create(
+            name="Toto",
+            geom_type=GeometryTypes.Polygon,
+            invalid_geometry=InvalidGeometryPolicy.Drop.value,
+        )
+
+        self.assertEqual(source.refresh_data(), {"count": 1, "total": 2})
+        self.assertEqual(source.report["status"], "Warning")
+        self.assertEqual(
+            source.report["geometries"], {"invalid": 1, "repaired": 0, "dropped": 1}
+        )
+
+
+@mock.patch(
+    "project.geosource.models.Source._get_records",
+    mock.MagicMock(
+        side_effect=lambda *args: [
+            {
+                "_geom_": GEOSGeometry(
+                    "LINESTRING (0.123456 0, 0.5 0.0001, 1 0)", srid=4326
+                ),
+                "id": 1,
+            },
+        ]
+    ),
+)
+class ModelSourceGeneralizationTestCase(TestCase):
+    def test_refresh_data_without_generalization(self):
+        source = Source.objects.create(name="Toto", geom_type=GeometryTypes.LineString)
+
+        source.refresh_data()
+        self.assertNotIn("size", source.report)
+        self.assertEqual(
+            source.get_layer().features.get().geom.coords,
+            ((0.123456, 0), (0.5, 0.0001), (1, 0)),
+        )
+
+    @mock.patch(
+        "project.geosource.models.Source._get_records",
+        mock.MagicMock(
+            side_effect=lambda *args: [
+                {
+                    "_geom_": GEOSGeometry(
+                        "POLYGON ((0 0, 4 0, 4 4, 2 0.4, 0 4, 0 0))", srid=4326
+                    ),
+                    "id": 1,
+                },
+            ]
+        ),
+    )
+    def test_refresh_data_snap_keeps_geometries_valid(self):
+        # Snapped spike touches the bottom edge of the ring
+        source = Source.objects.create(
+            name="Toto",
+            geom_type=GeometryTypes.Polygon,
+            coordinate_precision=1,
+            invalid_geometry=InvalidGeometryPolicy.Fail.value,
+        )
+
+        self.assertEqual(source.refresh_data(), {"count": 1, "total": 1})
+        self.assertNotIn("geometries", source.report)
+        geom = source.get_layer().features.get().geom
+        self.assertTrue(geom.valid)
+        self.assertEqual(geom.area, 8)
+
+    def test_refresh_data_snap_and_simplify(self):
+        source = Source.objects.create(
+            name="Toto",
+            geom_type=GeometryTypes.LineString,
+            coordinate_precision=0.001,
+            simplify_tolerance=0.01,
+        )
+
+        source.refresh_data()
+        self.assertEqual(
+            source.get_layer().features.get().geom.coords, ((0.123, 0), (1, 0))
+        )
+        size = source.report["size"]
+        self.assertGreater(size["saved"], 0)
+        self.assertEqual(size["saved"], size["before"] - size["after"])
+
+
+@mock.patch(
+    "project.geosource.models.Source._get_records",
+    mock.MagicMock(
+        side_effect=lambda *args: [
+            {"_geom_": GEOSGeometry("POINT (0 0)", srid=4326), "id": 1, "a": 1},
+            {"_geom_": GEOSGeometry("POINT (1 0)", srid=4326), "id": 2, "a": 3},
+            {"_geom_": GEOSGeometry("POINT (2 0)", srid=4326), "id": 3, "a": None},
+        ]
+    ),
+)
+class ModelSourceFieldStatisticsTestCase(TestCase):
+    def test_refresh_data_update_fields_statistics(self):
+        source = Source.objects.create(name="Toto", geom_type=GeometryTypes.Point)
+        source.update_fields()
+
+        source.refresh_data()
+        statistics = source.fields.get(name="a").statistics
+        self.assertEqual(statistics["total"], 3)
+        self.assertEqual(statistics["null_count"], 1)
+        self.assertEqual(statistics["count"], 2)
+        self.assertEqual(statistics["distinct"], 2)
+        self.assertEqual((statistics["min"], statistics["max"]), (1, 3))
+        self.assertEqual(statistics["quantiles"][500], 1)
+        self.assertEqual(source.fields.get(name="id").statistics["distinct"], 3)
+
+    @mock.patch(
+        "project.geosource.models.Source._get_records",
+        mock.MagicMock(
+            side_effect=lambda *args: [
+                {"_geom_": GEOSGeometry("POINT (0 0)", srid=4326), "id": 1, "a": 1},
+                {"_geom_": GEOSGeometry("POINT (1 0)", srid=4326), "id": 2, "a": 3},
+                {"_geom_": GEOSGeometry("POINT (1 0)", srid=4326), "id": 2, "a": 3},
+                {"_geom_": GEOSGeometry("POINT (2 0)", srid=4326), "id": 3, "a": -1},
+            ]
+        ),
+    )
+    def test_refresh_data_statistics_of_stored_features(self):
+        source = Source.objects.create(name="Toto", geom_type=GeometryTypes.Point)
+        source.update_fields()
+        update_feature = Source.update_feature
+
+        def reject_negative(self, layer, identifier, geometry, row):
+            if row["a"] < 0:
+                return None
+            return update_feature(self, layer, identifier, geometry, row)
+
+        with mock.patch.object(Source, "update_feature", reject_negative):
+            source.refresh_data()
+
+        self.assertEqual(source.get_layer().features.count(), 2)
+        statistics = source.fields.get(name="a").statistics
+        self.assertEqual(statistics["total"], 2)
+        self.assertEqual(statistics["count"], 2)
+        self.assertEqual((statistics["min"], statistics["max"]), (1, 3))
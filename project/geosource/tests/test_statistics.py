@@ -0,0 +1,66 @@
+from django.test import SimpleTestCase
+
+from project.geosource.statistics import (
+    DISTINCT_SKETCH_SIZE,
+    HISTOGRAM_BINS,
+    StatisticsCollector,
+)
+
+
+class StatisticsCollectorTestCase(SimpleTestCase):
+    def test_numeric_statistics(self):
+        collector = StatisticsCollector()
+        for value in [-2, 0, 2, "4", 6, None, "foo", True]:
+            collector.add({"a": value})
+
+        statistics = collector.get_statistics("a")
+        self.assertEqual(statistics["total"], 8)
+        self.assertEqual(statistics["null_count"], 1)
+        self.assertEqual(statistics["count"], 5)
+        self.assertEqual(statistics["distinct"], 7)
+        self.assertEqual((statistics["min"], statistics["max"]), (-2, 6))
+        self.assertEqual(
+            (statistics["positive_min"], statistics["positive_max"]), (2, 6)
+        )
+        self.assertEqual(statistics["quantiles"][::250], [-2, 0, 2, 4, 6])
+        self.assertEqual(statistics["sample_size"], 5)
+        self.assertEqual(len(statistics["histogram"]), HISTOGRAM_BINS)
+        self.assertEqual(sum(statistics["histogram"]), 5)
+
+    def test_missing_field(self):
+        collector = StatisticsCollector()
+        collector.add({"a": 1})
+        collector.add({"b": "foo"})
+
+        self.assertEqual(
+            collector.get_statistics("b"),
+            {"total": 2, "null_count": 1, "distinct": 1, "count": 0},
+        )
+        self.assertEqual(collector.get_statistics("c")["null_count"], 2)
+
+    def test_sampled_statistics(self):
+        collector = StatisticsCollector(sample_size=100)
+        for value in range(DISTINCT_SKETCH_SIZE * 10):
+            collector.add({"a": value})
+
+        statistics = collector.get_statistics("a")
+        self.assertEqual(statistics["count"], DISTINCT_SKETCH_SIZE * 10)
+        self.assertEqual(statistics["quantiles"][0], 0)
+        self.assertEqual(statistics["quantiles"][-1], DISTINCT_SKETCH_SIZE * 10 - 1)
+        self.assertEqual(statistics["sample_size"], 100)
+        # Quantiles are sampled values, not interpolated ones
+        self.assertTrue(
+            all(isinstance(value, int) for value in statistics["quantiles"])
+        )
+        self.assertAlmostEqual(
+            statistics["distinct"], DISTINCT_SKETCH_SIZE * 10, delta=1000
+        )
+
+    def test_sampled_statistics_are_deterministic(self):
+        def get_quantiles():
+            collector = StatisticsCollector(sample_size=100, seed=1)
+            for value in range(10000):
+                collector.add({"a": value})
+            return collector.get_statistics("a")["quantiles"]
+
+        self.assertEqual(get_quantiles(), get_quantiles())
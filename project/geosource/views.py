@@ -1,9 +1,11 @@
+from django.http import Http404
 from rest_framework import status
 from rest_framework.decorators import action
 from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
 
+from .geostore_callbacks import get_deletion_status
 from .models import Source
 from .parsers import NestedMultipartJSONParser
 from .permissions import SourcePermission
@@ -35,6 +37,17 @@ class SourceModelViewset(ModelViewSet):
     def get_queryset(self):
         return self.model.objects.all()
 
+    def retrieve(self, request, *args, **kwargs):
+        """Returns the source, or the purge status of a deleted source's data"""
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            pk = self.kwargs[self.lookup_field]
+            deletion_status = get_deletion_status(int(pk)) if pk.isdigit() else None
+            if deletion_status is None:
+                raise
+            return Response({"id": int(pk), "status": deletion_status})
+
     @action(detail=True, methods=["get"])
     def refresh(self, request, pk):
         """Schedule a refresh now"""
@@ -8,3 +8,7 @@ class AppConfig(PermissionRegistrationMixin, BaseAppConfig):
     name = "project.terra_layer"
     verbose_name = "ViewLayer"
     permissions = (("DataLayer", "can_manage_layers", "Can manage layers"),)
+
+    def ready(self):
+        super().ready()
+        from . import receivers  # NOQA
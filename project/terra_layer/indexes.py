@@ -0,0 +1,213 @@
+"""
+Partial expression indexes on geostore feature properties.
+
+Properties used by wizard styles are evaluated as numbers by style statistics
+and discretization queries, with `terra_layer_numeric(properties->>'field')`:
+an immutable cast giving NULL for values that are not numbers, so indexing it
+never makes a feature write fail. Properties used by enabled filters are
+compared as text, with `properties->>'field'`. For each of them an index on
+the same expression, restricted to the layer features, is maintained.
+
+Indexes are built concurrently, not to block feature writes, unless in a
+transaction, where it is not possible. Once features are partitioned by layer,
+indexes are built on the partition storing the layer features, as they can't
+be built concurrently on the partitioned table.
+"""
+import logging
+from hashlib import md5
+
+from django.db import DatabaseError, connection, transaction
+from geostore.models import Feature
+from geostore.models import Layer as GeoLayer
+from psycopg2 import sql
+
+from project.geosource import partitioning
+from project.geosource.models import Source
+
+from .models import FilterField
+from .style.utils import get_variable_fields
+
+logger = logging.getLogger(__name__)
+
+FEATURE_TABLE = Feature._meta.db_table
+INDEX_PREFIX = f"{FEATURE_TABLE}_pidx_"
+
+NUMERIC = "n"
+TEXT = "t"
+EXPRESSIONS = {
+    NUMERIC: "terra_layer_numeric(properties->>{})",
+    TEXT: "(properties->>{})",
+}
+
+
+def get_index_name(layer_pk, field, kind=NUMERIC):
+    digest = md5(field.encode("utf-8")).hexdigest()[:12]
+    return f"{INDEX_PREFIX}{int(layer_pk)}_{kind}_{digest}"
+
+
+def get_layer_table(layer_pk):
+    """Return the table, or the partition, storing features of a layer"""
+    if not partitioning.is_partitioned():
+        return FEATURE_TABLE
+    if partitioning.has_partition(layer_pk):
+        return partitioning.get_partition_name(layer_pk)
+    return partitioning.DEFAULT_PARTITION
+
+
+def get_used_fields(source):
+    """Return properties of a source used by layer styles, and by filters"""
+    styled = set()
+    for layer in source.layers.prefetch_related("extra_styles"):
+        styled |= get_variable_fields(layer.main_style)
+        for extra_style in layer.extra_styles.all():
+            styled |= get_variable_fields(extra_style.style_config)
+
+    filtered = set(
+        FilterField.objects.filter(field__source=source, filter_enable=True)
+        .values_list("field__name", flat=True)
+        .distinct()
+    )
+    return styled, filtered
+
+
+def get_wanted_indexes(source, layer_pk):
+    """Return {index name: (kind, property)} of indexes a source layer needs"""
+    styled, filtered = get_used_fields(source)
+    return {
+        **{
+            get_index_name(layer_pk, field, NUMERIC): (NUMERIC, field)
+            for field in styled
+        },
+        **{get_index_name(layer_pk, field, TEXT): (TEXT, field) for field in filtered},
+    }
+
+
+def get_existing_indexes(layer_pk=None):
+    """Return {name: table} of valid managed indexes, of a layer or of all layers"""
+    prefix = INDEX_PREFIX if layer_pk is None else f"{INDEX_PREFIX}{int(layer_pk)}_"
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT indexname, tablename
+            FROM pg_indexes
+            JOIN pg_class ON pg_class.relname = indexname
+            JOIN pg_index ON pg_index.indexrelid = pg_class.oid
+            WHERE
+                starts_with(tablename, %s)
+                AND starts_with(indexname, %s)
+                AND indisvalid
+            """,
+            [FEATURE_TABLE, prefix],
+        )
+        return dict(cursor.fetchall())
+
+
+def create_index(name, layer_pk, kind, field):
+    concurrently = not connection.in_atomic_block
+    # A failed concurrent build leaves an invalid index
+    drop_index(name)
+
+    query = sql.SQL("CREATE INDEX {} {} ON {} (({})) WHERE layer_id = {}").format(
+        sql.SQL("CONCURRENTLY" if concurrently else ""),
+        sql.Identifier(name),
+        sql.Identifier(get_layer_table(layer_pk)),
+        sql.SQL(EXPRESSIONS[kind]).format(sql.Literal(field)),
+        sql.Literal(int(layer_pk)),
+    )
+    try:
+        if concurrently:
+            # Can't run in a transaction, nor block writes of the feature table
+            with connection.cursor() as cursor:
+                cursor.execute(query)
+        else:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.execute(query)
+    except DatabaseError as err:
+        logger.warning(f"Index {name} on {field} can't be created: {err}")
+        if concurrently:
+            drop_index(name)
+        return False
+    return True
+
+
+def drop_index(name):
+    with connection.cursor() as cursor:
+        # Indexes of a partitioned table, copied when partitioning features,
+        # can't be dropped concurrently
+        cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s", [name])
+        row = cursor.fetchone()
+        partitioned = row is not None and row[0] == "I"
+        concurrently = not connection.in_atomic_block and not partitioned
+        cursor.execute(
+            sql.SQL("DROP INDEX {} IF EXISTS {}").format(
+                sql.SQL("CONCURRENTLY" if concurrently else ""), sql.Identifier(name)
+            )
+        )
+
+
+def sync_source_indexes(source):
+    """Create missing indexes of the source layer, and drop unused ones"""
+    # Layer is not created here, a source without layer has no feature
+    geo_layer = GeoLayer.objects.filter(name=source.slug).first()
+    if geo_layer is None:
+        return {"created": [], "dropped": []}
+
+    wanted = get_wanted_indexes(source, geo_layer.pk)
+    existing = get_existing_indexes(geo_layer.pk)
+    # Indexes not on the table storing the layer features, e.g. left on the
+    # default partition after the layer got its own, are built again
+    table = get_layer_table(geo_layer.pk)
+    placed = {name for name, index_table in existing.items() if index_table == table}
+
+    dropped = sorted(existing.keys() - wanted.keys())
+    for name in dropped:
+        drop_index(name)
+
+    created = [
+        name
+        for name in sorted(wanted.keys() - placed)
+        if create_index(name, geo_layer.pk, *wanted[name])
+    ]
+    return {"created": created, "dropped": dropped}
+
+
+def sync_all_indexes():
+    """Sync indexes of every source, and drop indexes of deleted layers"""
+    created, dropped = [], []
+    for source in Source.objects.all():
+        result = sync_source_indexes(source)
+        created += result["created"]
+        dropped += result["dropped"]
+
+    layer_pks = set(GeoLayer.objects.values_list("pk", flat=True))
+    for name in sorted(get_existing_indexes()):
+        layer_pk = name.removeprefix(INDEX_PREFIX).split("_", 1)[0]
+        if not layer_pk.isdigit() or int(layer_pk) not in layer_pks:
+            drop_index(name)
+            dropped.append(name)
+    return {"created": created, "dropped": dropped}
+
+
+def get_indexes_usage():
+    """Return size and usage statistics of every managed index"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT
+                indexrelname,
+                pg_relation_size(indexrelid),
+                idx_scan,
+                idx_tup_read
+            FROM
+                pg_stat_user_indexes
+            WHERE
+                starts_with(relname, %s) AND starts_with(indexrelname, %s)
+            ORDER BY
+                indexrelname
+            """,
+            [FEATURE_TABLE, INDEX_PREFIX],
+        )
+        return [
+            {"name": name, "size": size, "scans": scans, "tuples_read": tuples}
+            for name, size, scans, tuples in cursor.fetchall()
+        ]
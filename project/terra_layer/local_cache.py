@@ -0,0 +1,73 @@
+"""
+Per-process LRU cache, in front of the shared cache for hot read endpoints.
+
+Entries are stored under versioned cache keys, so they are never invalidated:
+an update gives new keys, and old entries are evicted as least recently used.
+"""
+import pickle
+import threading
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+from .settings import LOCAL_CACHE_MAX_BYTES, LOCAL_CACHE_MAX_ENTRIES
+
+
+def get_size(value):
+    """Approximate memory size of a value, in bytes"""
+    return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+
+
+class LocalCache:
+    """Thread safe LRU cache, bounded by entries count and by size"""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            self.entries.move_to_end(key)
+            return self.entries[key][0]
+
+    def set(self, key, value):
+        size = get_size(value)
+        if size > self.max_bytes or not self.max_entries:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.size += size
+
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self.size -= self.entries.popitem(last=False)[1][1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+local_cache = LocalCache(LOCAL_CACHE_MAX_ENTRIES, LOCAL_CACHE_MAX_BYTES)
+
+
+def get_or_set(key, default):
+    """
+    Like `cache.get_or_set`, with values kept in the local cache.
+
+    :param key: A versioned cache key, changed by any update of the value
+    :param default: The callable computing the value
+    :return: The cached value, that must not be modified
+    """
+    value = local_cache.get(key)
+    if value is None:
+        value = cache.get_or_set(key, default)
+        local_cache.set(key, value)
+    return value
@@ -0,0 +1,169 @@
+import json
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from geostore import GeometryTypes
+from geostore.models import Layer as GeoLayer
+
+from project.terra_layer.style import generate_style_from_wizard
+
+DEFAULT_SIZES = [10000, 100000, 1000000, 5000000]
+CATEGORIES = 50
+COLORS = ["#fff5eb", "#fdd0a2", "#fd8d3c", "#d94801", "#7f2704"]
+
+# Style configs by benchmark name, on "value" (numeric) and "category" fields
+BENCHMARKS = {
+    **{
+        f"graduated_{method}": {
+            "map_style_type": "circle",
+            "style": {
+                "circle_color": {
+                    "type": "variable",
+                    "field": "value",
+                    "analysis": "graduated",
+                    "method": method,
+                    "values": COLORS,
+                    "generate_legend": True,
+                },
+            },
+        }
+        for method in ("quantile", "jenks", "equal_interval")
+    },
+    "categorized": {
+        "map_style_type": "circle",
+        "style": {
+            "circle_color": {
+                "type": "variable",
+                "field": "category",
+                "analysis": "categorized",
+                "categories": [
+                    {"name": f"category {index}", "value": COLORS[index % len(COLORS)]}
+                    for index in range(CATEGORIES)
+                ],
+                "generate_legend": True,
+            },
+        },
+    },
+    "proportionnal": {
+        "map_style_type": "circle",
+        "style": {
+            "circle_radius": {
+                "type": "variable",
+                "field": "value",
+                "analysis": "proportionnal",
+                "max_radius": 50,
+                "generate_legend": True,
+            },
+        },
+    },
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Time style generation of each analysis on synthetic layers, "
+        "and write results as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--size",
+            dest="sizes",
+            type=int,
+            action="append",
+            help=f"Number of features of a synthetic layer (default: {DEFAULT_SIZES})",
+        )
+        parser.add_argument(
+            "--benchmark",
+            dest="benchmarks",
+            action="append",
+            choices=BENCHMARKS.keys(),
+            help="Benchmark to run (default: all)",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=3,
+            help="Number of runs of each benchmark, the fastest is kept",
+        )
+        parser.add_argument(
+            "--output",
+            help="JSON file where results are written (default: standard output)",
+        )
+
+    def create_layer(self, size):
+        """Create a layer of points, with a skewed numeric property, and a
+        categorical one. Values are the same at each run."""
+        geo_layer = GeoLayer.objects.create(
+            name=f"benchmark-{uuid.uuid4()}", geom_type=GeometryTypes.Point
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT setseed(0.42)")
+            cursor.execute(
+                """
+                INSERT INTO geostore_feature
+                    (created_at, updated_at, layer_id, identifier, geom, properties)
+                SELECT
+                    now(),
+                    now(),
+                    %(layer_id)s,
+                    i::text,
+                    ST_SetSRID(ST_MakePoint(random() * 10 - 5, random() * 10 + 40), 4326),
+                    jsonb_build_object(
+                        'value', CASE WHEN i %% 100 = 0 THEN NULL
+                            ELSE round((exp(random() * 10))::numeric, 2) END,
+                        'category', 'category ' || (i %% %(categories)s)
+                    )
+                FROM
+                    generate_series(1, %(size)s) AS i
+                """,
+                {"layer_id": geo_layer.pk, "size": size, "categories": CATEGORIES},
+            )
+            cursor.execute("ANALYZE geostore_feature")
+        return geo_layer
+
+    def run_benchmark(self, geo_layer, name, repeat):
+        config = {"type": "wizard", "uid": name, **BENCHMARKS[name]}
+        timings = []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                generate_style_from_wizard(geo_layer, config)
+                timings.append(time.perf_counter() - start)
+        return {"time": min(timings), "queries": len(queries)}
+
+    def handle(self, **options):
+        sizes = options["sizes"] or DEFAULT_SIZES
+        benchmarks = options["benchmarks"] or list(BENCHMARKS)
+
+        results = []
+        for size in sizes:
+            # Synthetic layers are never kept
+            with transaction.atomic():
+                self.stderr.write(f"Creating a layer of {size} features...")
+                geo_layer = self.create_layer(size)
+                for name in benchmarks:
+                    result = self.run_benchmark(geo_layer, name, options["repeat"])
+                    self.stderr.write(
+                        f"{name} on {size} features: {result['time']:.3f}s, "
+                        f"{result['queries']} queries"
+                    )
+                    results.append({"benchmark": name, "size": size, **result})
+                transaction.set_rollback(True)
+
+        output = json.dumps(
+            {
+                "database": connection.pg_version,
+                "repeat": options["repeat"],
+                "results": results,
+            },
+            indent=2,
+        )
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                output_file.write(output)
+        else:
+            self.stdout.write(output)
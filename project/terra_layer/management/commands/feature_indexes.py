@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from project.terra_layer import indexes
+
+
+class Command(BaseCommand):
+    help = "Report size and usage of feature properties indexes, and sync them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sync",
+            action="store_true",
+            help="create indexes needed by styles and filters, and drop unused ones",
+        )
+
+    def handle(self, **options):
+        if options.get("sync"):
+            result = indexes.sync_all_indexes()
+            for name in result["created"]:
+                self.stdout.write(self.style.SUCCESS(f"Index {name} created"))
+            for name in result["dropped"]:
+                self.stdout.write(f"Index {name} dropped")
+
+        usages = indexes.get_indexes_usage()
+        if not usages:
+            self.stdout.write("No feature properties index")
+            return
+
+        for usage in usages:
+            self.stdout.write(
+                f"{usage['name']}: {filesizeformat(usage['size'])}, "
+                f"{usage['scans']} scans, {usage['tuples_read']} tuples read"
+            )
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from project.terra_layer.models import Scene
+from project.terra_layer.views import LayerView
+
+
+class Command(BaseCommand):
+    help = "Build and cache layer trees of every scene, typically after a deploy"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scene",
+            dest="scenes",
+            action="append",
+            help="Slug of a scene to warm (default: all)",
+        )
+
+    def handle(self, **options):
+        scenes = Scene.objects.order_by("order", "name")
+        if options["scenes"]:
+            scenes = scenes.filter(slug__in=options["scenes"])
+
+        for scene in scenes:
+            trees = LayerView.warm_cache(scene)
+            self.stdout.write(f"{scene.name}: {trees} layer trees cached")
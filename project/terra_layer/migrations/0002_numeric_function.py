@@ -0,0 +1,27 @@
+# Generated by Django 4.1.6 on 2026-10-19 19:02
+
+from django.db import migrations
+
+# Numeric value of a text, or NULL when it is not a number. Immutable, so it
+# can be used in indexes of feature properties.
+CREATE_NUMERIC_FUNCTION = r"""
+CREATE OR REPLACE FUNCTION terra_layer_numeric(value text) RETURNS numeric AS $$
+    SELECT CASE
+        WHEN value ~ '^\s*[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d{1,2})?\s*$'
+        THEN value::numeric
+    END
+$$ LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+"""
+
+DROP_NUMERIC_FUNCTION = "DROP FUNCTION IF EXISTS terra_layer_numeric(text)"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("terra_layer", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunSQL(CREATE_NUMERIC_FUNCTION, DROP_NUMERIC_FUNCTION),
+    ]
@@ -1,8 +1,7 @@
 import uuid
+from collections import defaultdict
 from hashlib import md5
 
-from django.contrib.auth.models import Group
-from django.core.cache import cache
 from django.db import models, transaction
 from django.utils.functional import cached_property
 from django.utils.text import slugify
@@ -12,8 +11,11 @@ from rest_framework.reverse import reverse
 from project.geosource.models import Field, Source
 
 from .schema import SCENE_LAYERTREE, JSONSchemaValidator
+from .settings import AUTO_INDEXES
 from .style import generate_style_from_wizard
-from .utils import get_layer_group_cache_key
+from .style.utils import get_variable_fields
+from .tasks import run_sync_source_indexes
+from .utils import bump_scenes_generation
 
 
 class Scene(models.Model):
@@ -37,50 +39,97 @@ class Scene(models.Model):
     def get_absolute_url(self):
         return reverse("scene-detail", args=[self.pk])
 
-    def tree2models(self, current_node=None, parent=None, order=0):
+    @transaction.atomic
+    def tree2models(self):
         """
         Generate groups structure from admin layer tree.
-        This is a recursive function to handle each step of process.
 
-        :param current_node: current node of the tree
-        :param parent: The parent group of current node
-        :param order: Current order to keep initial json order
+        Existing groups are matched by parent and label, so only changed groups
+        and layers are written, level by level, and layer trees are invalidated once.
+
         :returns: Nothing
         """
+        # Existing groups by parent and label, in tree order
+        existing_groups = defaultdict(lambda: defaultdict(list))
+        roots = []
+        for group in self.layer_groups.order_by("order", "pk"):
+            if group.parent_id is None:
+                roots.append(group)
+            else:
+                existing_groups[group.parent_id][group.label].append(group)
 
-        # Init case, we've just launch the process
-        if current_node is None:
-            current_node = self.tree
-            self.layer_groups.all().delete()  # Clear all groups to generate brand new one
-
-        if not parent:
+        if roots:
+            root = roots[0]
+        else:
             # Create a default unique parent group that is ignored at export
-            parent = LayerGroup.objects.create(view=self, label="Root")
-
-        if isinstance(current_node, list):
-            for idx, child in enumerate(current_node):
-                self.tree2models(current_node=child, parent=parent, order=idx)
-
-        elif "group" in current_node:
-            # Handle groups
-            group = parent.children.create(
-                view=self,
-                label=current_node["label"],
-                exclusive=current_node.get("exclusive", False),
-                selectors=current_node.get("selectors"),
-                settings=current_node.get("settings", {}),
-                order=order,
-            )
-
-            if "children" in current_node:
-                self.tree2models(current_node=current_node["children"], parent=group)
-
-        elif "geolayer" in current_node:
-            # Handle layers
-            layer = Layer.objects.get(pk=current_node["geolayer"])
-            layer.group = parent
-            layer.order = order
-            layer.save(wizard_update=False)
+            root = LayerGroup.objects.create(view=self, label="Root")
+
+        kept_groups = {root.pk}
+        changed_groups = []
+        layer_positions = {}
+
+        level = [(self.tree, root)]
+        while level:
+            created_groups = []
+            next_level = []
+            for nodes, parent in level:
+                for order, node in enumerate(nodes):
+                    if "group" in node:
+                        values = {
+                            "label": node["label"],
+                            "exclusive": node.get("exclusive", False),
+                            "selectors": node.get("selectors"),
+                            "settings": node.get("settings", {}),
+                            "order": order,
+                        }
+                        matches = existing_groups[parent.pk][node["label"]]
+                        if matches:
+                            group = matches.pop(0)
+                            kept_groups.add(group.pk)
+                            if any(getattr(group, k) != v for k, v in values.items()):
+                                for key, value in values.items():
+                                    setattr(group, key, value)
+                                changed_groups.append(group)
+                        else:
+                            group = LayerGroup(view=self, parent=parent, **values)
+                            created_groups.append(group)
+
+                        if "children" in node:
+                            next_level.append((node["children"], group))
+
+                    elif "geolayer" in node:
+                        layer_positions[node["geolayer"]] = (parent, order)
+
+            # Children need their parent id
+            LayerGroup.objects.bulk_create(created_groups)
+            level = next_level
+
+        LayerGroup.objects.bulk_update(
+            changed_groups, ["label", "exclusive", "selectors", "settings", "order"]
+        )
+        self.layer_groups.exclude(pk__in=kept_groups).delete()
+
+        # Layers of the tree, and layers removed from it
+        layers = Layer.objects.filter(
+            models.Q(pk__in=layer_positions) | models.Q(group__view=self)
+        ).select_related("group")
+        missing = layer_positions.keys() - {layer.pk for layer in layers}
+        if missing:
+            raise Layer.DoesNotExist(f"Layers {sorted(missing)} don't exist")
+
+        scene_pks = {self.pk}
+        changed_layers = []
+        for layer in layers:
+            group, order = layer_positions.get(layer.pk, (None, layer.order))
+            if layer.group_id != getattr(group, "pk", None) or layer.order != order:
+                if layer.group:
+                    scene_pks.add(layer.group.view_id)
+                layer.group = group
+                layer.order = order
+                changed_layers.append(layer)
+        Layer.objects.bulk_update(changed_layers, ["group", "order"])
+
+        bump_scenes_generation(scene_pks)
 
     def insert_in_tree(self, layer, parts, group_config=None):
         """Add the layer in tree. Each parts are a group name to find inside the tree.
@@ -197,12 +246,15 @@ class Layer(models.Model):
     class Meta:
         ordering = ("order", "name")
 
-    def generate_style_and_legend(self, style_config):
+    def generate_style_and_legend(self, style_config, variable_only=False):
         # Add uid to style if missing
         if style_config and "uid" not in style_config:
             style_config["uid"] = str(uuid.uuid4())
 
         if style_config.get("type") == "wizard":
+            if variable_only and not get_variable_fields(style_config):
+                # Style doesn't depend on data
+                return []
             generated_map_style, legend_additions = generate_style_from_wizard(
                 self.source.get_layer(), style_config
             )
@@ -211,96 +263,110 @@ class Layer(models.Model):
 
         return []
 
+    def update_styles(self, preserve_legend=False, variable_only=False):
+        """Generate wizard styles and update their auto legends.
+
+        With variable_only, styles without variable property are kept as is.
+        """
+        style_by_uid = {}
+        # Mark not updated auto legends
+        [
+            legend.update({"not_updated": True})
+            for legend in self.legends
+            if legend.get("auto")
+        ]
+        legend_additions = self.generate_style_and_legend(
+            self.main_style, variable_only
+        )
+        if self.main_style:
+            style_by_uid[self.main_style["uid"]] = self.main_style
+
+        for extra_style in self.extra_styles.all():
+            legend_additions += self.generate_style_and_legend(
+                extra_style.style_config, variable_only
+            )
+            if extra_style.style_config:
+                style_by_uid[extra_style.style_config["uid"]] = extra_style.style_config
+            extra_style.save()
+
+        all_legends = list(self.legends)
+        for legend_addition in legend_additions:
+            found = False
+            for legend in all_legends:
+                if legend.get("uid") == legend_addition["uid"]:
+                    # Update found legend with addition
+                    legend.update(legend_addition)
+                    del legend["not_updated"]
+                    found = True
+                    break
+            if not found:
+                # Add legend to legends
+                legend_addition["title"] = f"{self.name}"
+                legend_addition["auto"] = True
+                self.legends.append(legend_addition)
+
+        # Update legend auto status and clean unused legends
+        kept_legend = []
+        for legend in self.legends:
+            # Do we remove that legend ?
+            if legend.get("auto") and legend.get("not_updated"):
+                if not preserve_legend:
+                    continue
+
+                # Here we try to keep deactivated legends
+                style_uid, style_prop = legend["uid"].split("__")
+
+                if style_uid not in style_by_uid:
+                    # Style is dropped, we remove that legend
+                    continue
+
+                prop_config = style_by_uid[style_uid]["style"].get(style_prop)
+
+                if not prop_config:
+                    # Style prop is dropped, we remove that legend
+                    continue
+
+                if prop_config["type"] in ["fixed", "none"]:
+                    # Legend not needed anymore for this field
+                    continue
+
+                # Here We've just need to deactivate the legend
+                del legend["auto"]
+                legend["uid"] = str(uuid.uuid4())
+                del legend["not_updated"]
+
+            kept_legend.append(legend)
+
+        self.legends = kept_legend
+
+    def has_variable_styles(self):
+        return bool(get_variable_fields(self.main_style)) or any(
+            get_variable_fields(extra_style.style_config)
+            for extra_style in self.extra_styles.all()
+        )
+
+    def refresh_styles(self):
+        """Regenerate styles depending on source data, after a data refresh"""
+        if not self.has_variable_styles():
+            return False
+        self.update_styles(preserve_legend=True, variable_only=True)
+        # Avoid save side effects, layer trees are invalidated by caller
+        Layer.objects.filter(pk=self.pk).update(
+            main_style=self.main_style, legends=self.legends
+        )
+        return True
+
     def save(self, wizard_update=True, preserve_legend=False, **kwargs):
         super().save(**kwargs)
 
         if wizard_update:
-            style_by_uid = {}
-            # Mark not updated auto legends
-            [
-                legend.update({"not_updated": True})
-                for legend in self.legends
-                if legend.get("auto")
-            ]
-            legend_additions = self.generate_style_and_legend(self.main_style)
-            if self.main_style:
-                style_by_uid[self.main_style["uid"]] = self.main_style
-
-            for extra_style in self.extra_styles.all():
-                legend_additions += self.generate_style_and_legend(
-                    extra_style.style_config
-                )
-                if extra_style.style_config:
-                    style_by_uid[
-                        extra_style.style_config["uid"]
-                    ] = extra_style.style_config
-                extra_style.save()
-
-            all_legends = list(self.legends)
-            for legend_addition in legend_additions:
-                found = False
-                for legend in all_legends:
-                    if legend.get("uid") == legend_addition["uid"]:
-                        # Update found legend with addition
-                        legend.update(legend_addition)
-                        del legend["not_updated"]
-                        found = True
-                        break
-                if not found:
-                    # Add legend to legends
-                    legend_addition["title"] = f"{self.name}"
-                    legend_addition["auto"] = True
-                    self.legends.append(legend_addition)
-
-            # Update legend auto status and clean unused legends
-            kept_legend = []
-            for legend in self.legends:
-                # Do we remove that legend ?
-                if legend.get("auto") and legend.get("not_updated"):
-                    if not preserve_legend:
-                        continue
-
-                    # Here we try to keep deactivated legends
-                    style_uid, style_prop = legend["uid"].split("__")
-
-                    if style_uid not in style_by_uid:
-                        # Style is dropped, we remove that legend
-                        continue
-
-                    prop_config = style_by_uid[style_uid]["style"].get(style_prop)
-
-                    if not prop_config:
-                        # Style prop is dropped, we remove that legend
-                        continue
-
-                    if prop_config["type"] in ["fixed", "none"]:
-                        # Legend not needed anymore for this field
-                        continue
-
-                    # Here We've just need to deactivate the legend
-                    del legend["auto"]
-                    legend["uid"] = str(uuid.uuid4())
-                    del legend["not_updated"]
+            self.update_styles(preserve_legend=preserve_legend)
 
-                kept_legend.append(legend)
-
-            self.legends = kept_legend
-
-        # Invalidate cache for layer group
-        if self.group:
-            cache.delete(get_layer_group_cache_key(self.group.view))
-
-            # deleting cache for Groups
-            groups = self.source.settings.get("groups", [])
-            for group in Group.objects.filter(id__in=groups):
-                cache.delete(
-                    get_layer_group_cache_key(
-                        self.group.view,
-                        [
-                            group.name,
-                        ],
-                    )
-                )
+        if AUTO_INDEXES:
+            # Styled and filtered properties may have changed, indexes are
+            # synced once nested filter fields and styles are saved too
+            source_pk = self.source_id
+            transaction.on_commit(lambda: run_sync_source_indexes.delay(source_pk))
 
     def __str__(self):
         return f"Layer({self.id}) - {self.name}"
@@ -0,0 +1,69 @@
+"""
+Pre-rendered JSON payloads.
+
+Payloads are rendered to JSON bytes once, with their compressed variants, so
+they can be stored in cache and served again without being serialized nor
+compressed at each request.
+"""
+import gzip
+from hashlib import md5
+
+import brotli
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.renderers import JSONRenderer
+
+# Supported content encodings, by order of preference
+ENCODINGS = ("br", "gzip")
+
+
+def render_json(data):
+    """Render data as the JSON API renderer does"""
+    return JSONRenderer().render(data)
+
+
+def compress(content, encoding):
+    if encoding == "br":
+        return brotli.compress(content)
+    # Fixed mtime, so the same content always gives the same bytes
+    return gzip.compress(content, mtime=0)
+
+
+def build_payload(content, encodings=ENCODINGS):
+    """Return JSON content with its ETag, and its variants compressed with
+    encodings. Other encodings are compressed when a response needs them.
+    """
+    return {
+        "content": content,
+        "etag": f'W/"{md5(content).hexdigest()}"',
+        **{encoding: compress(content, encoding) for encoding in encodings},
+    }
+
+
+def get_accepted_encoding(request):
+    """Return the preferred supported encoding accepted by the client, if any"""
+    accepted = set()
+    for part in request.META.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        encoding, *params = [value.strip() for value in part.split(";")]
+        if not any(param.replace(" ", "") in ("q=0", "q=0.0") for param in params):
+            accepted.add(encoding.lower())
+
+    for encoding in ENCODINGS:
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+def get_payload_response(request, payload):
+    """Return a response serving the payload, compressed if the client accepts it"""
+    encoding = get_accepted_encoding(request)
+    content = payload["content"]
+    if encoding:
+        content = payload.get(encoding) or compress(content, encoding)
+
+    response = HttpResponse(content, content_type="application/json")
+    response["ETag"] = payload["etag"]
+    if encoding:
+        response["Content-Encoding"] = encoding
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
@@ -0,0 +1,133 @@
+from django.db.models import Q
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+from geostore.models import Layer as GeoLayer
+from mapbox_baselayer.models import MapBaseLayer
+
+from project.geosource.models import Source
+from project.geosource.signals import refresh_data_done
+
+from .models import CustomStyle, FilterField, Layer, LayerGroup, Scene
+from .settings import AUTO_INDEXES, AUTO_REFRESH_STYLES
+from .tasks import run_refresh_source_styles, run_sync_source_indexes
+from .utils import bump_scenes_generation
+
+
+def get_refreshed_sources(layer):
+    return Source.objects.filter(
+        slug__in=GeoLayer.objects.filter(pk=layer).values("name")
+    ).values_list("pk", flat=True)
+
+
+def get_source_scenes(source_pks):
+    return (
+        Scene.objects.filter(
+            Q(layer_groups__layers__source__in=source_pks)
+            | Q(layer_groups__layers__extra_styles__source__in=source_pks)
+        )
+        .values_list("pk", flat=True)
+        .distinct()
+    )
+
+
+def get_layer_scenes(layer_pk):
+    return LayerGroup.objects.filter(layers=layer_pk).values_list("view", flat=True)
+
+
+@receiver(refresh_data_done)
+def sync_refreshed_source_indexes(sender, layer, **kwargs):
+    # Field statistics changed, numeric indexes may have to be created or dropped
+    if not AUTO_INDEXES:
+        return
+    for source_pk in get_refreshed_sources(layer):
+        run_sync_source_indexes.delay(source_pk)
+
+
+@receiver(refresh_data_done)
+def refresh_source_styles(sender, layer, **kwargs):
+    # Classes and legends of variable style properties depend on data
+    if not AUTO_REFRESH_STYLES:
+        return
+    for source_pk in get_refreshed_sources(layer):
+        run_refresh_source_styles.delay(source_pk)
+
+
+@receiver(refresh_data_done)
+def invalidate_refreshed_source_scenes(sender, layer, **kwargs):
+    bump_scenes_generation(get_source_scenes(list(get_refreshed_sources(layer))))
+
+
+@receiver([post_save, post_delete], sender=Scene)
+def invalidate_scene(sender, instance, **kwargs):
+    bump_scenes_generation([instance.pk])
+
+
+@receiver(m2m_changed, sender=Scene.baselayer.through)
+def invalidate_scene_baselayers(sender, instance, action, pk_set, **kwargs):
+    if action.startswith("post_"):
+        bump_scenes_generation(
+            [instance.pk] if isinstance(instance, Scene) else pk_set or []
+        )
+
+
+@receiver([post_save, pre_delete], sender=MapBaseLayer)
+def invalidate_baselayer_scenes(sender, instance, **kwargs):
+    # Before deletion, while scenes are still linked
+    bump_scenes_generation(
+        Scene.objects.filter(baselayer=instance).values_list("pk", flat=True)
+    )
+
+
+@receiver(pre_save, sender=Layer)
+def keep_layer_previous_group(sender, instance, **kwargs):
+    # Scene of the previous group must be invalidated too when a layer is moved
+    instance._previous_group_id = (
+        Layer.objects.filter(pk=instance.pk).values_list("group", flat=True).first()
+        if instance.pk
+        else None
+    )
+
+
+@receiver([post_save, post_delete], sender=Layer)
+def invalidate_layer_scene(sender, instance, **kwargs):
+    group_pks = {instance.group_id, getattr(instance, "_previous_group_id", None)}
+    group_pks.discard(None)
+    if group_pks:
+        bump_scenes_generation(
+            LayerGroup.objects.filter(pk__in=group_pks)
+            .values_list("view", flat=True)
+            .distinct()
+        )
+
+
+@receiver([post_save, post_delete], sender=CustomStyle)
+@receiver([post_save, post_delete], sender=FilterField)
+def invalidate_layer_content_scene(sender, instance, **kwargs):
+    bump_scenes_generation(get_layer_scenes(instance.layer_id))
+
+
+def get_source_models():
+    """Return the source model and all its subclasses"""
+    models = [Source]
+    for model in models:
+        models.extend(model.__subclasses__())
+    return models
+
+
+def invalidate_source_scenes(sender, instance, update_fields=None, **kwargs):
+    # Refresh reports are not served in layer trees
+    if update_fields is not None and set(update_fields) == {"report"}:
+        return
+    bump_scenes_generation(get_source_scenes([instance.pk]))
+
+
+# Sources are polymorphic, signals are sent by each source model
+for source_model in get_source_models():
+    post_save.connect(invalidate_source_scenes, sender=source_model)
+    post_delete.connect(invalidate_source_scenes, sender=source_model)
@@ -6,7 +6,10 @@ from rest_framework.fields import SerializerMethodField
 from rest_framework.reverse import reverse
 from rest_framework.serializers import ModelSerializer, PrimaryKeyRelatedField
 
+from project.geosource.models import Source
+
 from .models import CustomStyle, FilterField, Layer, Scene
+from .settings import DEFAULT_HISTOGRAM_BINS
 
 
 class SceneListSerializer(ModelSerializer):
@@ -135,3 +138,21 @@ class LayerDetailSerializer(ModelSerializer):
     class Meta:
         model = Layer
         fields = "__all__"
+
+
+class StylePreviewSerializer(serializers.Serializer):
+    source = PrimaryKeyRelatedField(queryset=Source.objects.all())
+    style_config = serializers.JSONField()
+
+    def validate_style_config(self, value):
+        if not isinstance(value, dict) or value.get("type") != "wizard":
+            raise serializers.ValidationError("Only wizard styles can be previewed")
+        return value
+
+
+class HistogramSerializer(serializers.Serializer):
+    source = PrimaryKeyRelatedField(queryset=Source.objects.all())
+    field = serializers.CharField()
+    bins = serializers.IntegerField(
+        min_value=1, max_value=1000, default=DEFAULT_HISTOGRAM_BINS
+    )
@@ -6,3 +6,35 @@ default_settings = getattr(settings, "TERRA_LAYER_STYLE_SETTINGS", {})
 DEFAULT_CIRCLE_MIN_LEGEND_HEIGHT = default_settings.get("circle_min_legend_height", 14)
 DEFAULT_SIZE_MIN_LEGEND_HEIGHT = default_settings.get("size_min_legend_height", 1)
 DEFAULT_NO_VALUE_FILL_COLOR = default_settings.get("no_value_fill_color", "#000000")
+# Max number of values used to compute Jenks natural breaks, evenly sampled on larger layers.
+DEFAULT_JENKS_SAMPLE_SIZE = default_settings.get("jenks_sample_size", 3000)
+# Features count above which quantiles are computed from a sample, with a max rank error.
+DEFAULT_APPROX_QUANTILE_THRESHOLD = default_settings.get(
+    "approx_quantile_threshold", 1000000
+)
+DEFAULT_APPROX_QUANTILE_ERROR = default_settings.get("approx_quantile_error", 0.01)
+# Bins of field histograms shown by the style wizard.
+DEFAULT_HISTOGRAM_BINS = default_settings.get("histogram_bins", 20)
+
+# Maintain partial expression indexes on feature properties used by styles and filters.
+AUTO_INDEXES = getattr(settings, "TERRA_LAYER_AUTO_INDEXES", True)
+# Regenerate styles depending on data in background after each source refresh.
+AUTO_REFRESH_STYLES = getattr(settings, "TERRA_LAYER_AUTO_REFRESH_STYLES", True)
+# Validity of tiles tokens in seconds, layer trees of authenticated users are revalidated more often.
+TILES_TOKEN_TIMEOUT = getattr(settings, "TOKEN_TIMEOUT", 3600)
+# Layer trees are rebuilt by one request at once, holding a lock for at most this many seconds.
+CACHE_LOCK_TIMEOUT = getattr(settings, "TERRA_LAYER_CACHE_LOCK_TIMEOUT", 30)
+# Seconds other requests wait for the rebuilt tree, when there is no stale tree to serve.
+CACHE_LOCK_WAIT = getattr(settings, "TERRA_LAYER_CACHE_LOCK_WAIT", 5)
+# Seconds the last built tree is kept, to be served while a new one is built.
+CACHE_STALE_TIMEOUT = getattr(settings, "TERRA_LAYER_CACHE_STALE_TIMEOUT", 86400)
+# Rebuild layer trees in background after invalidation, once for all the invalidations of this many seconds.
+AUTO_WARM_CACHE = getattr(settings, "TERRA_LAYER_AUTO_WARM_CACHE", True)
+WARM_CACHE_DELAY = getattr(settings, "TERRA_LAYER_WARM_CACHE_DELAY", 10)
+# Number of the last authorization profiles of a scene warmed, besides the public one.
+WARM_CACHE_PROFILES = getattr(settings, "TERRA_LAYER_WARM_CACHE_PROFILES", 10)
+# Bounds of the per-process cache of layer trees and settings, in entries and in bytes.
+LOCAL_CACHE_MAX_ENTRIES = getattr(settings, "TERRA_LAYER_LOCAL_CACHE_MAX_ENTRIES", 32)
+LOCAL_CACHE_MAX_BYTES = getattr(
+    settings, "TERRA_LAYER_LOCAL_CACHE_MAX_BYTES", 32 * 1024 * 1024
+)
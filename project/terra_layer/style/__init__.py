@@ -1,7 +1,10 @@
+import logging
+
 from project.terra_layer.settings import DEFAULT_NO_VALUE_FILL_COLOR
 
 from .all import gen_categorized_any_legend, gen_categorized_any_style
 from .color import gen_graduated_color_legend, gen_graduated_color_style
+from .expressions import compact_style
 from .radius import gen_proportionnal_radius_legend, gen_proportionnal_radius_style
 from .size import (
     gen_graduated_size_legend,
@@ -9,7 +12,13 @@ from .size import (
     gen_proportionnal_size_legend,
     gen_proportionnal_size_style,
 )
-from .utils import get_style_no_value_condition, style_type_2_legend_property
+from .utils import (
+    FieldStatistics,
+    get_style_no_value_condition,
+    style_type_2_legend_property,
+)
+
+logger = logging.getLogger(__name__)
 
 
 def to_map_style(prop):
@@ -71,6 +80,7 @@ def generate_style_from_wizard(geo_layer, config):
         map_style["weight"] = config["weight"]
 
     legends = []
+    statistics = FieldStatistics(geo_layer)
 
     for map_field, prop_config in config["style"].items():
         style_type = prop_config.get("type", "none")
@@ -102,7 +112,11 @@ def generate_style_from_wizard(geo_layer, config):
                     map_style.setdefault(paint_or_layout, {})[
                         map_style_prop
                     ] = gen_graduated_color_style(
-                        geo_layer, data_field, map_field, prop_config
+                        geo_layer,
+                        data_field,
+                        map_field,
+                        prop_config,
+                        statistics=statistics,
                     )
                     if prop_config.get("generate_legend"):
                         legend = gen_graduated_color_legend(
@@ -111,9 +125,9 @@ def generate_style_from_wizard(geo_layer, config):
                             map_style_type,
                             prop_config,
                             style_type_2_legend_property(map_field),
+                            statistics=statistics,
                         )
                         legend["uid"] = f"{suid}__{map_field}"
-                        # TODO reuse previous computations
                         legends.append(legend)
                 elif analysis == "categorized":
                     map_style.setdefault(paint_or_layout, {})[
@@ -172,7 +186,11 @@ def generate_style_from_wizard(geo_layer, config):
                     map_style.setdefault(paint_or_layout, {})[
                         map_style_prop
                     ] = gen_proportionnal_radius_style(
-                        geo_layer, data_field, map_field, prop_config
+                        geo_layer,
+                        data_field,
+                        map_field,
+                        prop_config,
+                        statistics=statistics,
                     )
                     # Add sort key
                     # TODO find more smart way to do that
@@ -180,7 +198,6 @@ def generate_style_from_wizard(geo_layer, config):
                         f"{map_style_type}-sort-key": ["-", ["get", data_field]]
                     }
                     if prop_config.get("generate_legend"):
-                        # TODO reuse previous computations
                         color = (
                             config["style"]
                             .get(f"{map_style_type}_color", {})
@@ -198,6 +215,7 @@ def generate_style_from_wizard(geo_layer, config):
                             prop_config,
                             color,
                             no_value_color,
+                            statistics=statistics,
                         )
                         legend["uid"] = f"{suid}__{map_field}"
                         legends.append(legend)
@@ -209,10 +227,13 @@ def generate_style_from_wizard(geo_layer, config):
                     map_style.setdefault(paint_or_layout, {})[
                         map_style_prop
                     ] = gen_graduated_size_style(
-                        geo_layer, data_field, map_field, prop_config
+                        geo_layer,
+                        data_field,
+                        map_field,
+                        prop_config,
+                        statistics=statistics,
                     )
                     if prop_config.get("generate_legend"):
-                        # TODO reuse previous computations
                         color = (
                             config["style"]
                             .get(f"{map_style_type}_color", {})
@@ -231,6 +252,7 @@ def generate_style_from_wizard(geo_layer, config):
                             color,
                             no_value_color,
                             style_type_2_legend_property(map_field),
+                            statistics=statistics,
                         )
                         legend["uid"] = f"{suid}__{map_field}"
                         legends.append(legend)
@@ -266,10 +288,13 @@ def generate_style_from_wizard(geo_layer, config):
                     map_style.setdefault(paint_or_layout, {})[
                         map_style_prop
                     ] = gen_proportionnal_size_style(
-                        geo_layer, data_field, map_field, prop_config
+                        geo_layer,
+                        data_field,
+                        map_field,
+                        prop_config,
+                        statistics=statistics,
                     )
                     if prop_config.get("generate_legend"):
-                        # TODO reuse previous computations
                         color = (
                             config["style"]
                             .get(f"{map_style_type}_color", {})
@@ -288,10 +313,17 @@ def generate_style_from_wizard(geo_layer, config):
                             color,
                             no_value_color,
                             style_type_2_legend_property(map_field),
+                            statistics=statistics,
                         )
                         legend["uid"] = f"{suid}__{map_field}"
                         legends.append(legend)
                 else:
                     raise ValueError(f'Unknow analysis type "{analysis}"')
 
+    map_style, report = compact_style(map_style)
+    if report["saved"]:
+        logger.debug(
+            f"Style {suid} compacted from {report['before']} to {report['after']} bytes"
+        )
+
     return (map_style, legends)
@@ -1,5 +1,5 @@
 from .utils import (
-    discretize,
+    FieldStatistics,
     gen_style_steps,
     get_style_no_value_condition,
     style_type_2_legend_shape,
@@ -40,7 +40,10 @@ def gen_color_legend_steps(boundaries, colors, no_value_color, legend_field="col
     return ret
 
 
-def gen_graduated_color_style(geo_layer, data_field, map_field, prop_config):
+def gen_graduated_color_style(
+    geo_layer, data_field, map_field, prop_config, statistics=None
+):
+    statistics = statistics or FieldStatistics(geo_layer)
     colors = prop_config["values"]
     no_value = prop_config.get("no_value")
 
@@ -50,8 +53,8 @@ def gen_graduated_color_style(geo_layer, data_field, map_field, prop_config):
         if len(boundaries) < 2:
             raise ValueError('"boundaries" must be at least a list of two values')
     elif "method" in prop_config:
-        boundaries = discretize(
-            geo_layer, data_field, prop_config["method"], len(colors)
+        boundaries = statistics.discretize(
+            data_field, prop_config["method"], len(colors)
         )
     else:
         raise ValueError(
@@ -74,8 +77,9 @@ def gen_graduated_color_style(geo_layer, data_field, map_field, prop_config):
 
 
 def gen_graduated_color_legend(
-    geo_layer, data_field, map_style_type, prop_config, legend_field
+    geo_layer, data_field, map_style_type, prop_config, legend_field, statistics=None
 ):
+    statistics = statistics or FieldStatistics(geo_layer)
     colors = prop_config["values"]
     no_value = prop_config.get("no_value")
 
@@ -83,8 +87,8 @@ def gen_graduated_color_legend(
     if "boundaries" in prop_config:
         boundaries = prop_config["boundaries"]
     elif "method" in prop_config:
-        boundaries = discretize(
-            geo_layer, data_field, prop_config["method"], len(colors)
+        boundaries = statistics.discretize(
+            data_field, prop_config["method"], len(colors)
         )
 
     # Use boundaries to make style
@@ -0,0 +1,128 @@
+"""
+Compaction of generated Mapbox GL style expressions.
+
+Categorized styles produce one label/output pair per category, while many
+categories often share the same output. Labels with identical outputs are
+grouped in label arrays, labels giving the fallback output are dropped, and
+`case` wrappers that can't change the result are removed.
+"""
+import json
+
+# Operators whose arguments are not expressions
+LITERAL_OPERATORS = ("literal",)
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(",", ":"), sort_keys=True)
+
+
+def _is_expression(value):
+    return isinstance(value, list) and bool(value) and isinstance(value[0], str)
+
+
+def compact_match(expression):
+    """
+    ["match", input, label1, output1, label2, output1, ..., fallback]
+    -> ["match", input, [label1, label2], output1, ..., fallback]
+    """
+    input_value, *branches, fallback = expression[1:]
+    fallback_key = _dumps(fallback)
+
+    outputs = {}
+    seen = set()
+    for labels, output in zip(branches[::2], branches[1::2]):
+        output_key = _dumps(output)
+        for label in labels if isinstance(labels, list) else [labels]:
+            # First branch matching a label wins
+            if label in seen:
+                continue
+            seen.add(label)
+            if output_key != fallback_key:
+                outputs.setdefault(output_key, (output, []))[1].append(label)
+
+    if not outputs:
+        return fallback
+
+    compacted = ["match", input_value]
+    for output, labels in outputs.values():
+        compacted += [labels if len(labels) > 1 else labels[0], output]
+    compacted.append(fallback)
+    return compacted
+
+
+def _is_has_wrapper(condition, output, fallback):
+    """
+    ["case", ["has", field], ["match", ["get", field], ..., fallback], fallback]
+    is the match alone, as a missing property never matches a label.
+    """
+    return (
+        _is_expression(condition)
+        and condition[0] == "has"
+        and len(condition) == 2
+        and _is_expression(output)
+        and output[0] == "match"
+        and output[1] == ["get", condition[1]]
+        and _dumps(output[-1]) == _dumps(fallback)
+    )
+
+
+def compact_case(expression):
+    *branches, fallback = expression[1:]
+    branches = list(zip(branches[::2], branches[1::2]))
+
+    # Only trailing branches can be dropped without changing previous ones
+    while branches:
+        condition, output = branches[-1]
+        if _dumps(output) == _dumps(fallback):
+            branches.pop()
+        elif _is_has_wrapper(condition, output, fallback):
+            branches.pop()
+            fallback = output
+        else:
+            break
+
+    if not branches:
+        return fallback
+
+    compacted = ["case"]
+    for condition, output in branches:
+        compacted += [condition, output]
+    compacted.append(fallback)
+    return compacted
+
+
+def compact_expression(expression):
+    """Return an equivalent and smaller expression"""
+    if not _is_expression(expression) or expression[0] in LITERAL_OPERATORS:
+        return expression
+
+    operator = expression[0]
+    if operator == "match":
+        # Labels are literals, only input and outputs are expressions
+        compacted = [operator, compact_expression(expression[1])]
+        for index, value in enumerate(expression[2:-1]):
+            compacted.append(value if index % 2 == 0 else compact_expression(value))
+        compacted.append(compact_expression(expression[-1]))
+        return compact_match(compacted)
+
+    compacted = [operator] + [compact_expression(arg) for arg in expression[1:]]
+    if operator == "case":
+        return compact_case(compacted)
+    return compacted
+
+
+def compact_style(map_style):
+    """Compact paint and layout expressions of a map style.
+
+    Return the compacted style and its size reduction report, in bytes of JSON.
+    """
+    compacted = {
+        key: (
+            {prop: compact_expression(value) for prop, value in value.items()}
+            if key in ("paint", "layout")
+            else value
+        )
+        for key, value in map_style.items()
+    }
+    before, after = len(_dumps(map_style)), len(_dumps(compacted))
+    return compacted, {"before": before, "after": after, "saved": before - after}
@@ -3,11 +3,11 @@ import math
 from project.terra_layer.settings import DEFAULT_CIRCLE_MIN_LEGEND_HEIGHT
 
 from .utils import (
+    FieldStatistics,
     boundaries_round,
     circle_boundaries_candidate,
     circle_boundaries_filter_values,
     gen_style_interpolate,
-    get_positive_min_max,
     get_style_no_value_condition,
 )
 
@@ -52,13 +52,16 @@ def gen_proportionnal_radius_legend_items(
     return ret
 
 
-def gen_proportionnal_radius_style(geo_layer, data_field, map_field, prop_config):
+def gen_proportionnal_radius_style(
+    geo_layer, data_field, map_field, prop_config, statistics=None
+):
+    statistics = statistics or FieldStatistics(geo_layer)
     field_getter = ["get", data_field]
     max_value = prop_config["max_radius"]
     no_value = prop_config.get("no_value")
 
     # Get min max value
-    mm = get_positive_min_max(geo_layer, data_field)
+    mm = statistics.get_positive_min_max(data_field)
 
     if mm[1] is not None and mm[2] is not None:
         mm = boundaries_round(mm[1:])
@@ -78,13 +81,20 @@ def gen_proportionnal_radius_style(geo_layer, data_field, map_field, prop_config
 
 
 def gen_proportionnal_radius_legend(
-    geo_layer, data_field, map_style_type, prop_config, color, no_value_color
+    geo_layer,
+    data_field,
+    map_style_type,
+    prop_config,
+    color,
+    no_value_color,
+    statistics=None,
 ):
+    statistics = statistics or FieldStatistics(geo_layer)
     no_value_size = prop_config.get("no_value")
     max_value = prop_config["max_radius"]
 
     # Get min max value
-    mm = get_positive_min_max(geo_layer, data_field)
+    mm = statistics.get_positive_min_max(data_field)
 
     if mm[1] is not None and mm[2] is not None:
         mm = boundaries_round(mm[1:])
@@ -1,11 +1,10 @@
 from project.terra_layer.settings import DEFAULT_SIZE_MIN_LEGEND_HEIGHT
 
 from .utils import (
+    FieldStatistics,
     boundaries_round,
-    discretize,
     gen_style_interpolate,
     gen_style_steps,
-    get_positive_min_max,
     get_style_no_value_condition,
     size_boundaries_candidate,
     style_type_2_legend_shape,
@@ -83,7 +82,10 @@ def gen_proportionnal_size_legend_items(
     return ret
 
 
-def gen_graduated_size_style(geo_layer, data_field, map_field, prop_config):
+def gen_graduated_size_style(
+    geo_layer, data_field, map_field, prop_config, statistics=None
+):
+    statistics = statistics or FieldStatistics(geo_layer)
     values = prop_config["values"]
     no_value = prop_config.get("no_value")
 
@@ -93,8 +95,8 @@ def gen_graduated_size_style(geo_layer, data_field, map_field, prop_config):
         if len(boundaries) < 2:
             raise ValueError('"boundaries" must be at least a list of two values')
     elif "method" in prop_config:
-        boundaries = discretize(
-            geo_layer, data_field, prop_config["method"], len(values)
+        boundaries = statistics.discretize(
+            data_field, prop_config["method"], len(values)
         )
     else:
         raise ValueError(
@@ -124,7 +126,9 @@ def gen_graduated_size_legend(
     color,
     no_value_color,
     legend_field,
+    statistics=None,
 ):
+    statistics = statistics or FieldStatistics(geo_layer)
     values = prop_config["values"]
     no_value = prop_config.get("no_value")
 
@@ -132,8 +136,8 @@ def gen_graduated_size_legend(
     if "boundaries" in prop_config:
         boundaries = prop_config["boundaries"]
     elif "method" in prop_config:
-        boundaries = discretize(
-            geo_layer, data_field, prop_config["method"], len(values)
+        boundaries = statistics.discretize(
+            data_field, prop_config["method"], len(values)
         )
 
     # Use boundaries to make style
@@ -159,13 +163,16 @@ def gen_graduated_size_legend(
         }
 
 
-def gen_proportionnal_size_style(geo_layer, data_field, map_field, prop_config):
+def gen_proportionnal_size_style(
+    geo_layer, data_field, map_field, prop_config, statistics=None
+):
+    statistics = statistics or FieldStatistics(geo_layer)
     field_getter = ["get", data_field]
     max_value = prop_config["max_value"]
     no_value = prop_config.get("no_value")
 
     # Get min max value
-    mm = get_positive_min_max(geo_layer, data_field)
+    mm = statistics.get_positive_min_max(data_field)
 
     if mm[1] is not None and mm[2] is not None:
         mm = boundaries_round(mm[1:])
@@ -191,12 +198,14 @@ def gen_proportionnal_size_legend(
     color,
     no_value_color,
     legend_field,
+    statistics=None,
 ):
+    statistics = statistics or FieldStatistics(geo_layer)
     no_value_size = prop_config.get("no_value")
     max_value = prop_config["max_value"]
 
     # Get min max value
-    mm = get_positive_min_max(geo_layer, data_field)
+    mm = statistics.get_positive_min_max(data_field)
 
     if mm[1] is not None and mm[2] is not None:
         mm = boundaries_round(mm[1:])
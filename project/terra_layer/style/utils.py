@@ -2,8 +2,16 @@ import math
 import numbers
 from functools import reduce
 
+import numpy as np
 from django.db import connection
 
+from project.geosource.models import Field
+from project.terra_layer.settings import (
+    DEFAULT_APPROX_QUANTILE_ERROR,
+    DEFAULT_APPROX_QUANTILE_THRESHOLD,
+    DEFAULT_JENKS_SAMPLE_SIZE,
+)
+
 style_type_2_legend_shape = {
     "fill-extrusion": "square",
     "fill": "square",
@@ -27,6 +35,19 @@ def style_type_2_legend_property(style_type):
     return "color"
 
 
+def get_variable_fields(style_config):
+    """
+    Return data fields used by variable properties of a wizard style.
+    """
+    if not style_config or style_config.get("type") != "wizard":
+        return set()
+    return {
+        prop_config["field"]
+        for prop_config in style_config.get("style", {}).values()
+        if prop_config.get("type") == "variable" and prop_config.get("field")
+    }
+
+
 def _flatten(levels):
     """
     Flatten 2-level array.
@@ -43,9 +64,9 @@ def get_min_max(geo_layer, field):
         cursor.execute(
             """
             SELECT
-                bool_or((properties->>%(field)s)::numeric IS NULL) AS is_null,
-                min((properties->>%(field)s)::numeric) AS min,
-                max((properties->>%(field)s)::numeric) AS max
+                bool_or(terra_layer_numeric(properties->>%(field)s) IS NULL) AS is_null,
+                min(terra_layer_numeric(properties->>%(field)s)) AS min,
+                max(terra_layer_numeric(properties->>%(field)s)) AS max
             FROM
                 geostore_feature
             WHERE
@@ -66,14 +87,14 @@ def get_positive_min_max(geo_layer, field):
         cursor.execute(
             """
             SELECT
-                bool_or((properties->>%(field)s)::numeric IS NULL) AS is_null,
-                min((properties->>%(field)s)::numeric) AS min,
-                max((properties->>%(field)s)::numeric) AS max
+                bool_or(terra_layer_numeric(properties->>%(field)s) IS NULL) AS is_null,
+                min(terra_layer_numeric(properties->>%(field)s)) AS min,
+                max(terra_layer_numeric(properties->>%(field)s)) AS max
             FROM
                 geostore_feature
             WHERE
                 layer_id = %(layer_id)s AND
-                (properties->>%(field)s)::numeric > 0
+                terra_layer_numeric(properties->>%(field)s) > 0
             """,
             {"field": field, "layer_id": geo_layer.id},
         )
@@ -82,6 +103,104 @@ def get_positive_min_max(geo_layer, field):
         return [is_null == True, min, max]  # noqa
 
 
+def get_histogram(geo_layer, field, bin_count):
+    """
+    Return the min, the max, the null count and the values count in
+    `bin_count` bins of equal width of a numeric property.
+    Values that are not numbers are counted as null, ValueError is raised if
+    no value is a number.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT
+                count(*) - count(terra_layer_numeric(properties->>%(field)s))
+                    AS null_count,
+                min(terra_layer_numeric(properties->>%(field)s)) AS min,
+                max(terra_layer_numeric(properties->>%(field)s)) AS max,
+                count(properties->>%(field)s) AS value_count
+            FROM
+                geostore_feature
+            WHERE
+                layer_id = %(layer_id)s
+            """,
+            {"field": field, "layer_id": geo_layer.id},
+        )
+        null_count, min, max, value_count = cursor.fetchone()
+        if min is None and value_count:
+            raise ValueError(f"{field} is not a numeric field")
+        if min is not None:
+            min, max = float(min), float(max)
+        histogram = {
+            "min": min,
+            "max": max,
+            "null_count": null_count,
+            "bins": [],
+        }
+        if min is None:
+            return histogram
+
+        if min == max:
+            cursor.execute(
+                """
+                SELECT
+                    count(terra_layer_numeric(properties->>%(field)s))
+                FROM
+                    geostore_feature
+                WHERE
+                    layer_id = %(layer_id)s
+                """,
+                {"field": field, "layer_id": geo_layer.id},
+            )
+            histogram["bins"] = [
+                {"lower": min, "upper": max, "count": cursor.fetchone()[0]}
+            ]
+            return histogram
+
+        # Max value belongs to the last bin
+        cursor.execute(
+            """
+            SELECT
+                least(
+                    width_bucket(
+                        terra_layer_numeric(properties->>%(field)s),
+                        %(min)s,
+                        %(max)s,
+                        %(bin_count)s
+                    ),
+                    %(bin_count)s
+                ) AS bin,
+                count(*)
+            FROM
+                geostore_feature
+            WHERE
+                layer_id = %(layer_id)s AND
+                terra_layer_numeric(properties->>%(field)s) IS NOT NULL
+            GROUP BY
+                bin
+            """,
+            {
+                "field": field,
+                "layer_id": geo_layer.id,
+                "min": min,
+                "max": max,
+                "bin_count": bin_count,
+            },
+        )
+        counts = dict(cursor.fetchall())
+
+    width = (max - min) / bin_count
+    histogram["bins"] = [
+        {
+            "lower": min + width * index,
+            "upper": max if index == bin_count - 1 else min + width * (index + 1),
+            "count": counts.get(index + 1, 0),
+        }
+        for index in range(bin_count)
+    ]
+    return histogram
+
+
 def discretize_quantile(geo_layer, field, class_count):
     """
     Compute Quantile class boundaries from a layer property.
@@ -92,8 +211,10 @@ def discretize_quantile(geo_layer, field, class_count):
             WITH
             ntiles AS (
                 SELECT
-                    (properties->>%(field)s)::numeric AS value,
-                    ntile(%(class_count)s) OVER (ORDER BY (properties->>%(field)s)::numeric) AS ntile
+                    terra_layer_numeric(properties->>%(field)s) AS value,
+                    ntile(%(class_count)s) OVER (
+                        ORDER BY terra_layer_numeric(properties->>%(field)s)
+                    ) AS ntile
                 FROM
                     geostore_feature
                 WHERE
@@ -106,7 +227,7 @@ def discretize_quantile(geo_layer, field, class_count):
                     geostore_feature
                 WHERE
                     layer_id = %(layer_id)s AND
-                    (properties->>%(field)s)::numeric IS NOT NULL
+                    terra_layer_numeric(properties->>%(field)s) IS NOT NULL
             )
             SELECT
                 min(value) AS boundary,
@@ -130,48 +251,190 @@ def discretize_quantile(geo_layer, field, class_count):
                 return [r[0] for r in rows] + [rows[-1][1]]
 
 
-def discretize_jenks(geo_layer, field, class_count):
+def approx_quantile_sample_size(error, confidence=0.999):
     """
-    Compute Jenks class boundaries from a layer property.
-    Note: Use PostGIS ST_ClusterKMeans() as k-means function.
+    Return the sample size bounding the rank error of sampled quantiles by
+    `error`, with probability `confidence` (Dvoretzky-Kiefer-Wolfowitz).
+    """
+    return math.ceil(math.log(2 / (1 - confidence)) / (2 * error**2))
+
+
+def discretize_quantile_approx(geo_layer, field, class_count, count=None):
     """
+    Compute approximate Quantile class boundaries from a deterministic sample
+    of a layer property, avoiding to sort all the layer values.
+    """
+    if count is None:
+        count = geo_layer.features.count()
+    sample_size = approx_quantile_sample_size(DEFAULT_APPROX_QUANTILE_ERROR)
+    if count <= sample_size:
+        return discretize_quantile(geo_layer, field, class_count)
+
     with connection.cursor() as cursor:
         cursor.execute(
             """
             WITH
-            kmeans AS (
+            feature AS (
                 SELECT
-                    (properties->>%(field)s)::numeric AS field,
-                    ST_ClusterKMeans(
-                        ST_MakePoint((properties->>%(field)s)::numeric, 0),
-                        least(%(class_count)s, (SELECT count(*) FROM geostore_feature WHERE layer_id = %(layer_id)s))::integer
-                    ) OVER () AS class_id
+                    terra_layer_numeric(properties->>%(field)s)::float8 AS value,
+                    (hashint8(id)::bigint & 4294967295) < %(threshold)s AS sampled
                 FROM
                     geostore_feature
                 WHERE
                     layer_id = %(layer_id)s
             )
             SELECT
-                min(field) AS min,
-                max(field) AS max
+                percentile_disc(%(fractions)s::float8[]) WITHIN GROUP (
+                    ORDER BY value
+                ) FILTER (WHERE sampled) AS boundaries,
+                min(value) AS min,
+                max(value) AS max
             FROM
-                kmeans
-            GROUP BY
-                class_id
-            ORDER BY
-                min,
-                max
+                feature
             """,
-            {"field": field, "class_count": class_count, "layer_id": geo_layer.id},
+            {
+                "field": field,
+                "layer_id": geo_layer.id,
+                "threshold": int(sample_size / count * 2**32),
+                "fractions": [index / class_count for index in range(class_count)],
+            },
         )
-        rows = cursor.fetchall()
-        if rows and len(rows) > 0:
-            rows = [row for row in rows if row[0] is not None]
-            if len(rows) == 0:
-                return []
-            else:
-                # Each class start + last class end
-                return [r[0] for r in rows] + [rows[-1][1]]
+        starts, min, max = cursor.fetchone()
+        if min is None:
+            return []
+
+        # Sample bounds are replaced by the exact ones
+        boundaries = [min]
+        for start in starts[1:]:
+            if start is not None and boundaries[-1] < start <= max:
+                boundaries.append(start)
+        # Each class start + last class end
+        return boundaries + [max]
+
+
+def fisher_jenks(values, class_count):
+    """
+    Compute Fisher-Jenks natural breaks of numeric values, minimizing the sum
+    of squared deviations from class means.
+    Returns the lower bound of each class, sorted.
+    """
+    values, weights = np.unique(np.asarray(values, dtype=float), return_counts=True)
+    n = len(values)
+    class_count = min(class_count, n)
+    if class_count == 0:
+        return []
+
+    # Prefix sums of weights, values and squared values allow to compute the
+    # sum of squared deviations of any class in constant time
+    w = np.concatenate(([0], np.cumsum(weights)))
+    s1 = np.concatenate(([0], np.cumsum(weights * values)))
+    s2 = np.concatenate(([0], np.cumsum(weights * values**2)))
+
+    def ssd(starts, end):
+        """Sum of squared deviations of classes values[starts:end + 1]"""
+        count = w[end + 1] - w[starts]
+        total = s1[end + 1] - s1[starts]
+        return s2[end + 1] - s2[starts] - total**2 / count
+
+    # cost[i]: min cost of values[:i + 1] in current number of classes
+    cost = ssd(np.zeros(n, dtype=int), np.arange(n))
+    starts = np.zeros((class_count, n), dtype=int)
+    for k in range(1, class_count):
+        new_cost = np.full(n, np.inf)
+        for end in range(k, n):
+            # Last class starts at j, in [k, end]
+            j = np.arange(k, end + 1)
+            candidates = cost[j - 1] + ssd(j, end)
+            best = np.argmin(candidates)
+            new_cost[end] = candidates[best]
+            starts[k, end] = j[best]
+        cost = new_cost
+
+    # Backtrack class starts from the last value
+    breaks = []
+    end = n - 1
+    for k in range(class_count - 1, -1, -1):
+        start = starts[k, end]
+        breaks.append(values[start])
+        end = start - 1
+    return [float(value) for value in breaks[::-1]]
+
+
+def get_jenks_values(geo_layer, field, sample_size):
+    """
+    Return the numeric values of a property, or a deterministic sample of
+    `sample_size` values evenly spread over the sorted values.
+    Return None if the layer has no feature.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT
+                count(*) AS total,
+                count(terra_layer_numeric(properties->>%(field)s)) AS count
+            FROM
+                geostore_feature
+            WHERE
+                layer_id = %(layer_id)s
+            """,
+            {"field": field, "layer_id": geo_layer.id},
+        )
+        total, count = cursor.fetchone()
+        if not total:
+            return None
+        if not count:
+            return []
+
+        if count <= sample_size:
+            cursor.execute(
+                """
+                SELECT
+                    terra_layer_numeric(properties->>%(field)s)::float8 AS value
+                FROM
+                    geostore_feature
+                WHERE
+                    layer_id = %(layer_id)s AND
+                    terra_layer_numeric(properties->>%(field)s) IS NOT NULL
+                """,
+                {"field": field, "layer_id": geo_layer.id},
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+        cursor.execute(
+            """
+            SELECT
+                percentile_disc(%(fractions)s::float8[]) WITHIN GROUP (
+                    ORDER BY terra_layer_numeric(properties->>%(field)s)::float8
+                )
+            FROM
+                geostore_feature
+            WHERE
+                layer_id = %(layer_id)s AND
+                terra_layer_numeric(properties->>%(field)s) IS NOT NULL
+            """,
+            {
+                "field": field,
+                "layer_id": geo_layer.id,
+                "fractions": np.linspace(0, 1, sample_size).tolist(),
+            },
+        )
+        return cursor.fetchone()[0]
+
+
+def discretize_jenks(geo_layer, field, class_count):
+    """
+    Compute Jenks class boundaries from a layer property.
+    Note: Use an exact Fisher-Jenks algorithm on property values, sampled on
+    large layers.
+    """
+    values = get_jenks_values(geo_layer, field, DEFAULT_JENKS_SAMPLE_SIZE)
+    if values is None:
+        return None
+    if len(values) == 0:
+        return []
+
+    # Each class start + last class end
+    return fisher_jenks(values, class_count) + [float(max(values))]
 
 
 def discretize_equal_interval(geo_layer, field, class_count):
@@ -179,6 +442,10 @@ def discretize_equal_interval(geo_layer, field, class_count):
     Compute QuantiEqual Interval class boundaries from a layer property.
     """
     is_null, min, max = get_min_max(geo_layer, field)
+    return equal_interval_boundaries(min, max, class_count)
+
+
+def equal_interval_boundaries(min, max, class_count):
     if min is not None and max is not None and isinstance(min, numbers.Number):
         delta = (max - min) / class_count
         return [min + delta * i for i in range(0, class_count + 1)]
@@ -193,7 +460,12 @@ def discretize(geo_layer, field, method, class_count):
     Note, can returns less boundaries than requested if lesser values in property than class_count
     """
     if method == "quantile":
+        count = geo_layer.features.count()
+        if count > DEFAULT_APPROX_QUANTILE_THRESHOLD:
+            return discretize_quantile_approx(geo_layer, field, class_count, count)
         return discretize_quantile(geo_layer, field, class_count)
+    elif method == "approx_quantile":
+        return discretize_quantile_approx(geo_layer, field, class_count)
     elif method == "jenks":
         return discretize_jenks(geo_layer, field, class_count)
     elif method == "equal_interval":
@@ -202,6 +474,154 @@ def discretize(geo_layer, field, method, class_count):
         raise ValueError(f'Unknow discretize method "{method}"')
 
 
+def get_field_stats(geo_layer, field):
+    """
+    Return null presence, min and max of a property, over all values and over
+    positive values only, with a single scan of the layer features.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT
+                bool_or(value IS NULL) AS is_null,
+                min(value) AS min,
+                max(value) AS max,
+                bool_or(value IS NULL) FILTER (WHERE value > 0) AS positive_is_null,
+                min(value) FILTER (WHERE value > 0) AS positive_min,
+                max(value) FILTER (WHERE value > 0) AS positive_max
+            FROM (
+                SELECT
+                    terra_layer_numeric(properties->>%(field)s) AS value
+                FROM
+                    geostore_feature
+                WHERE
+                    layer_id = %(layer_id)s
+            ) AS feature
+            """,
+            {"field": field, "layer_id": geo_layer.id},
+        )
+        row = cursor.fetchone()
+        is_null, min, max, positive_is_null, positive_min, positive_max = row
+        return {
+            "min_max": [is_null == True, min, max],  # noqa
+            "positive_min_max": [
+                positive_is_null == True,  # noqa
+                positive_min,
+                positive_max,
+            ],
+        }
+
+
+def get_stored_field_stats(geo_layer, field):
+    """
+    Return statistics of a property computed at the last refresh of the layer
+    source, or None if not available.
+
+    Features written outside of a source refresh, e.g. through the geostore
+    API, are not taken into account until the next refresh.
+    """
+    statistics = (
+        Field.objects.filter(source__slug=geo_layer.name, name=field)
+        .values_list("statistics", flat=True)
+        .first()
+    )
+    if not statistics:
+        return None
+    return {
+        "min_max": [
+            statistics["null_count"] > 0,
+            statistics.get("min"),
+            statistics.get("max"),
+        ],
+        "positive_min_max": [
+            False,
+            statistics.get("positive_min"),
+            statistics.get("positive_max"),
+        ],
+        "count": statistics["count"],
+        "quantiles": statistics.get("quantiles"),
+        "sample_size": statistics.get("sample_size", 0),
+    }
+
+
+def quantile_boundaries(quantiles, class_count):
+    """
+    Compute Quantile class boundaries from stored quantiles of a property,
+    evenly spaced from min to max. Boundaries are stored values, as with
+    percentile_disc.
+    """
+    resolution = len(quantiles) - 1
+    boundaries = []
+    for index in range(class_count):
+        boundary = quantiles[math.ceil(index * resolution / class_count)]
+        if not boundaries or boundary != boundaries[-1]:
+            boundaries.append(boundary)
+    # Each class start + last class end
+    return boundaries + [quantiles[-1]]
+
+
+class FieldStatistics:
+    """
+    Statistics of a layer properties, computed once and shared between the
+    style and legend builders of a same style generation.
+    Statistics stored at source refresh are used when available.
+    """
+
+    def __init__(self, geo_layer):
+        self.geo_layer = geo_layer
+        self._stats = {}
+        self._boundaries = {}
+
+    def _get_stats(self, field):
+        if field not in self._stats:
+            self._stats[field] = get_stored_field_stats(
+                self.geo_layer, field
+            ) or get_field_stats(self.geo_layer, field)
+        return self._stats[field]
+
+    def get_min_max(self, field):
+        return self._get_stats(field)["min_max"]
+
+    def get_positive_min_max(self, field):
+        return self._get_stats(field)["positive_min_max"]
+
+    @staticmethod
+    def _has_approx_quantiles(stats):
+        """
+        Whether stored quantiles are within the approximation error: computed
+        from all values, or from a large enough sample.
+        """
+        return stats.get("quantiles") is not None and (
+            stats["sample_size"] >= stats["count"]
+            or stats["sample_size"]
+            >= approx_quantile_sample_size(DEFAULT_APPROX_QUANTILE_ERROR)
+        )
+
+    def discretize(self, field, method, class_count):
+        key = (field, method, class_count)
+        if key not in self._boundaries:
+            stats = self._get_stats(field)
+            if method == "equal_interval":
+                is_null, min, max = self.get_min_max(field)
+                boundaries = equal_interval_boundaries(min, max, class_count)
+            elif self._has_approx_quantiles(stats) and (
+                method == "approx_quantile"
+                or method == "quantile"
+                and stats["count"] > DEFAULT_APPROX_QUANTILE_THRESHOLD
+            ):
+                # Stored quantiles are computed from a sample, so exact ones
+                # are still computed under the approximation threshold
+                boundaries = (
+                    quantile_boundaries(stats["quantiles"], class_count)
+                    if stats["quantiles"]
+                    else []
+                )
+            else:
+                boundaries = discretize(self.geo_layer, field, method, class_count)
+            self._boundaries[key] = boundaries
+        return self._boundaries[key]
+
+
 def get_style_no_value_condition(key, with_value, with_no_value):
     if with_no_value is not None:
         if with_value is not None:
@@ -0,0 +1,42 @@
+from celery import shared_task
+
+from project.geosource.models import Source
+
+
+@shared_task
+def run_sync_source_indexes(source_pk):
+    from project.terra_layer.indexes import sync_source_indexes
+
+    source = Source.objects.filter(pk=source_pk).first()
+    if source is None:
+        return {"created": [], "dropped": []}
+    return sync_source_indexes(source)
+
+
+@shared_task
+def run_refresh_source_styles(source_pk):
+    from project.terra_layer.models import Layer
+    from project.terra_layer.utils import bump_scenes_generation
+
+    layers = (
+        Layer.objects.filter(source_id=source_pk)
+        .select_related("source", "group")
+        .prefetch_related("extra_styles")
+    )
+    refreshed = [layer for layer in layers if layer.refresh_styles()]
+
+    # Invalidate layer trees once, when all styles are up to date
+    bump_scenes_generation(layer.group.view_id for layer in refreshed if layer.group)
+
+    return {"layers": [layer.pk for layer in refreshed]}
+
+
+@shared_task
+def run_warm_scene_cache(scene_pk):
+    from project.terra_layer.models import Scene
+    from project.terra_layer.views import LayerView
+
+    scene = Scene.objects.filter(pk=scene_pk).first()
+    if scene is None:
+        return {"trees": 0}
+    return {"trees": LayerView.warm_cache(scene)}
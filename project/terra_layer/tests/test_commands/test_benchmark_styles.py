@@ -0,0 +1,51 @@
+import json
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from geostore.models import Feature
+from geostore.models import Layer as GeoLayer
+
+from project.terra_layer.management.commands.benchmark_styles import BENCHMARKS
+
+
+class BenchmarkStylesTestCase(TestCase):
+    def test_benchmark_styles(self):
+        with tempfile.NamedTemporaryFile(suffix=".json") as output:
+            call_command(
+                "benchmark_styles",
+                "--size=100",
+                "--size=200",
+                "--repeat=1",
+                f"--output={output.name}",
+                stderr=StringIO(),
+            )
+            results = json.load(output)
+
+        self.assertEqual(results["repeat"], 1)
+        self.assertEqual(len(results["results"]), 2 * len(BENCHMARKS))
+        for result in results["results"]:
+            self.assertIn(result["benchmark"], BENCHMARKS)
+            self.assertIn(result["size"], [100, 200])
+            self.assertGreaterEqual(result["time"], 0)
+            self.assertIsInstance(result["queries"], int)
+
+        # Synthetic layers are dropped
+        self.assertFalse(GeoLayer.objects.exists())
+        self.assertFalse(Feature.objects.exists())
+
+    def test_benchmark_styles_stdout(self):
+        out = StringIO()
+        call_command(
+            "benchmark_styles",
+            "--size=10",
+            "--benchmark=categorized",
+            "--repeat=1",
+            stdout=out,
+            stderr=StringIO(),
+        )
+        results = json.loads(out.getvalue())
+        self.assertEqual(
+            [result["benchmark"] for result in results["results"]], ["categorized"]
+        )
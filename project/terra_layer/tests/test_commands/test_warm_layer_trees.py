@@ -0,0 +1,56 @@
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+
+from project.geosource.models import PostGISSource
+from project.terra_layer.models import Layer, LayerGroup
+from project.terra_layer.tests.factories import SceneFactory
+from project.terra_layer.utils import (
+    add_scene_profile,
+    get_layer_group_cache_key,
+    get_layer_group_stale_cache_key,
+)
+
+
+class WarmLayerTreesTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.scene = SceneFactory(name="Warmed scene")
+        self.source = PostGISSource.objects.create(
+            name="warmed_source",
+            db_name="test",
+            db_password="test",
+            db_host="localhost",
+            geom_type=1,
+            refresh=-1,
+        )
+        Layer.objects.create(
+            name="warmed_layer",
+            source=self.source,
+            group=LayerGroup.objects.get(view=self.scene),
+        )
+        self.empty_scene = SceneFactory(name="Empty scene")
+
+    def test_warm_layer_trees(self):
+        add_scene_profile(self.scene.pk, [self.source.slug])
+        output = StringIO()
+        call_command("warm_layer_trees", stdout=output)
+
+        self.assertIn("Warmed scene: 2 layer trees cached", output.getvalue())
+        self.assertIn("Empty scene: 0 layer trees cached", output.getvalue())
+        for profile in ([], [self.source.slug]):
+            self.assertIsNotNone(
+                cache.get(get_layer_group_cache_key(self.scene, profile))
+            )
+            self.assertIsNotNone(
+                cache.get(get_layer_group_stale_cache_key(self.scene, profile))
+            )
+
+    def test_warm_scene(self):
+        output = StringIO()
+        call_command("warm_layer_trees", scenes=[self.empty_scene.slug], stdout=output)
+
+        self.assertNotIn("Warmed scene", output.getvalue())
+        self.assertIsNone(cache.get(get_layer_group_cache_key(self.scene)))
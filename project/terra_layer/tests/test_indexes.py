@@ -0,0 +1,185 @@
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from geostore.models import Layer as GeoLayer
+
+from project.geosource import partitioning
+from project.geosource.models import Field, PostGISSource
+from project.terra_layer import indexes
+from project.terra_layer.models import FilterField, Layer
+
+NUMERIC_STATISTICS = {"total": 3, "null_count": 1, "distinct": 2, "count": 2}
+TEXT_STATISTICS = {"total": 3, "null_count": 0, "distinct": 3, "count": 1}
+
+
+class FeatureIndexesTestCase(TestCase):
+    def setUp(self):
+        self.source = PostGISSource.objects.create(
+            name="test",
+            db_name="test",
+            db_password="test",
+            db_host="localhost",
+            geom_type=1,
+            refresh=-1,
+        )
+        self.geo_layer = self.source.get_layer()
+        self.population = Field.objects.create(
+            source=self.source, name="population", statistics=NUMERIC_STATISTICS
+        )
+        self.city = Field.objects.create(
+            source=self.source, name="city", statistics=TEXT_STATISTICS
+        )
+        self.layer = Layer.objects.create(source=self.source, name="layer")
+        Layer.objects.filter(pk=self.layer.pk).update(
+            main_style={
+                "type": "wizard",
+                "style": {
+                    "fill_color": {"type": "variable", "field": "population"},
+                    "fill_outline_color": {"type": "variable", "field": "city"},
+                    "fill_opacity": {"type": "fixed", "value": 0.5},
+                },
+            }
+        )
+        FilterField.objects.create(
+            field=self.city, layer=self.layer, filter_enable=True
+        )
+        FilterField.objects.create(field=self.population, layer=self.layer)
+
+    def test_get_used_fields(self):
+        styled, filtered = indexes.get_used_fields(self.source)
+        self.assertEqual(styled, {"population", "city"})
+        self.assertEqual(filtered, {"city"})
+
+    def test_get_wanted_indexes(self):
+        wanted = indexes.get_wanted_indexes(self.source, self.geo_layer.pk)
+        self.assertEqual(
+            set(wanted.values()),
+            {
+                (indexes.NUMERIC, "population"),
+                (indexes.NUMERIC, "city"),
+                (indexes.TEXT, "city"),
+            },
+        )
+
+    def test_sync_source_indexes(self):
+        result = indexes.sync_source_indexes(self.source)
+        self.assertEqual(len(result["created"]), 3)
+        self.assertEqual(result["dropped"], [])
+        self.assertEqual(
+            set(indexes.get_existing_indexes(self.geo_layer.pk)),
+            set(result["created"]),
+        )
+
+        # Already synced
+        self.assertEqual(
+            indexes.sync_source_indexes(self.source), {"created": [], "dropped": []}
+        )
+
+        # City is neither filtered nor styled anymore
+        FilterField.objects.filter(field=self.city).update(filter_enable=False)
+        Layer.objects.filter(pk=self.layer.pk).update(
+            main_style={
+                "type": "wizard",
+                "style": {"fill_color": {"type": "variable", "field": "population"}},
+            }
+        )
+        result = indexes.sync_source_indexes(self.source)
+        self.assertEqual(result["created"], [])
+        self.assertEqual(
+            result["dropped"],
+            sorted(
+                [
+                    indexes.get_index_name(self.geo_layer.pk, "city", indexes.NUMERIC),
+                    indexes.get_index_name(self.geo_layer.pk, "city", indexes.TEXT),
+                ]
+            ),
+        )
+
+    def test_numeric_index_matches_style_queries(self):
+        indexes.sync_source_indexes(self.source)
+        name = indexes.get_index_name(self.geo_layer.pk, "population")
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexdef FROM pg_indexes WHERE indexname = %s", [name]
+            )
+            self.assertIn("terra_layer_numeric", cursor.fetchone()[0])
+
+            cursor.execute(
+                "SELECT terra_layer_numeric('12.5'), terra_layer_numeric('abc')"
+            )
+            self.assertEqual(cursor.fetchone(), (Decimal("12.5"), None))
+
+    def test_sync_source_indexes_not_numeric(self):
+        self.geo_layer.features.create(geom="POINT(0 0)", properties={"population": 12})
+        indexes.sync_source_indexes(self.source)
+
+        # Indexes never prevent writing values that are not numeric
+        self.geo_layer.features.create(
+            geom="POINT(0 0)", properties={"population": "unknown"}
+        )
+        self.geo_layer.features.create(geom="POINT(0 0)", properties={"population": ""})
+        self.assertEqual(self.geo_layer.features.count(), 3)
+
+    def test_sync_source_indexes_without_layer(self):
+        source = PostGISSource.objects.create(
+            name="without_layer",
+            db_name="test",
+            db_password="test",
+            db_host="localhost",
+            geom_type=1,
+            refresh=-1,
+        )
+        GeoLayer.objects.filter(name=source.slug).delete()
+
+        self.assertEqual(
+            indexes.sync_source_indexes(source), {"created": [], "dropped": []}
+        )
+        self.assertFalse(GeoLayer.objects.filter(name=source.slug).exists())
+
+    def test_sync_all_indexes_drop_orphans(self):
+        indexes.sync_source_indexes(self.source)
+        geo_layer_pk = self.geo_layer.pk
+        Layer.objects.all().delete()
+        self.geo_layer.delete()
+
+        result = indexes.sync_all_indexes()
+        self.assertEqual(len(result["dropped"]), 3)
+        self.assertEqual(indexes.get_existing_indexes(geo_layer_pk), {})
+
+    def test_sync_source_indexes_partitioned(self):
+        indexes.sync_source_indexes(self.source)
+        partitioning.partition_feature_table(drop_foreign_keys=True)
+
+        # Indexes copied on the partitioned table are built on the default
+        # partition storing the layer features
+        result = indexes.sync_source_indexes(self.source)
+        self.assertEqual(len(result["created"]), 3)
+        self.assertEqual(
+            set(indexes.get_existing_indexes(self.geo_layer.pk).values()),
+            {partitioning.DEFAULT_PARTITION},
+        )
+
+        # Then on the layer partition
+        partitioning.create_layer_partition(self.geo_layer.pk)
+        result = indexes.sync_source_indexes(self.source)
+        self.assertEqual(len(result["created"]), 3)
+        self.assertEqual(
+            set(indexes.get_existing_indexes(self.geo_layer.pk).values()),
+            {partitioning.get_partition_name(self.geo_layer.pk)},
+        )
+        self.assertEqual(
+            indexes.sync_source_indexes(self.source), {"created": [], "dropped": []}
+        )
+
+    def test_feature_indexes_command(self):
+        out = StringIO()
+        call_command("feature_indexes", stdout=out)
+        self.assertEqual(out.getvalue(), "No feature properties index\n")
+
+        out = StringIO()
+        call_command("feature_indexes", "--sync", stdout=out)
+        for name in indexes.get_existing_indexes(self.geo_layer.pk):
+            self.assertIn(f"Index {name} created", out.getvalue())
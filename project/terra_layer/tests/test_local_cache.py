@@ -0,0 +1,56 @@
+from unittest.mock import Mock
+
+from django.core.cache import cache
+from django.test import SimpleTestCase
+
+from project.terra_layer.local_cache import (
+    LocalCache,
+    get_or_set,
+    get_size,
+    local_cache,
+)
+
+
+class LocalCacheTestCase(SimpleTestCase):
+    def test_evicted_by_entries(self):
+        local = LocalCache(max_entries=2, max_bytes=1024)
+        local.set("a", 1)
+        local.set("b", 2)
+        # Recently used entries are kept
+        self.assertEqual(local.get("a"), 1)
+        local.set("c", 3)
+
+        self.assertIsNone(local.get("b"))
+        self.assertEqual(local.get("a"), 1)
+        self.assertEqual(local.get("c"), 3)
+
+    def test_evicted_by_size(self):
+        value = b"x" * 100
+        local = LocalCache(max_entries=10, max_bytes=get_size(value) * 2)
+        for key in ("a", "b", "c"):
+            local.set(key, value)
+
+        self.assertEqual(list(local.entries), ["b", "c"])
+        self.assertEqual(local.size, get_size(value) * 2)
+
+        # Too large values are not kept
+        local.set("d", value * 3)
+        self.assertIsNone(local.get("d"))
+
+        local.set("c", b"")
+        self.assertEqual(local.size, get_size(value) + get_size(b""))
+        local.clear()
+        self.assertEqual(local.size, 0)
+
+    def test_get_or_set(self):
+        local_cache.clear()
+        cache.delete("local-key")
+        default = Mock(return_value={"value": 1})
+
+        self.assertEqual(get_or_set("local-key", default), {"value": 1})
+        self.assertEqual(cache.get("local-key"), {"value": 1})
+
+        # Shared cache is not read again
+        cache.delete("local-key")
+        self.assertEqual(get_or_set("local-key", default), {"value": 1})
+        default.assert_called_once()
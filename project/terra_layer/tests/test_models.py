@@ -1,7 +1,15 @@
+from unittest import mock
+
+from django.contrib.gis.geos import Point
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from geostore.models import Feature
 
 from project.geosource.models import PostGISSource
+from project.geosource.signals import refresh_data_done
 from project.terra_layer.models import Layer
+from project.terra_layer.tasks import run_refresh_source_styles
 
 from .factories import LayerFactory, SceneFactory
 
@@ -145,3 +153,157 @@ class LayerTestCase(TestCase):
                 },
             ],
         )
+
+    def test_scene_tree2models_updates_changed_rows(self):
+        source = PostGISSource.objects.create(
+            name="test",
+            db_name="test",
+            db_password="test",
+            db_host="localhost",
+            geom_type=1,
+            refresh=-1,
+        )
+        layer, layer2, layer3 = [LayerFactory(source=source) for _ in range(3)]
+        scene = SceneFactory(
+            tree=[
+                {
+                    "group": True,
+                    "label": "level1",
+                    "children": [
+                        {"geolayer": layer.id, "label": ""},
+                        {
+                            "group": True,
+                            "label": "level2",
+                            "children": [{"geolayer": layer2.id, "label": ""}],
+                        },
+                    ],
+                },
+                {"geolayer": layer3.id, "label": ""},
+            ]
+        )
+        groups = {group.label: group for group in scene.layer_groups.all()}
+        self.assertEqual(set(groups), {"Root", "level1", "level2"})
+        self.assertEqual(groups["level2"].parent, groups["level1"])
+        layer2.refresh_from_db()
+        self.assertEqual(layer2.group, groups["level2"])
+
+        # Layer 3 removed, level2 moved and made exclusive, new group created
+        scene.tree = [
+            {
+                "group": True,
+                "label": "level1",
+                "children": [
+                    {
+                        "group": True,
+                        "label": "level2",
+                        "exclusive": True,
+                        "children": [{"geolayer": layer2.id, "label": ""}],
+                    },
+                    {"geolayer": layer.id, "label": ""},
+                    {"group": True, "label": "new", "children": []},
+                ],
+            },
+        ]
+        with mock.patch(
+            "project.terra_layer.models.bump_scenes_generation"
+        ) as bump_scenes_generation:
+            scene.save()
+        bump_scenes_generation.assert_called_once_with({scene.pk})
+
+        new_groups = {group.label: group for group in scene.layer_groups.all()}
+        self.assertEqual(set(new_groups), {"Root", "level1", "level2", "new"})
+        # Groups are kept
+        for label in ("Root", "level1", "level2"):
+            self.assertEqual(new_groups[label].pk, groups[label].pk)
+        self.assertTrue(new_groups["level2"].exclusive)
+        self.assertEqual(new_groups["level2"].order, 0)
+        self.assertEqual(new_groups["new"].parent, new_groups["level1"])
+
+        layer.refresh_from_db()
+        layer3.refresh_from_db()
+        self.assertEqual((layer.group, layer.order), (new_groups["level1"], 1))
+        self.assertIsNone(layer3.group)
+
+        # Nothing is written when the tree does not change
+        with CaptureQueriesContext(connection) as queries:
+            scene.tree2models()
+        for query in queries:
+            self.assertFalse(
+                query["sql"].startswith(("INSERT", "UPDATE", "DELETE")), query["sql"]
+            )
+
+
+class LayerRefreshStylesTestCase(TestCase):
+    def setUp(self):
+        self.source = PostGISSource.objects.create(
+            name="test",
+            db_name="test",
+            db_password="test",
+            db_host="localhost",
+            geom_type=1,
+            refresh=-1,
+        )
+        self.geo_layer = self.source.get_layer()
+        for value in (1, 2):
+            self._feature_factory(value)
+
+        self.layer = Layer.objects.create(
+            source=self.source,
+            name="variable",
+            main_style={
+                "map_style_type": "circle",
+                "type": "wizard",
+                "uid": "a48f4bd8-3715-4ea0-ae02-b1d827bcb599",
+                "style": {
+                    "circle_color": {
+                        "type": "variable",
+                        "field": "a",
+                        "analysis": "graduated",
+                        "method": "equal_interval",
+                        "values": ["#aa0000", "#000000"],
+                        "generate_legend": True,
+                    },
+                },
+            },
+        )
+        self.layer.save()
+        self.fixed_layer = Layer.objects.create(
+            source=self.source,
+            name="fixed",
+            main_style={
+                "map_style_type": "circle",
+                "type": "wizard",
+                "style": {"circle_color": {"type": "fixed", "value": "#ffffff"}},
+            },
+        )
+
+    def _feature_factory(self, value):
+        return Feature.objects.create(
+            layer=self.geo_layer,
+            geom=Point(-1.560408, 47.218658),
+            properties={"a": value},
+        )
+
+    def _get_boundaries(self, layer):
+        return [
+            item["boundaries"]["upper"]["value"] for item in layer.legends[0]["items"]
+        ]
+
+    def test_refresh_source_styles(self):
+        self.assertEqual(self._get_boundaries(self.layer), [2.0, 1.5])
+
+        self._feature_factory(10)
+        result = run_refresh_source_styles(self.source.pk)
+
+        self.assertEqual(result, {"layers": [self.layer.pk]})
+        self.layer.refresh_from_db()
+        self.assertEqual(self._get_boundaries(self.layer), [10.0, 5.5])
+        self.assertEqual(len(self.layer.legends), 1)
+
+    def test_refresh_styles_without_variable_property(self):
+        self.assertFalse(self.fixed_layer.refresh_styles())
+
+    @mock.patch("project.terra_layer.tasks.run_refresh_source_styles.delay")
+    def test_refresh_data_done_refresh_styles(self, mocked_delay):
+        refresh_data_done.send_robust(sender=None, layer=self.geo_layer.pk)
+        mocked_delay.assert_called_once_with(self.source.pk)
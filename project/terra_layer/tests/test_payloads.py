@@ -0,0 +1,63 @@
+import gzip
+
+import brotli
+from django.test import RequestFactory, SimpleTestCase
+
+from project.terra_layer.payloads import (
+    build_payload,
+    get_accepted_encoding,
+    get_payload_response,
+    render_json,
+)
+
+
+class PayloadsTestCase(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.content = render_json({"title": "Scène", "layers": list(range(100))})
+
+    def test_render_json(self):
+        self.assertEqual(render_json({"a": [1, "é"]}), '{"a":[1,"é"]}'.encode())
+
+    def test_build_payload(self):
+        payload = build_payload(self.content)
+        self.assertEqual(brotli.decompress(payload["br"]), self.content)
+        self.assertEqual(gzip.decompress(payload["gzip"]), self.content)
+        self.assertEqual(payload, build_payload(self.content))
+        self.assertTrue(payload["etag"].startswith('W/"'))
+
+        payload = build_payload(self.content, encodings=())
+        self.assertNotIn("gzip", payload)
+
+    def test_accepted_encoding(self):
+        for header, encoding in (
+            ("", None),
+            ("deflate", None),
+            ("gzip, deflate", "gzip"),
+            ("br, gzip", "br"),
+            ("gzip, br;q=0", "gzip"),
+            ("GZIP;q=0.5", "gzip"),
+            ("gzip;q=0", None),
+        ):
+            request = self.factory.get("/", HTTP_ACCEPT_ENCODING=header)
+            self.assertEqual(get_accepted_encoding(request), encoding, header)
+
+    def test_payload_response(self):
+        payload = build_payload(self.content, encodings=())
+
+        response = get_payload_response(self.factory.get("/"), payload)
+        self.assertEqual(response.content, self.content)
+        self.assertEqual(response["Content-Type"], "application/json")
+        self.assertEqual(response["ETag"], payload["etag"])
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+        request = self.factory.get("/", HTTP_ACCEPT_ENCODING="gzip")
+        response = get_payload_response(request, payload)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertEqual(gzip.decompress(response.content), self.content)
+
+        request = self.factory.get("/", HTTP_ACCEPT_ENCODING="gzip, deflate, br")
+        response = get_payload_response(request, build_payload(self.content))
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(response.content), self.content)
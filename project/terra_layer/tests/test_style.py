@@ -1,15 +1,30 @@
 import random
+from unittest import mock
 
 from django.contrib.gis.geos import Point
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
 from geostore.models import Feature
 
 from project.geosource.models import PostGISSource
 from project.terra_layer.models import CustomStyle, Layer
+from project.terra_layer.style import generate_style_from_wizard
+from project.terra_layer.style.expressions import (
+    compact_case,
+    compact_expression,
+    compact_match,
+    compact_style,
+)
 from project.terra_layer.style.utils import (
+    FieldStatistics,
+    approx_quantile_sample_size,
     ceil_scale,
     circle_boundaries_candidate,
     circle_boundaries_filter_values,
+    discretize,
+    discretize_jenks,
+    discretize_quantile,
+    discretize_quantile_approx,
+    fisher_jenks,
     get_min_max,
     round_scale,
     trunc_scale,
@@ -62,6 +77,198 @@ class StyleTestCase(TestCase):
         geo_layer = self.source.get_layer()
         self.assertEqual(get_min_max(geo_layer, "a"), [False, None, None])
 
+    def test_field_statistics(self):
+        geo_layer = self.source.get_layer()
+        self._feature_factory(geo_layer, a=-1),
+        self._feature_factory(geo_layer, a=2),
+        self._feature_factory(geo_layer, a=4),
+        self._feature_factory(geo_layer, b=1),
+
+        statistics = FieldStatistics(geo_layer)
+        # Stored statistics lookup, then a single scan
+        with self.assertNumQueries(2):
+            self.assertEqual(statistics.get_min_max("a"), [True, -1.0, 4.0])
+            self.assertEqual(statistics.get_positive_min_max("a"), [False, 2.0, 4.0])
+            self.assertEqual(
+                statistics.discretize("a", "equal_interval", 5),
+                [-1.0, 0.0, 1.0, 2.0, 3.0, 4.0],
+            )
+
+    def test_field_statistics_stored(self):
+        geo_layer = self.source.get_layer()
+        self.source.fields.create(
+            name="a",
+            label="a",
+            statistics={
+                "total": 10,
+                "null_count": 0,
+                "distinct": 10,
+                "count": 10,
+                "min": 0,
+                "max": 10,
+                "positive_min": 1,
+                "positive_max": 10,
+                "sample_size": 10,
+                "quantiles": [i / 10 for i in range(101)],
+            },
+        )
+
+        statistics = FieldStatistics(geo_layer)
+        with self.assertNumQueries(1), mock.patch(
+            "project.terra_layer.style.utils.DEFAULT_APPROX_QUANTILE_THRESHOLD", 5
+        ):
+            self.assertEqual(statistics.get_min_max("a"), [False, 0, 10])
+            self.assertEqual(statistics.get_positive_min_max("a"), [False, 1, 10])
+            self.assertEqual(
+                statistics.discretize("a", "quantile", 4),
+                [0.0, 2.5, 5.0, 7.5, 10.0],
+            )
+            self.assertEqual(
+                statistics.discretize("a", "approx_quantile", 4),
+                [0.0, 2.5, 5.0, 7.5, 10.0],
+            )
+
+    def test_field_statistics_stored_exact_quantile(self):
+        geo_layer = self.source.get_layer()
+        for i in range(10):
+            self._feature_factory(geo_layer, a=i)
+        self.source.fields.create(
+            name="a",
+            label="a",
+            statistics={
+                "total": 10,
+                "null_count": 0,
+                "distinct": 10,
+                "count": 10,
+                "min": 0,
+                "max": 9,
+                "positive_min": 1,
+                "positive_max": 9,
+                # Sampled quantiles, not used under the approximation threshold
+                "quantiles": [0] * 50 + [9] * 51,
+            },
+        )
+
+        statistics = FieldStatistics(geo_layer)
+        self.assertEqual(
+            statistics.discretize("a", "quantile", 4),
+            discretize_quantile(geo_layer, "a", 4),
+        )
+
+    def test_field_statistics_stored_small_sample(self):
+        geo_layer = self.source.get_layer()
+        for i in range(10):
+            self._feature_factory(geo_layer, a=i)
+        self.source.fields.create(
+            name="a",
+            label="a",
+            statistics={
+                "total": 10,
+                "null_count": 0,
+                "distinct": 10,
+                "count": 10,
+                "min": 0,
+                "max": 9,
+                "positive_min": 1,
+                "positive_max": 9,
+                # Sample too small for the approximation error
+                "sample_size": 2,
+                "quantiles": [0] * 50 + [9] * 51,
+            },
+        )
+
+        statistics = FieldStatistics(geo_layer)
+        self.assertEqual(
+            statistics.discretize("a", "approx_quantile", 4),
+            discretize_quantile_approx(geo_layer, "a", 4),
+        )
+
+    def test_field_statistics_shared_by_style_and_legend(self):
+        geo_layer = self.source.get_layer()
+        for i in range(10):
+            self._feature_factory(geo_layer, a=i)
+
+        config = {
+            "map_style_type": "fill",
+            "uid": "a48f4bd8-3715-4ea0-ae02-b1d827bcb599",
+            "style": {
+                "fill_color": {
+                    "type": "variable",
+                    "field": "a",
+                    "analysis": "graduated",
+                    "method": "quantile",
+                    "values": ["#aa0000", "#770000", "#330000", "#000000"],
+                    "generate_legend": True,
+                },
+            },
+        }
+        with mock.patch(
+            "project.terra_layer.style.utils.discretize",
+            wraps=discretize,
+        ) as mocked_discretize:
+            generate_style_from_wizard(geo_layer, config)
+        mocked_discretize.assert_called_once_with(geo_layer, "a", "quantile", 4)
+
+    def test_fisher_jenks(self):
+        self.assertEqual(fisher_jenks([], 3), [])
+        self.assertEqual(fisher_jenks([5, 5, 5], 3), [5.0])
+        self.assertEqual(
+            fisher_jenks([22, 1, 2, 3, 10, 11, 12, 20, 21], 3), [1.0, 10.0, 20.0]
+        )
+        self.assertEqual(fisher_jenks([1, 1, 1, 1, 2, 5, 6, 6, 6, 9], 2), [1.0, 5.0])
+
+    def test_discretize_jenks_sampled(self):
+        geo_layer = self.source.get_layer()
+        for value in [1, 2, 3, 10, 11, 12, 20, 21, 22]:
+            self._feature_factory(geo_layer, a=value)
+        self._feature_factory(geo_layer, b=1)
+
+        self.assertEqual(discretize_jenks(geo_layer, "a", 3), [1.0, 10.0, 20.0, 22.0])
+        with mock.patch("project.terra_layer.style.utils.DEFAULT_JENKS_SAMPLE_SIZE", 5):
+            # Sample is 1, 3, 11, 20, 22
+            self.assertEqual(
+                discretize_jenks(geo_layer, "a", 3), [1.0, 11.0, 20.0, 22.0]
+            )
+
+    def test_approx_quantile_sample_size(self):
+        self.assertEqual(approx_quantile_sample_size(0.01), 38005)
+        self.assertEqual(approx_quantile_sample_size(0.01, 0.95), 18445)
+
+    def test_discretize_quantile_approx(self):
+        geo_layer = self.source.get_layer()
+        for value in range(100):
+            self._feature_factory(geo_layer, a=value)
+
+        # Small layers are not sampled
+        self.assertEqual(
+            discretize_quantile_approx(geo_layer, "a", 4),
+            discretize_quantile(geo_layer, "a", 4),
+        )
+
+        with mock.patch(
+            "project.terra_layer.style.utils.DEFAULT_APPROX_QUANTILE_ERROR", 0.5
+        ):
+            boundaries = discretize_quantile_approx(geo_layer, "a", 4)
+            self.assertEqual(boundaries, discretize_quantile_approx(geo_layer, "a", 4))
+        self.assertEqual(boundaries[0], 0)
+        self.assertEqual(boundaries[-1], 99)
+        self.assertEqual(boundaries, sorted(set(boundaries)))
+
+    @mock.patch("project.terra_layer.style.utils.discretize_quantile_approx")
+    def test_discretize_quantile_threshold(self, mocked_approx):
+        geo_layer = self.source.get_layer()
+        for value in range(5):
+            self._feature_factory(geo_layer, a=value)
+
+        discretize(geo_layer, "a", "quantile", 2)
+        mocked_approx.assert_not_called()
+
+        with mock.patch(
+            "project.terra_layer.style.utils.DEFAULT_APPROX_QUANTILE_THRESHOLD", 2
+        ):
+            discretize(geo_layer, "a", "quantile", 2)
+        mocked_approx.assert_called_once_with(geo_layer, "a", 2, 5)
+
     def test_circle_boundaries_0(self):
         min = 0
         max = 1
@@ -2156,12 +2363,7 @@ class StyleTestCase(TestCase):
                         0.4,
                         0,
                     ],
-                    "fill-outline-color": [
-                        "case",
-                        ["==", ["typeof", ["get", "a"]], "number"],
-                        "#ffffff",
-                        "#ffffff",
-                    ],
+                    "fill-outline-color": "#ffffff",
                 },
             },
         )
@@ -2273,7 +2475,7 @@ class StyleTestCase(TestCase):
                         "#770000",
                         0.5740581144424383,
                         "#330000",
-                        5.727211814984125,
+                        5.582558667496384,
                         "#000000",
                     ],
                     "fill-color": "#ffffff",
@@ -2291,7 +2493,7 @@ class StyleTestCase(TestCase):
                         {
                             "strokeColor": "#000000",
                             "boundaries": {
-                                "lower": {"value": 5.727211814984125, "included": True},
+                                "lower": {"value": 5.582558667496384, "included": True},
                                 "upper": {
                                     "value": 15.25702131719717,
                                     "included": True,
@@ -2306,7 +2508,7 @@ class StyleTestCase(TestCase):
                                     "included": True,
                                 },
                                 "upper": {
-                                    "value": 5.727211814984125,
+                                    "value": 5.582558667496384,
                                     "included": False,
                                 },
                             },
@@ -2478,7 +2680,7 @@ class StyleTestCase(TestCase):
                             "#770000",
                             0.5740581144424383,
                             "#330000",
-                            5.727211814984125,
+                            5.582558667496384,
                             "#000000",
                         ],
                         "#CC0000",
@@ -2509,7 +2711,7 @@ class StyleTestCase(TestCase):
                         {
                             "color": "#000000",
                             "boundaries": {
-                                "lower": {"value": 5.727211814984125, "included": True},
+                                "lower": {"value": 5.582558667496384, "included": True},
                                 "upper": {
                                     "value": 15.25702131719717,
                                     "included": True,
@@ -2524,7 +2726,7 @@ class StyleTestCase(TestCase):
                                     "included": True,
                                 },
                                 "upper": {
-                                    "value": 5.727211814984125,
+                                    "value": 5.582558667496384,
                                     "included": False,
                                 },
                             },
@@ -2610,7 +2812,7 @@ class StyleTestCase(TestCase):
                             5,
                             0.5740581144424383,
                             10,
-                            5.727211814984125,
+                            5.582558667496384,
                             15,
                         ],
                         7,
@@ -2631,7 +2833,7 @@ class StyleTestCase(TestCase):
                             "color": "#ffffff",
                             "strokeWidth": 15,
                             "boundaries": {
-                                "lower": {"value": 5.727211814984125, "included": True},
+                                "lower": {"value": 5.582558667496384, "included": True},
                                 "upper": {"value": 15.25702131719717, "included": True},
                             },
                         },
@@ -2644,7 +2846,7 @@ class StyleTestCase(TestCase):
                                     "included": True,
                                 },
                                 "upper": {
-                                    "value": 5.727211814984125,
+                                    "value": 5.582558667496384,
                                     "included": False,
                                 },
                             },
@@ -2831,25 +3033,20 @@ class StyleTestCase(TestCase):
                 "type": "fill",
                 "paint": {
                     "fill-color": [
-                        "case",
-                        ["has", "a"],
-                        [
-                            "match",
-                            ["get", "a"],
-                            "Alaska",
-                            "#fc34bc",
-                            "Cameroun",
-                            "#2334bc",
-                            "France",
-                            "#fc3445",
-                            "Canada",
-                            "#fc15bc",
-                            "Groland",
-                            "#1623bc",
-                            "",
-                            "#0023bc",
-                            "#110000",
-                        ],
+                        "match",
+                        ["get", "a"],
+                        "Alaska",
+                        "#fc34bc",
+                        "Cameroun",
+                        "#2334bc",
+                        "France",
+                        "#fc3445",
+                        "Canada",
+                        "#fc15bc",
+                        "Groland",
+                        "#1623bc",
+                        "",
+                        "#0023bc",
                         "#110000",
                     ],
                     "fill-outline-color": "#00ffff",
@@ -2916,25 +3113,20 @@ class StyleTestCase(TestCase):
                 "type": "circle",
                 "paint": {
                     "circle-radius": [
-                        "case",
-                        ["has", "a"],
-                        [
-                            "match",
-                            ["get", "a"],
-                            "Alaska",
-                            10,
-                            "Cameroun",
-                            20,
-                            "France",
-                            30,
-                            "Canada",
-                            40,
-                            "Groland",
-                            50,
-                            "",
-                            2,
-                            0,
-                        ],
+                        "match",
+                        ["get", "a"],
+                        "Alaska",
+                        10,
+                        "Cameroun",
+                        20,
+                        "France",
+                        30,
+                        "Canada",
+                        40,
+                        "Groland",
+                        50,
+                        "",
+                        2,
                         0,
                     ],
                     "circle-color": "#00ffff",
@@ -3021,25 +3213,20 @@ class StyleTestCase(TestCase):
                 "type": "line",
                 "paint": {
                     "line-width": [
-                        "case",
-                        ["has", "a"],
-                        [
-                            "match",
-                            ["get", "a"],
-                            "Alaska",
-                            10,
-                            "Cameroun",
-                            20,
-                            "France",
-                            30,
-                            "Canada",
-                            40,
-                            "Groland",
-                            50,
-                            "",
-                            2,
-                            0,
-                        ],
+                        "match",
+                        ["get", "a"],
+                        "Alaska",
+                        10,
+                        "Cameroun",
+                        20,
+                        "France",
+                        30,
+                        "Canada",
+                        40,
+                        "Groland",
+                        50,
+                        "",
+                        2,
                         0,
                     ],
                     "line-color": "#00ffff",
@@ -3318,3 +3505,87 @@ class StyleTestCase(TestCase):
         self.layer.save(preserve_legend=True)
 
         self.assertEqual(len(self.layer.legends), 1)
+
+
+class ExpressionsTestCase(SimpleTestCase):
+    def test_compact_match(self):
+        self.assertEqual(
+            compact_match(
+                [
+                    "match",
+                    ["get", "a"],
+                    "A",
+                    "#1",
+                    "B",
+                    "#2",
+                    "C",
+                    "#1",
+                    "D",
+                    "#0",
+                    "#0",
+                ]
+            ),
+            ["match", ["get", "a"], ["A", "C"], "#1", "B", "#2", "#0"],
+        )
+        # Duplicated labels keep the first output
+        self.assertEqual(
+            compact_match(["match", ["get", "a"], ["A", "B"], 1, "A", 2, 0]),
+            ["match", ["get", "a"], ["A", "B"], 1, 0],
+        )
+        # Every label gives the fallback output
+        self.assertEqual(compact_match(["match", ["get", "a"], "A", 0, 0]), 0)
+
+    def test_compact_case(self):
+        self.assertEqual(
+            compact_case(["case", ["==", ["typeof", ["get", "a"]], "number"], 1, 1]),
+            1,
+        )
+        self.assertEqual(
+            compact_case(["case", ["has", "a"], ["match", ["get", "a"], "A", 1, 0], 0]),
+            ["match", ["get", "a"], "A", 1, 0],
+        )
+        # Missing properties don't give the match fallback
+        self.assertEqual(
+            compact_case(["case", ["has", "a"], ["match", ["get", "a"], "A", 1, 0], 2]),
+            ["case", ["has", "a"], ["match", ["get", "a"], "A", 1, 0], 2],
+        )
+        # Only trailing branches can be dropped
+        self.assertEqual(
+            compact_case(["case", ["has", "a"], 0, ["has", "b"], 1, 1, 0]),
+            ["case", ["has", "a"], 0, ["has", "b"], 1, 0],
+        )
+        self.assertEqual(
+            compact_case(["case", ["has", "a"], 1, ["has", "b"], 0, 0]),
+            ["case", ["has", "a"], 1, 0],
+        )
+
+    def test_compact_expression(self):
+        expression = [
+            "case",
+            ["has", "a"],
+            ["match", ["get", "a"], "A", "#1", "B", "#1", "#0"],
+            "#0",
+        ]
+        self.assertEqual(
+            compact_expression(expression),
+            ["match", ["get", "a"], ["A", "B"], "#1", "#0"],
+        )
+        step = ["step", ["get", "a"], 1, 10, 2]
+        self.assertEqual(compact_expression(step), step)
+        self.assertEqual(
+            compact_expression(["literal", ["case", 1, 1]]), ["literal", ["case", 1, 1]]
+        )
+
+    def test_compact_style(self):
+        categories = ["match", ["get", "a"]]
+        for index in range(1000):
+            categories += [f"category {index}", f"#00000{index % 3}"]
+        categories.append("#000000")
+
+        map_style, report = compact_style(
+            {"type": "fill", "paint": {"fill-color": categories}}
+        )
+        self.assertEqual(len(map_style["paint"]["fill-color"]), 7)
+        self.assertEqual(map_style["type"], "fill")
+        self.assertGreater(report["saved"], 0)
+        self.assertEqual(report["saved"], report["before"] - report["after"])
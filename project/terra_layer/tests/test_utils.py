@@ -1,6 +1,9 @@
-from django.test import TestCase
+from unittest.mock import Mock, patch
 
-from ..utils import dict_merge
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+
+from ..utils import dict_merge, get_or_set_single_flight
 
 
 class UtilsTestCase(TestCase):
@@ -19,3 +22,40 @@ class UtilsTestCase(TestCase):
             False,
         )
         self.assertEqual(merged, {"initialState": "test", "other": {"other": 2}})
+
+
+class SingleFlightTestCase(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_value_computed_once(self):
+        default = Mock(return_value="value")
+        self.assertEqual(get_or_set_single_flight("key", default, "stale"), "value")
+        self.assertEqual(get_or_set_single_flight("key", default, "stale"), "value")
+        default.assert_called_once()
+        self.assertEqual(cache.get("stale"), "value")
+        self.assertIsNone(cache.get("key-lock"))
+
+    def test_stale_value_while_locked(self):
+        cache.set("stale", "old value")
+        cache.add("key-lock", "other")
+        default = Mock(return_value="value")
+        self.assertEqual(get_or_set_single_flight("key", default, "stale"), "old value")
+        default.assert_not_called()
+
+    @patch("project.terra_layer.utils.CACHE_LOCK_WAIT", 0.2)
+    def test_wait_while_locked(self):
+        cache.add("key-lock", "other")
+        default = Mock(return_value="value")
+        with patch("project.terra_layer.utils.time.sleep") as sleep:
+            sleep.side_effect = lambda _: cache.set("key", "computed value")
+            self.assertEqual(
+                get_or_set_single_flight("key", default, "stale"), "computed value"
+            )
+        default.assert_not_called()
+
+        # Computed anyway when the lock is held too long
+        cache.delete("key")
+        self.assertEqual(get_or_set_single_flight("key", default), "value")
+        # Lock of the other caller is kept
+        self.assertEqual(cache.get("key-lock"), "other")
@@ -1,17 +1,24 @@
+import gzip
 import io
 import json
+from datetime import timedelta
 from unittest.mock import patch
 
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
 from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from geostore import GeometryTypes
+from geostore.models import Layer as GeoLayer
 from geostore.tests.factories import LayerFactory
+from mapbox_baselayer.models import MapBaseLayer
 from rest_framework.status import (
     HTTP_200_OK,
     HTTP_201_CREATED,
     HTTP_204_NO_CONTENT,
+    HTTP_304_NOT_MODIFIED,
     HTTP_400_BAD_REQUEST,
     HTTP_403_FORBIDDEN,
     HTTP_404_NOT_FOUND,
@@ -19,8 +26,16 @@ from rest_framework.status import (
 from rest_framework.test import APITestCase
 
 from project.geosource.models import FieldTypes, PostGISSource, Source, WMTSSource
+from project.geosource.signals import refresh_data_done
+from project.terra_layer.local_cache import local_cache
 from project.terra_layer.models import CustomStyle, FilterField, Layer, LayerGroup
-from project.terra_layer.utils import get_layer_group_cache_key
+from project.terra_layer.utils import (
+    get_layer_group_cache_key,
+    get_scene_generation,
+    get_scene_generation_key,
+    get_scene_profiles,
+)
+from project.terra_layer.views.layers import LayerView
 
 from .factories import SceneFactory
 
@@ -415,6 +430,62 @@ class ModelSourceViewsetTestCase(APITestCase):
         response = self.client.get(reverse("layerview", args=[scene["slug"]]))
         self.assertEqual(response.status_code, HTTP_404_NOT_FOUND)
 
+    def _create_nested_scene(self, name, depth):
+        def get_tree(level):
+            layer = Layer.objects.create(
+                source=self.source,
+                name=f"Layer {level}",
+                minisheet_config={"enable": True},
+                popup_config={"enable": True},
+            )
+            CustomStyle.objects.create(layer=layer, source=self.source)
+            tree = [{"geolayer": layer.id}]
+            if level < depth:
+                tree.append(
+                    {
+                        "label": f"Group {level}",
+                        "group": True,
+                        "children": get_tree(level + 1),
+                    }
+                )
+            return tree
+
+        query = {
+            "name": name,
+            "category": "map",
+            "tree": get_tree(1),
+            "baselayer": [],
+        }
+        response = self.client.post(reverse("scene-list"), query)
+        self.assertEqual(response.status_code, HTTP_201_CREATED)
+        return response.json()
+
+    def _count_layer_view_queries(self, scene):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                reverse("layerview", args=[scene["slug"]]), {"cache": "false"}
+            )
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        return len(queries), response.json()
+
+    def test_layer_view_constant_queries(self):
+        small_scene = self._create_nested_scene("Small scene", 1)
+        large_scene = self._create_nested_scene("Large scene", 6)
+
+        small_count, small_tree = self._count_layer_view_queries(small_scene)
+        large_count, large_tree = self._count_layer_view_queries(large_scene)
+
+        self.assertEqual(small_count, large_count)
+        self.assertEqual(len(large_tree["map"]["customStyle"]["sources"]), 12)
+        self.assertEqual(len(large_tree["interactions"]), 12)
+
+        # Deepest layer is in the fifth nested group
+        group = large_tree["layersTree"][1]
+        for _ in range(4):
+            group = group["layers"][1]
+        self.assertEqual(group["group"], "Group 5")
+        self.assertEqual(group["layers"][0]["label"], "Layer 6")
+
     def test_create_scene_with_complexe_tree(self):
         layers = [
             Layer.objects.create(
@@ -619,6 +690,143 @@ class ModelSourceViewsetTestCase(APITestCase):
         response = self.client.delete(reverse("layer-detail", kwargs={"pk": layer.id}))
         self.assertEqual(response.status_code, HTTP_204_NO_CONTENT)
 
+    def test_style_preview(self):
+        geo_layer = self.source.get_layer()
+        for value in (1, 2, 3):
+            geo_layer.features.create(geom="POINT(0 0)", properties={"a": value})
+        style_config = {
+            "map_style_type": "circle",
+            "type": "wizard",
+            "style": {
+                "circle_color": {
+                    "type": "variable",
+                    "field": "a",
+                    "analysis": "graduated",
+                    "method": "equal_interval",
+                    "values": ["#aa0000", "#000000"],
+                    "generate_legend": True,
+                },
+            },
+        }
+        query = {"source": self.source.pk, "style_config": style_config}
+
+        response = self.client.post(
+            reverse("layer-style-preview"), query, format="json"
+        )
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        preview = response.json()
+        self.assertEqual(
+            preview["map_style"]["paint"]["circle-color"],
+            ["step", ["get", "a"], "#aa0000", 2.0, "#000000"],
+        )
+        self.assertEqual(preview["legends"][0]["uid"], "preview__circle_color")
+        # Nothing is saved
+        self.assertFalse(Layer.objects.exists())
+
+        # Cached until next data refresh
+        with patch(
+            "project.terra_layer.views.layers.generate_style_from_wizard"
+        ) as mocked_generate:
+            response = self.client.post(
+                reverse("layer-style-preview"), query, format="json"
+            )
+            self.assertEqual(response.json(), preview)
+            mocked_generate.assert_not_called()
+
+            mocked_generate.return_value = ({}, [])
+            PostGISSource.objects.filter(pk=self.source.pk).update(
+                last_refresh=self.source.last_refresh + timedelta(minutes=1)
+            )
+            response = self.client.post(
+                reverse("layer-style-preview"), query, format="json"
+            )
+            self.assertEqual(response.json(), {"map_style": {}, "legends": []})
+
+    def test_style_preview_without_data(self):
+        style_config = {
+            "map_style_type": "circle",
+            "type": "wizard",
+            "style": {"circle_color": {"type": "fixed", "value": "#000000"}},
+        }
+        query = {"source": self.source.pk, "style_config": style_config}
+
+        response = self.client.post(
+            reverse("layer-style-preview"), query, format="json"
+        )
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertIn("source", response.json())
+        # Geostore layer is not created by a preview
+        self.assertFalse(GeoLayer.objects.filter(name=self.source.slug).exists())
+
+    def test_histogram(self):
+        geo_layer = self.source.get_layer()
+        for value in (0, 1, 2, 3, 4, None):
+            geo_layer.features.create(geom="POINT(0 0)", properties={"a": value})
+        geo_layer.features.create(geom="POINT(0 0)", properties={"b": "text"})
+        query = {"source": self.source.pk, "field": "a", "bins": 2}
+
+        response = self.client.get(reverse("layer-histogram"), query)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(
+            response.json(),
+            {
+                "min": 0.0,
+                "max": 4.0,
+                "null_count": 2,
+                "bins": [
+                    {"lower": 0.0, "upper": 2.0, "count": 2},
+                    {"lower": 2.0, "upper": 4.0, "count": 3},
+                ],
+            },
+        )
+
+        # Cached until next data refresh
+        geo_layer.features.create(geom="POINT(0 0)", properties={"a": 8})
+        response = self.client.get(reverse("layer-histogram"), query)
+        self.assertEqual(response.json()["max"], 4.0)
+
+        PostGISSource.objects.filter(pk=self.source.pk).update(
+            last_refresh=self.source.last_refresh + timedelta(minutes=1)
+        )
+        response = self.client.get(reverse("layer-histogram"), query)
+        self.assertEqual(response.json()["max"], 8.0)
+
+    def test_histogram_without_data(self):
+        response = self.client.get(
+            reverse("layer-histogram"), {"source": self.source.pk, "field": "a"}
+        )
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+        self.assertIn("source", response.json())
+        self.assertFalse(GeoLayer.objects.filter(name=self.source.slug).exists())
+
+    def test_histogram_invalid(self):
+        geo_layer = self.source.get_layer()
+        geo_layer.features.create(geom="POINT(0 0)", properties={"a": "text"})
+
+        response = self.client.get(
+            reverse("layer-histogram"), {"source": self.source.pk, "field": "a"}
+        )
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(
+            reverse("layer-histogram"), {"source": self.source.pk, "bins": 0}
+        )
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+
+    def test_style_preview_invalid(self):
+        self.source.get_layer()
+        query = {"source": self.source.pk, "style_config": {"type": "wizard"}}
+        response = self.client.post(
+            reverse("layer-style-preview"), query, format="json"
+        )
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+
+        query = {"source": self.source.pk, "style_config": {"type": "advanced"}}
+        response = self.client.post(
+            reverse("layer-style-preview"), query, format="json"
+        )
+        self.assertEqual(response.status_code, HTTP_400_BAD_REQUEST)
+
 
 class ModelSourceViewsetAnonymousTestCase(APITestCase):
     def setUp(self):
@@ -752,14 +960,15 @@ class LayerViewTestCase(APITestCase):
         cache_key = get_layer_group_cache_key(
             self.scene,
             [
-                group.name,
+                source.slug,
             ],
         )
         self.assertIsNotNone(cache.get(cache_key))
 
         # updating layer to trigger cache reset
-        layer.name = "new_name"
-        layer.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            layer.name = "new_name"
+            layer.save()
         self.assertIsNone(cache.get(cache_key))
 
     def test_cache_cleared_after_public_layer_update(self):
@@ -774,10 +983,286 @@ class LayerViewTestCase(APITestCase):
         self.assertIsNotNone(cache.get(cache_key))
 
         # updating layer to trigger cache reset
-        layer.name = "new_name"
-        layer.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            layer.name = "new_name"
+            layer.save()
         self.assertIsNone(cache.get(cache_key))
 
+    def test_cache_cleared_for_groups_combination(self):
+        groups = [Group.objects.create(name=name) for name in ("group_a", "group_b")]
+        self.user.groups.add(*groups)
+        source = PostGISSource.objects.create(
+            **self.source_params, settings={"groups": [group.pk for group in groups]}
+        )
+        layer = Layer.objects.create(
+            name="private_layer", source=source, group=self.layer_group
+        )
+        source.get_layer().authorized_groups.add(*groups)
+
+        self.client.force_authenticate(self.user)
+        self.client.get(reverse("layerview", args=[self.scene.slug]))
+
+        cache_key = get_layer_group_cache_key(self.scene, [source.slug])
+        self.assertIsNotNone(cache.get(cache_key))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CustomStyle.objects.create(layer=layer, source=source)
+        self.assertIsNone(
+            cache.get(get_layer_group_cache_key(self.scene, [source.slug]))
+        )
+
+    def test_cache_shared_by_users_seeing_same_sources(self):
+        group = Group.objects.create(name="private")
+        other_group = Group.objects.create(name="other_private")
+        other_user = UserModel.objects.create(
+            **{UserModel.USERNAME_FIELD: "other_private_user"}
+        )
+        self.user.groups.add(group)
+        other_user.groups.add(group, other_group)
+        source = PostGISSource.objects.create(
+            **self.source_params, settings={"groups": [group.pk, other_group.pk]}
+        )
+        Layer.objects.create(
+            name="private_layer", source=source, group=self.layer_group
+        )
+        source.get_layer().authorized_groups.add(group, other_group)
+
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse("layerview", args=[self.scene.slug]))
+        url = response.json()["map"]["customStyle"]["sources"][0]["url"]
+        self.assertIn("token=", url)
+
+        # Cached tree has no user token
+        cache_key = get_layer_group_cache_key(self.scene, [source.slug])
+        payload = cache.get(cache_key)
+        self.assertNotIn(b"token=", payload["content"])
+
+        # Other user gets the cached tree, with its own token
+        payload["content"] = payload["content"].replace(b'"test_scene"', b'"cached"', 1)
+        cache.set(cache_key, payload)
+        local_cache.clear()
+        self.client.force_authenticate(other_user)
+        response = self.client.get(reverse("layerview", args=[self.scene.slug]))
+        self.assertEqual(response.json()["title"], "cached")
+        other_url = response.json()["map"]["customStyle"]["sources"][0]["url"]
+        self.assertEqual(other_url.split("?")[0], url.split("?")[0])
+        self.assertNotEqual(other_url, url)
+
+    def test_compressed_payload(self):
+        source = PostGISSource.objects.create(**self.source_params)
+        Layer.objects.create(name="public_layer", source=source, group=self.layer_group)
+
+        response = self.client.get(
+            reverse("layerview", args=[self.scene.slug]),
+            HTTP_ACCEPT_ENCODING="gzip, deflate",
+        )
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        tree = json.loads(gzip.decompress(response.content))
+        self.assertEqual(tree["title"], "test_scene")
+        self.assertTrue(tree["map"]["customStyle"]["sources"][0]["url"].endswith("?"))
+
+        # Served from the pre-rendered payload
+        payload = cache.get(get_layer_group_cache_key(self.scene))
+        self.assertEqual(response.content, payload["anonymous"]["gzip"])
+
+        # Uncompressed payload has the same ETag
+        response = self.client.get(reverse("layerview", args=[self.scene.slug]))
+        self.assertNotIn("Content-Encoding", response)
+        self.assertEqual(response["ETag"], payload["anonymous"]["etag"])
+        self.assertEqual(response.json(), tree)
+
+    def test_not_modified(self):
+        source = PostGISSource.objects.create(**self.source_params)
+        layer = Layer.objects.create(
+            name="public_layer", source=source, group=self.layer_group
+        )
+        url = reverse("layerview", args=[self.scene.slug])
+
+        response = self.client.get(url)
+        etag = response["ETag"]
+
+        # Neither built nor read from cache
+        with patch.object(cache, "get_or_set") as get_or_set:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        get_or_set.assert_not_called()
+        self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response["ETag"], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            layer.name = "new_name"
+            layer.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+
+        # Tiles tokens are given to authenticated users
+        self.client.force_authenticate(self.user)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+    def test_not_modified_after_baselayer_update(self):
+        source = PostGISSource.objects.create(**self.source_params)
+        Layer.objects.create(name="public_layer", source=source, group=self.layer_group)
+        url = reverse("layerview", args=[self.scene.slug])
+        etag = self.client.get(url)["ETag"]
+
+        baselayer = MapBaseLayer.objects.create(
+            name="base", base_layer_type="mapbox", map_box_url="mapbox://styles/base"
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.scene.baselayer.add(baselayer)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.json()["map"]["backgroundStyle"][0]["label"], "base")
+
+        etag = response["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            baselayer.name = "renamed"
+            baselayer.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(
+            response.json()["map"]["backgroundStyle"][0]["label"], "renamed"
+        )
+
+    def test_stale_tree_served_while_rebuilt(self):
+        source = PostGISSource.objects.create(**self.source_params)
+        layer = Layer.objects.create(
+            name="public_layer", source=source, group=self.layer_group
+        )
+        url = reverse("layerview", args=[self.scene.slug])
+        etag = self.client.get(url)["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            layer.name = "new_name"
+            layer.save()
+        # Another request is rebuilding the tree
+        cache.add(f"{get_layer_group_cache_key(self.scene)}-lock", "other")
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response.json()["layersTree"][0]["label"], "public_layer")
+        # Stale tree is not served as the new version
+        self.assertNotEqual(response["ETag"], etag)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+    def test_cache_warmed_after_update(self):
+        group = Group.objects.create(name="private")
+        group.user_set.add(self.user)
+        source = PostGISSource.objects.create(
+            **self.source_params, settings={"groups": [group.pk]}
+        )
+        layer = Layer.objects.create(
+            name="private_layer", source=source, group=self.layer_group
+        )
+        source.get_layer().authorized_groups.add(group)
+
+        self.client.force_authenticate(self.user)
+        self.client.get(reverse("layerview", args=[self.scene.slug]))
+        self.assertEqual(get_scene_profiles(self.scene.pk), [[], [source.slug]])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            layer.name = "new_name"
+            layer.save()
+
+        # Public and seen trees are built again
+        for profile in ([], [source.slug]):
+            payload = cache.get(get_layer_group_cache_key(self.scene, profile))
+            self.assertIn(b"new_name", payload["content"])
+
+    def test_cache_set_with_built_generation(self):
+        source = PostGISSource.objects.create(**self.source_params)
+        Layer.objects.create(name="public_layer", source=source, group=self.layer_group)
+        generation = get_scene_generation(self.scene.pk)
+        get_response_with_sources = LayerView.get_response_with_sources
+
+        def update_while_building(view):
+            response = get_response_with_sources(view)
+            cache.delete(get_scene_generation_key(self.scene.pk))
+            return response
+
+        with patch.object(
+            LayerView, "get_response_with_sources", update_while_building
+        ):
+            LayerView(scene=self.scene, authorization_profile=[]).set_cache()
+
+        # Tree is not cached as the new generation
+        self.assertIsNotNone(
+            cache.get(get_layer_group_cache_key(self.scene, [], generation))
+        )
+        self.assertIsNone(cache.get(get_layer_group_cache_key(self.scene, [])))
+
+    def test_cache_cleared_on_commit(self):
+        generation = get_scene_generation(self.scene.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.scene.save()
+            self.assertEqual(get_scene_generation(self.scene.pk), generation)
+        self.assertNotEqual(get_scene_generation(self.scene.pk), generation)
+
+    def test_cache_cleared_after_source_update(self):
+        source = PostGISSource.objects.create(**self.source_params)
+        Layer.objects.create(name="public_layer", source=source, group=self.layer_group)
+        generation = get_scene_generation(self.scene.pk)
+
+        # Only source models are listened
+        with patch("project.terra_layer.receivers.get_source_scenes") as get_scenes:
+            source.get_layer().features.create(geom="POINT (0 0)", properties={})
+        get_scenes.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            source.save()
+        self.assertNotEqual(get_scene_generation(self.scene.pk), generation)
+
+    def test_cache_kept_after_source_report_update(self):
+        source = PostGISSource.objects.create(**self.source_params)
+        Layer.objects.create(name="public_layer", source=source, group=self.layer_group)
+        generation = get_scene_generation(self.scene.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            source.report = {"status": "success"}
+            source.save(update_fields=["report"])
+        self.assertEqual(get_scene_generation(self.scene.pk), generation)
+
+    def test_cache_cleared_after_layer_moved(self):
+        source = PostGISSource.objects.create(**self.source_params)
+        layer = Layer.objects.create(
+            name="public_layer", source=source, group=self.layer_group
+        )
+        other_scene = SceneFactory(name="other_scene")
+        generations = {
+            scene.pk: get_scene_generation(scene.pk)
+            for scene in (self.scene, other_scene)
+        }
+
+        with self.captureOnCommitCallbacks(execute=True):
+            layer.group = LayerGroup.objects.get(view=other_scene)
+            layer.save()
+
+        # Layer is removed from the first scene, and added to the other one
+        for scene_pk, generation in generations.items():
+            self.assertNotEqual(get_scene_generation(scene_pk), generation)
+
+    def test_cache_cleared_after_source_refresh(self):
+        source = PostGISSource.objects.create(**self.source_params)
+        Layer.objects.create(name="public_layer", source=source, group=self.layer_group)
+
+        self.client.get(reverse("layerview", args=[self.scene.slug]))
+        self.assertIsNotNone(cache.get(get_layer_group_cache_key(self.scene)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh_data_done.send_robust(sender=None, layer=source.get_layer().pk)
+        self.assertIsNone(cache.get(get_layer_group_cache_key(self.scene)))
+
+        # Other scenes are kept
+        other_scene = SceneFactory(name="other_scene")
+        generation = get_scene_generation(other_scene.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh_data_done.send_robust(sender=None, layer=source.get_layer().pk)
+        self.assertEqual(get_scene_generation(other_scene.pk), generation)
+
     def test_cache_updated_with_query_parameter(self):
         source = PostGISSource.objects.create(**self.source_params)
         Layer.objects.create(name="public_layer", source=source, group=self.layer_group)
@@ -792,3 +1277,42 @@ class LayerViewTestCase(APITestCase):
         )
 
         self.assertEqual(response.status_code, HTTP_200_OK)
+
+    def test_sources_of_layer_group_authorized(self):
+        group = Group.objects.create(name="private")
+        group.user_set.add(self.user)
+        public_source = PostGISSource.objects.create(**self.source_params)
+        Layer.objects.create(
+            name="public_layer", source=public_source, group=self.layer_group, order=0
+        )
+        private_source = PostGISSource.objects.create(
+            **{**self.source_params, "name": "private"},
+            settings={"groups": [group.pk]},
+        )
+        Layer.objects.create(
+            name="private_layer",
+            source=private_source,
+            group=self.layer_group,
+            order=1,
+        )
+        private_source.get_layer().authorized_groups.add(group)
+        # Public, but not in the layer group of the scene sources
+        other_source = PostGISSource.objects.create(
+            **{**self.source_params, "name": "other"}, settings={"group": "other"}
+        )
+        Layer.objects.create(
+            name="other_layer", source=other_source, group=self.layer_group, order=2
+        )
+
+        response = self.client.get(reverse("layerview", args=[self.scene.slug]))
+        self.assertEqual(
+            [layer["label"] for layer in response.json()["layersTree"]],
+            ["public_layer"],
+        )
+
+        self.client.force_authenticate(self.user)
+        response = self.client.get(reverse("layerview", args=[self.scene.slug]))
+        self.assertEqual(
+            [layer["label"] for layer in response.json()["layersTree"]],
+            ["public_layer", "private_layer"],
+        )
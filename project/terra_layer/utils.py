@@ -1,4 +1,20 @@
+import json
+import time
+import uuid
 from collections.abc import Mapping
+from hashlib import md5
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .settings import (
+    AUTO_WARM_CACHE,
+    CACHE_LOCK_TIMEOUT,
+    CACHE_LOCK_WAIT,
+    CACHE_STALE_TIMEOUT,
+    WARM_CACHE_DELAY,
+    WARM_CACHE_PROFILES,
+)
 
 
 def dict_merge(dct, merge_dct, add_keys=True):
@@ -15,13 +31,175 @@ def dict_merge(dct, merge_dct, add_keys=True):
     return dct
 
 
-def get_layer_group_cache_key(scene, extras=None):
+def get_scene_generation_key(scene_pk):
+    return f"terra-layer-generation-{scene_pk}"
+
+
+def get_scene_generation(scene_pk):
+    """
+    :param scene_pk: The scene pk
+    :return: The current generation of the scene, changed by any update of
+        its layer tree content
+    :rtype: string
+    """
+    return cache.get_or_set(
+        get_scene_generation_key(scene_pk), lambda: uuid.uuid4().hex, None
+    )
+
+
+def bump_scenes_generation(scene_pks):
+    """Invalidate every cached layer tree of scenes at once, whatever their keys.
+
+    Done once the transaction is committed, so trees are not built again from
+    data not committed yet.
+    """
+    scene_pks = set(scene_pks)
+    if scene_pks:
+        transaction.on_commit(lambda: set_scenes_generation(scene_pks))
+
+
+def set_scenes_generation(scene_pks):
+    cache.set_many(
+        {get_scene_generation_key(pk): uuid.uuid4().hex for pk in scene_pks},
+        None,
+    )
+    if AUTO_WARM_CACHE:
+        schedule_scenes_warming(scene_pks)
+
+
+def schedule_scenes_warming(scene_pks):
+    """Warm layer trees of scenes in background, once for a burst of invalidations"""
+    from .tasks import run_warm_scene_cache
+
+    for scene_pk in scene_pks:
+        if cache.add(f"terra-layer-warming-{scene_pk}", True, WARM_CACHE_DELAY):
+            run_warm_scene_cache.apply_async((scene_pk,), countdown=WARM_CACHE_DELAY)
+
+
+def get_scene_profiles_key(scene_pk):
+    return f"terra-layer-profiles-{scene_pk}"
+
+
+def get_scene_profiles(scene_pk):
+    """
+    :param scene_pk: The scene pk
+    :return: The public profile, and the authorization profiles of the last
+        layer trees built for the scene
+    :rtype: list
+    """
+    return [[], *cache.get(get_scene_profiles_key(scene_pk), [])]
+
+
+def add_scene_profile(scene_pk, profile):
+    if not profile:
+        return
+    profiles = cache.get(get_scene_profiles_key(scene_pk), [])
+    if profiles[:1] == [profile]:
+        return
+    profiles = [profile, *[p for p in profiles if p != profile]]
+    cache.set(get_scene_profiles_key(scene_pk), profiles[:WARM_CACHE_PROFILES], None)
+
+
+def get_extras_key(extras=None):
+    extras_joined = "-".join(extras or [])
+    if extras_joined:
+        # Keep keys short whatever the number of extras
+        extras_joined = md5(extras_joined.encode("utf-8")).hexdigest()
+    return extras_joined
+
+
+def get_layer_group_cache_key(scene, extras=None, generation=None):
     """
     :param scene: The scene to be cached
+    :param generation: The scene generation, if already known
     :return: The cache key
     :rtype: string
     """
-    if extras is None:
-        extras = []
-    extras_joined = "-".join(extras)
-    return f"terra-layer-{scene.pk}-{extras_joined}"
+    if generation is None:
+        generation = get_scene_generation(scene.pk)
+    return f"terra-layer-{scene.pk}-{generation}-{get_extras_key(extras)}"
+
+
+def get_layer_group_stale_cache_key(scene, extras=None):
+    """
+    :param scene: The cached scene
+    :return: The cache key of the last layer tree built, whatever its generation
+    :rtype: string
+    """
+    return f"terra-layer-stale-{scene.pk}-{get_extras_key(extras)}"
+
+
+def get_or_set_single_flight(key, default, stale_key=None):
+    """
+    Like `cache.get_or_set`, but a missing value is computed by a single caller
+    at once. Meanwhile, others get the stale value if any, or wait for it.
+
+    :param key: The cache key
+    :param default: The callable computing the value
+    :param stale_key: The cache key where the last computed value is kept
+    :return: The cached value
+    """
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = f"{key}-lock"
+    lock = uuid.uuid4().hex
+    if cache.add(lock_key, lock, CACHE_LOCK_TIMEOUT):
+        try:
+            value = default()
+            cache.set(key, value)
+            if stale_key:
+                cache.set(stale_key, value, CACHE_STALE_TIMEOUT)
+        finally:
+            # The lock may have expired and been taken by another caller
+            if cache.get(lock_key) == lock:
+                cache.delete(lock_key)
+        return value
+
+    if stale_key:
+        value = cache.get(stale_key)
+        if value is not None:
+            return value
+
+    deadline = time.monotonic() + CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        value = cache.get(key)
+        if value is not None:
+            return value
+
+    # Computation is too long, or failed
+    return default()
+
+
+def get_source_data_version(source):
+    """Version of source data, changed by each data refresh"""
+    return source.last_refresh.timestamp()
+
+
+def get_style_preview_cache_key(source, style_config):
+    """
+    :param source: The source styled by the previewed style
+    :param style_config: The previewed wizard style config
+    :return: The cache key, changed by each data refresh of the source
+    :rtype: string
+    """
+    version = get_source_data_version(source)
+    config_hash = md5(
+        json.dumps(style_config, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    return f"terra-layer-style-preview-{source.pk}-{version}-{config_hash}"
+
+
+def get_histogram_cache_key(source, field, bin_count):
+    """
+    :param source: The source of the field
+    :param field: The numeric field
+    :param bin_count: The number of bins
+    :return: The cache key, changed by each data refresh of the source
+    :rtype: string
+    """
+    version = get_source_data_version(source)
+    field_hash = md5(field.encode("utf-8")).hexdigest()
+    return f"terra-layer-histogram-{source.pk}-{version}-{field_hash}-{bin_count}"
@@ -1,15 +1,23 @@
 from geostore.views import FeatureViewSet, LayerGroupViewsSet, LayerViewSet
 
+from project.geosource.generalization import GeneralizedVectorTile
 from project.geosource.views import SourceModelViewset
 
 from ..permissions import ReadOnly, SourcePermission
 
 
+class GeneralizedTileMixin:
+    # Overrides geostore tiles mixin, see GeostoreCompatibilityTestCase
+    def get_tile_for_layer(self, layer, z, x, y, name=None, features_pk=None):
+        tile = GeneralizedVectorTile(layer)
+        return tile.get_tile(x, y, z, name, features_pk)
+
+
 class GeoSourceModelViewset(SourceModelViewset):
     permission_classes = (SourcePermission,)
 
 
-class GeostoreLayerViewSet(LayerViewSet):
+class GeostoreLayerViewSet(GeneralizedTileMixin, LayerViewSet):
     permission_classes = (ReadOnly,)
 
 
@@ -17,5 +25,5 @@ class GeostoreFeatureViewSet(FeatureViewSet):
     permission_classes = (ReadOnly,)
 
 
-class GeostoreLayerGroupViewsSet(LayerGroupViewsSet):
+class GeostoreLayerGroupViewsSet(GeneralizedTileMixin, LayerGroupViewsSet):
     permission_classes = (ReadOnly,)
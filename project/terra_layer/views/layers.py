@@ -1,33 +1,56 @@
 import tempfile
+import time
+from collections import defaultdict
 from copy import deepcopy
+from hashlib import md5
 from urllib.parse import unquote
 
 from django.conf import settings
 from django.core.cache import cache
 from django.core.management import call_command, get_commands
-from django.db.models import Prefetch, Q
+from django.db.models import Prefetch
 from django.http import Http404, QueryDict
 from django.urls import reverse
+from django.utils.cache import get_conditional_response
 from django.utils.functional import cached_property
+from geostore.models import Layer as GeoLayer
 from geostore.tokens import tiles_token_generator
+from rest_framework.decorators import action
 from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 from rest_framework.serializers import ValidationError
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
 
-from project.geosource.models import FieldTypes, WMTSSource
+from project.geosource.models import FieldTypes, Source, WMTSSource
 
+from ..local_cache import local_cache
 from ..models import FilterField, Layer, LayerGroup, Scene
+from ..payloads import build_payload, get_payload_response, render_json
 from ..permissions import LayerPermission, ScenePermission
 from ..serializers import (
+    HistogramSerializer,
     LayerDetailSerializer,
     LayerListSerializer,
     SceneDetailSerializer,
     SceneListSerializer,
+    StylePreviewSerializer,
 )
+from ..settings import CACHE_STALE_TIMEOUT, TILES_TOKEN_TIMEOUT
 from ..sources_serializers import SourceSerializer
-from ..utils import dict_merge, get_layer_group_cache_key
+from ..style import generate_style_from_wizard
+from ..style.utils import get_histogram
+from ..utils import (
+    add_scene_profile,
+    dict_merge,
+    get_histogram_cache_key,
+    get_layer_group_cache_key,
+    get_layer_group_stale_cache_key,
+    get_or_set_single_flight,
+    get_scene_generation,
+    get_scene_profiles,
+    get_style_preview_cache_key,
+)
 
 # Map source field data_type to format_type
 TYPE_MAP = {a: b.name.lower() for a, b in dict(FieldTypes.choices()).items()}
@@ -134,6 +157,67 @@ class LayerViewset(ModelViewSet):
             raise ValidationError("Can't delete a layer linked to a scene")
         super().perform_destroy(instance)
 
+    def get_source_layer(self, source):
+        """Return the geostore layer of a source, without creating it"""
+        try:
+            return GeoLayer.objects.get(name=source.slug)
+        except GeoLayer.DoesNotExist:
+            raise ValidationError({"source": "Source has no data yet"})
+
+    @action(detail=False, methods=["post"], url_path="style-preview")
+    def style_preview(self, request):
+        """
+        Returns map style and legends generated from a wizard style config
+        for a source, without saving anything.
+        """
+        serializer = StylePreviewSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        source = serializer.validated_data["source"]
+        style_config = serializer.validated_data["style_config"]
+        style_config.setdefault("uid", "preview")
+
+        geo_layer = self.get_source_layer(source)
+
+        def generate_preview():
+            try:
+                map_style, legends = generate_style_from_wizard(geo_layer, style_config)
+            except (KeyError, ValueError) as e:
+                raise ValidationError({"style_config": f"Invalid style: {e}"})
+            return {"map_style": map_style, "legends": legends}
+
+        # Style depends only on its config and on source data
+        return Response(
+            cache.get_or_set(
+                get_style_preview_cache_key(source, style_config), generate_preview
+            )
+        )
+
+    @action(detail=False, methods=["get"])
+    def histogram(self, request):
+        """
+        Returns min, max, null count and an equal width histogram of the
+        numeric values of a source field.
+        """
+        serializer = HistogramSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        source = serializer.validated_data["source"]
+        field = serializer.validated_data["field"]
+        bin_count = serializer.validated_data["bins"]
+
+        geo_layer = self.get_source_layer(source)
+
+        def compute_histogram():
+            try:
+                return get_histogram(geo_layer, field, bin_count)
+            except ValueError as e:
+                raise ValidationError({"field": f"{e}"})
+
+        return Response(
+            cache.get_or_set(
+                get_histogram_cache_key(source, field, bin_count), compute_histogram
+            )
+        )
+
 
 class LayerView(APIView):
     """This view generates the LayersTree used to construct the frontend"""
@@ -143,27 +227,8 @@ class LayerView(APIView):
     EXTERNAL_SOURCES_CLASSES = [WMTSSource]
     DEFAULT_SOURCE_NAME = "terra"
     DEFAULT_SOURCE_TYPE = "vector"
-
-    prefetch_layers = Prefetch(
-        "layers",
-        (
-            Layer.objects.select_related("source").prefetch_related(
-                Prefetch(
-                    "fields_filters",
-                    FilterField.objects.filter(shown=True).select_related("field"),
-                    to_attr="filters_shown",
-                ),
-                Prefetch(
-                    "fields_filters",
-                    FilterField.objects.filter(filter_enable=True).select_related(
-                        "field"
-                    ),
-                    to_attr="filters_enabled",
-                ),
-                "extra_styles__source",
-            )
-        ),
-    )
+    # Replaced in source urls by the querystring of the user tiles token
+    TILES_TOKEN = b"__tiles_token__"
 
     scene = None
 
@@ -171,89 +236,170 @@ class LayerView(APIView):
         update_cache = request.query_params.get("cache") == "false"
 
         self.scene = get_object_or_404(Scene, slug=slug)
-        self.layergroup = self.layers.first().source.get_layer().layer_groups.first()
 
-        self.user_groups = tiles_token_generator.get_groups_intersect(
-            self.request.user, self.layergroup
-        )
+        # Unchanged trees are not built again, nor read from cache
+        generation = get_scene_generation(self.scene.pk)
+        etag = self.get_etag(generation)
+        if not update_cache:
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                not_modified["ETag"] = etag
+                return not_modified
 
+        # Users seeing the same sources share the same cached layer tree
         cache_key = get_layer_group_cache_key(
-            self.scene, self.user_groups.values_list("name", flat=True)
+            self.scene, self.authorization_profile, generation
         )
 
         if update_cache:
-            response = self.get_response_with_sources()
-            cache.set(cache_key, response)
+            payload = self.set_cache()
         else:
-            response = cache.get_or_set(cache_key, self.get_response_with_sources)
+            # Hot trees are kept in process, then in the shared cache
+            payload = local_cache.get(cache_key)
+            if payload is None:
+                # Stale tree is served while another request rebuilds it
+                payload = get_or_set_single_flight(
+                    cache_key,
+                    self.get_payload,
+                    stale_key=get_layer_group_stale_cache_key(
+                        self.scene, self.authorization_profile
+                    ),
+                )
+                if payload["generation"] == generation:
+                    local_cache.set(cache_key, payload)
+
+        response = get_payload_response(request, self.add_tiles_token(payload))
+        if payload["generation"] == generation:
+            response["ETag"] = etag
+        return response
+
+    def get_etag(self, generation):
+        """Return the ETag of the user layersTree, changed by any update of the scene"""
+        version = [self.scene.pk, generation]
+        user = self.request.user
+        if not user.is_anonymous:
+            # Tiles token depends on user groups, and expires
+            version += [
+                user.pk,
+                *user.groups.order_by("pk").values_list("pk", flat=True),
+                int(time.time()) // max(TILES_TOKEN_TIMEOUT // 2, 1),
+            ]
+        digest = md5("-".join(map(str, version)).encode("utf-8")).hexdigest()
+        return f'W/"{digest}"'
 
-        return Response(response)
+    @classmethod
+    def warm_cache(cls, scene):
+        """Build and cache layer trees of a scene for public and recently seen
+        authorization profiles. Return the number of trees built.
+        """
+        profiles = get_scene_profiles(scene.pk)
+        for profile in profiles:
+            try:
+                cls(scene=scene, authorization_profile=profile).set_cache()
+            except Http404:
+                # Scene without layers
+                return 0
+        return len(profiles)
+
+    def set_cache(self):
+        """Build the layersTree payload and store it in cache"""
+        payload = self.get_payload()
+        # Keyed with the generation the tree was built from, as it may have
+        # changed while building
+        cache.set(
+            get_layer_group_cache_key(
+                self.scene, self.authorization_profile, payload["generation"]
+            ),
+            payload,
+        )
+        cache.set(
+            get_layer_group_stale_cache_key(self.scene, self.authorization_profile),
+            payload,
+            CACHE_STALE_TIMEOUT,
+        )
+        return payload
 
-    def get_response_with_sources(self):
-        """Return a response object containing the full layersTree with updated
-        user authentication.
+    def get_payload(self):
+        """Return the layersTree rendered with a placeholder for tiles tokens,
+        and its payload without token, served to anonymous users.
         """
+        generation = get_scene_generation(self.scene.pk)
+        # Recently built trees are warmed after invalidation
+        add_scene_profile(self.scene.pk, self.authorization_profile)
+        content = render_json(self.get_response_with_sources())
+        return {
+            "generation": generation,
+            "content": content,
+            "anonymous": build_payload(content.replace(self.TILES_TOKEN, b"")),
+        }
 
-        layer_structure = self.get_layer_structure()
+    def add_tiles_token(self, payload):
+        """Return the layersTree payload with the user tiles token"""
+        if self.request.user.is_anonymous:
+            return payload["anonymous"]
 
+        # We provide tokens in the URL to authenticate the user in the MVT endpoint
         querystring = QueryDict(mutable=True)
+        querystring.update(
+            {
+                "idb64": tiles_token_generator.token_idb64(
+                    self.user_groups, self.layergroup
+                ),
+                "token": tiles_token_generator.make_token(
+                    self.user_groups, self.layergroup
+                ),
+            }
+        )
+        content = payload["content"].replace(
+            self.TILES_TOKEN, querystring.urlencode().encode()
+        )
+        # Compressed when served, as each user gets a different content
+        return build_payload(content, encodings=())
 
-        # When the user is not anonymous, we provide tokens in the URL to authenticated
-        # it in the MVT endpoint
-        if not self.request.user.is_anonymous:
-            querystring.update(
-                {
-                    "idb64": tiles_token_generator.token_idb64(
-                        self.user_groups, self.layergroup
-                    ),
-                    "token": tiles_token_generator.make_token(
-                        self.user_groups, self.layergroup
-                    ),
-                }
-            )
+    def get_response_with_sources(self):
+        """Return a response object containing the full layersTree, with a
+        placeholder for the user tiles token.
+        """
+
+        layer_structure = self.get_layer_structure()
+
+        # Non-raster map layers by layer and source, to set their source "id"
+        map_layers = defaultdict(list)
+        for map_layer in layer_structure["map"]["customStyle"]["layers"]:
+            if map_layer.get("type", "") != "raster":
+                map_layers[map_layer["layerId"], map_layer.get("source-layer")].append(
+                    map_layer
+                )
 
         custom_style_infos = []
-        for i, layer in enumerate(self.layers.all()):
-            if layer.extra_styles.exists():
-                # Layer's extra styles have "sub sources" & "sub layers" we need to handle
-                for y, style in enumerate(layer.extra_styles.all()):
-                    sub_source = style.source
-                    sub_layer = sub_source.get_layer()
-                    subl_url = reverse("layer-tilejson", args=(sub_layer.id,))
-                    sub_source_id = f"{self.DEFAULT_SOURCE_NAME}_{i}_{y}"
-                    custom_style_infos.append((subl_url, sub_source_id))
-
-                    for map_layer in layer_structure["map"]["customStyle"]["layers"]:
-                        if (
-                            map_layer.get("type", "") == "raster"
-                            or map_layer["layerId"] != layer.id
-                        ):
-                            continue
-                        if map_layer["source-layer"] != sub_source.slug:
-                            continue
-                        map_layer["source"] = sub_source_id
-
-            geolayer = layer.source.get_layer()
-            url = reverse("layer-tilejson", args=(geolayer.id,))
+        for i, layer in enumerate(self.layers):
+            # Layer's extra styles have "sub sources" & "sub layers" we need to handle
+            for y, style in enumerate(layer.extra_styles.all()):
+                sub_source = style.source
+                subl_url = reverse(
+                    "layer-tilejson", args=(self.geo_layer_ids[sub_source.slug],)
+                )
+                sub_source_id = f"{self.DEFAULT_SOURCE_NAME}_{i}_{y}"
+                custom_style_infos.append((subl_url, sub_source_id))
+
+                for map_layer in map_layers[layer.id, sub_source.slug]:
+                    map_layer["source"] = sub_source_id
+
+            url = reverse(
+                "layer-tilejson", args=(self.geo_layer_ids[layer.source.slug],)
+            )
             source_id = f"{self.DEFAULT_SOURCE_NAME}_{i}"
             custom_style_infos.append((url, source_id))
 
             # Set the correct source "id" for each non-raster layer in the customStyle field
-            for map_layer in layer_structure["map"]["customStyle"]["layers"]:
-                if (
-                    map_layer.get("type", "") == "raster"
-                    or map_layer["layerId"] != layer.id
-                ):
-                    continue
-                if map_layer["source-layer"] != layer.source.slug:
-                    continue
+            for map_layer in map_layers[layer.id, layer.source.slug]:
                 map_layer["source"] = source_id
 
         layer_structure["map"]["customStyle"]["sources"] = [
             {
                 "id": source_id,
                 "type": self.DEFAULT_SOURCE_TYPE,
-                "url": f"{url}?{querystring.urlencode()}",
+                "url": f"{url}?{self.TILES_TOKEN.decode()}",
             }
             for url, source_id in custom_style_infos
         ]
@@ -311,7 +457,9 @@ class LayerView(APIView):
     def get_map_layers(self):
         """Return sources informations using serializer from sources_serializers module"""
         map_layers = []
-        for layer in self.layers.filter(source__slug__in=self.authorized_sources):
+        for layer in self.layers:
+            if layer.source.slug not in self.authorized_sources:
+                continue
             map_layers += [
                 dict(
                     **SourceSerializer.get_object_serializer(layer).data,
@@ -322,9 +470,8 @@ class LayerView(APIView):
                         **SourceSerializer.get_object_serializer(cs).data,
                         layerId=layer.id,
                     )
-                    for cs in layer.extra_styles.filter(
-                        source__slug__in=self.authorized_sources
-                    )
+                    for cs in layer.extra_styles.all()
+                    if cs.source.slug in self.authorized_sources
                 ],
             ]
         return map_layers
@@ -347,7 +494,7 @@ class LayerView(APIView):
                     "url": unquote(
                         reverse(
                             "feature-detail",
-                            args=(layer.source.get_layer().pk, "{{id}}"),
+                            args=(self.geo_layer_ids[layer.source.slug], "{{id}}"),
                         )
                     ),
                     "id": "_id",
@@ -397,7 +544,7 @@ class LayerView(APIView):
                     "url": unquote(
                         reverse(
                             "feature-detail",
-                            args=(layer.source.get_layer().pk, "{{id}}"),
+                            args=(self.geo_layer_ids[layer.source.slug], "{{id}}"),
                         )
                     ),
                     "id": "_id",
@@ -421,9 +568,10 @@ class LayerView(APIView):
 
     def get_layers_tree(self, scene):
         """Return the full layer tree of a scene object"""
-        root_group = LayerGroup.objects.prefetch_related(self.prefetch_layers).get(
-            view=scene, parent=None
-        )
+        root_groups = self.groups_by_parent[None]
+        if not root_groups:
+            raise LayerGroup.DoesNotExist(f"{scene} has no root group")
+        root_group = root_groups[0]
 
         # Keep only child of root group
         return self.get_group_dict(root_group)["layers"]
@@ -444,16 +592,14 @@ class LayerView(APIView):
         }
 
         # Add subgroups
-        for sub_group in group.children.filter(view=group.view).prefetch_related(
-            self.prefetch_layers
-        ):
+        for sub_group in self.groups_by_parent[group.pk]:
             group_dict = self.get_group_dict(sub_group)
             # exclude empty groups
             if group_dict["layers"]:
                 group_content["layers"].append(group_dict)
 
         # Add layers of group
-        for layer in group.layers.filter(in_tree=True):
+        for layer in self.layers_by_group[group.pk]:
             layer_dict = self.get_layer_dict(layer)
             if layer_dict:
                 group_content["layers"].append(layer_dict)
@@ -467,11 +613,9 @@ class LayerView(APIView):
         return group_content
 
     def get_layer_dict(self, layer):
-        if (
-            layer.source.slug not in self.authorized_sources
-            or layer.extra_styles.exclude(
-                source__slug__in=self.authorized_sources
-            ).exists()
+        if layer.source.slug not in self.authorized_sources or any(
+            style.source.slug not in self.authorized_sources
+            for style in layer.extra_styles.all()
         ):
             # Exclude layers with non-authorized sources
             return None
@@ -547,26 +691,112 @@ class LayerView(APIView):
 
     @cached_property
     def authorized_sources(self):
-        """Cached property of authorized sources from the authenticated user's groups"""
-        groups = self.user_groups
-        sources_slug = list(
-            self.layergroup.layers.filter(
-                Q(authorized_groups__isnull=True) | Q(authorized_groups__in=groups)
+        """Cached property of authorized sources, public ones and the ones
+        authorized to the user groups
+        """
+        return self.public_sources | set(self.authorization_profile)
+
+    @cached_property
+    def public_sources(self):
+        """Slugs of the scene sources of the layer group not restricted to any group"""
+        return set(
+            GeoLayer.objects.filter(
+                pk__in=self.geo_layer_ids.values(),
+                layer_groups=self.layergroup,
+                authorized_groups__isnull=True,
             ).values_list("name", flat=True)
-        ) + list(WMTSSource.objects.values_list("slug", flat=True))
+        ) | set(WMTSSource.objects.values_list("slug", flat=True))
 
-        return sources_slug
+    @cached_property
+    def layergroup(self):
+        return self.layers[0].source.get_layer().layer_groups.first()
+
+    @cached_property
+    def user_groups(self):
+        return tiles_token_generator.get_groups_intersect(
+            self.request.user, self.layergroup
+        )
+
+    @cached_property
+    def authorization_profile(self):
+        """Sorted slugs of the scene sources of the layer group restricted to some
+        of the user groups.
+
+        The layersTree only depends on it, as public sources are shown to everyone.
+        """
+        if self.request.user.is_anonymous:
+            return []
+        return sorted(
+            GeoLayer.objects.filter(
+                pk__in=self.geo_layer_ids.values(),
+                layer_groups=self.layergroup,
+                authorized_groups__in=self.user_groups,
+            )
+            .values_list("name", flat=True)
+            .distinct()
+        )
+
+    @cached_property
+    def geo_layer_ids(self):
+        """Geostore layer id of every source of the scene, by source slug"""
+        sources = {}
+        for layer in self.layers:
+            sources[layer.source.slug] = layer.source
+            for style in layer.extra_styles.all():
+                sources[style.source.slug] = style.source
+
+        geo_layer_ids = dict(
+            GeoLayer.objects.filter(name__in=sources).values_list("name", "pk")
+        )
+        # Geostore layers are created on first use
+        for slug in sources.keys() - geo_layer_ids.keys():
+            geo_layer_ids[slug] = sources[slug].get_layer().pk
+        return geo_layer_ids
 
     @cached_property
     def layers(self):
         """List of layers of the selected scene"""
-        layers = (
+        layers = list(
             self.model.objects.filter(group__view=self.scene.pk)
             .order_by("order")
-            .select_related("source")
-            .prefetch_related("extra_styles__source")
+            .select_related("main_field")
+            # Polymorphic querysets load sources as their real type, with
+            # one query by source type instead of one by source
+            .prefetch_related(
+                Prefetch("source", Source.objects.all()),
+                Prefetch("extra_styles__source", Source.objects.all()),
+                Prefetch(
+                    "fields_filters",
+                    FilterField.objects.filter(shown=True).select_related("field"),
+                    to_attr="filters_shown",
+                ),
+                Prefetch(
+                    "fields_filters",
+                    FilterField.objects.filter(filter_enable=True).select_related(
+                        "field"
+                    ),
+                    to_attr="filters_enabled",
+                ),
+            )
         )
 
         if layers:
             return layers
         raise Http404
+
+    @cached_property
+    def groups_by_parent(self):
+        """Groups of the scene by parent group id, the tree is built from them"""
+        groups_by_parent = defaultdict(list)
+        for group in LayerGroup.objects.filter(view=self.scene):
+            groups_by_parent[group.parent_id].append(group)
+        return groups_by_parent
+
+    @cached_property
+    def layers_by_group(self):
+        """Layers of the scene shown in tree by group id, with layers ordering"""
+        layers_by_group = defaultdict(list)
+        for layer in sorted(self.layers, key=lambda layer: (layer.order, layer.name)):
+            if layer.in_tree:
+                layers_by_group[layer.group_id].append(layer)
+        return layers_by_group
@@ -1,12 +1,17 @@
+from hashlib import md5
+
 from django.urls import reverse
+from django.utils.cache import get_conditional_response
 from mapbox_baselayer.models import MapBaseLayer
 from rest_framework import permissions
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from project.accounts.serializers import UserSerializer
+from project.terra_layer.local_cache import get_or_set
 
 from . import settings as app_settings
+from .utils import get_settings_version
 
 
 class SettingsView(APIView):
@@ -14,47 +19,66 @@ class SettingsView(APIView):
         permissions.AllowAny,
     ]
 
-    def get(self, request, *args, **kwargs):
+    def get_etag(self, version, user):
+        """ETag changed by settings updates, and by user or base url changes"""
+        version = f"{version}-{self.request.build_absolute_uri('/')}-{user}"
+        return f'W/"{md5(version.encode("utf-8")).hexdigest()}"'
+
+    def get_settings(self):
         base_layers = MapBaseLayer.objects.all()
+        return {
+            "instance": {
+                "title": app_settings.INSTANCE_TITLE,
+                "logo": app_settings.INSTANCE_LOGO,
+                "loginUrl": reverse("login_dispatcher"),
+                "logoutUrl": reverse("logout"),
+            },
+            "map": {
+                "baseLayers": [
+                    {
+                        "label": layer.name,
+                        "slug": layer.slug,
+                        "url": f"{self.request.build_absolute_uri(layer.url)}"
+                        if layer.url.startswith("/")
+                        else f"{layer.url}",
+                    }
+                    for layer in base_layers
+                ],
+                "bounds": {
+                    "minLat": app_settings.MAP_BBOX_LAT_MIN,
+                    "minLon": app_settings.MAP_BBOX_LNG_MIN,
+                    "maxLat": app_settings.MAP_BBOX_LAT_MAX,
+                    "maxLon": app_settings.MAP_BBOX_LNG_MAX,
+                },
+                "zoom": {
+                    "min": app_settings.MAP_MIN_ZOOM,
+                    "max": app_settings.MAP_MAX_ZOOM,
+                },
+                "default": {
+                    "lat": app_settings.MAP_DEFAULT_LAT,
+                    "lng": app_settings.MAP_DEFAULT_LNG,
+                    "zoom": app_settings.MAP_DEFAULT_ZOOM,
+                },
+            },
+        }
+
+    def get(self, request, *args, **kwargs):
         user = (
             UserSerializer(request.user).data if request.user.is_authenticated else None
         )
 
-        return Response(
-            {
-                "instance": {
-                    "title": app_settings.INSTANCE_TITLE,
-                    "logo": app_settings.INSTANCE_LOGO,
-                    "loginUrl": reverse("login_dispatcher"),
-                    "logoutUrl": reverse("logout"),
-                },
-                "map": {
-                    "baseLayers": [
-                        {
-                            "label": layer.name,
-                            "slug": layer.slug,
-                            "url": f"{request.build_absolute_uri(layer.url)}"
-                            if layer.url.startswith("/")
-                            else f"{layer.url}",
-                        }
-                        for layer in base_layers
-                    ],
-                    "bounds": {
-                        "minLat": app_settings.MAP_BBOX_LAT_MIN,
-                        "minLon": app_settings.MAP_BBOX_LNG_MIN,
-                        "maxLat": app_settings.MAP_BBOX_LAT_MAX,
-                        "maxLon": app_settings.MAP_BBOX_LNG_MAX,
-                    },
-                    "zoom": {
-                        "min": app_settings.MAP_MIN_ZOOM,
-                        "max": app_settings.MAP_MAX_ZOOM,
-                    },
-                    "default": {
-                        "lat": app_settings.MAP_DEFAULT_LAT,
-                        "lng": app_settings.MAP_DEFAULT_LNG,
-                        "zoom": app_settings.MAP_DEFAULT_ZOOM,
-                    },
-                },
-                "user": user,
-            }
-        )
+        # Unchanged settings are not built again
+        version = get_settings_version()
+        etag = self.get_etag(version, user)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            not_modified["ETag"] = etag
+            return not_modified
+
+        # Settings are shared by users, kept in process then in the shared cache
+        base_url = md5(request.build_absolute_uri("/").encode("utf-8")).hexdigest()
+        settings = get_or_set(f"visu-settings-{version}-{base_url}", self.get_settings)
+
+        response = Response({**settings, "user": user})
+        response["ETag"] = etag
+        return response
@@ -5,3 +5,7 @@ class AppConfig(BaseAppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "project.visu"
     verbose_name = "Visu"
+
+    def ready(self):
+        super().ready()
+        from . import receivers  # NOQA
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from mapbox_baselayer.models import MapBaseLayer
+from siteprefs.models import Preference
+
+from .utils import bump_settings_version
+
+
+@receiver([post_save, post_delete], sender=MapBaseLayer)
+@receiver([post_save, post_delete], sender=Preference)
+def invalidate_settings(sender, instance, **kwargs):
+    bump_settings_version()
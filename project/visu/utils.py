@@ -0,0 +1,18 @@
+import uuid
+
+from django.core.cache import cache
+
+SETTINGS_VERSION_KEY = "visu-settings-version"
+
+
+def get_settings_version():
+    """
+    :return: The current version of instance settings, changed by any update
+        of preferences or base layers
+    :rtype: string
+    """
+    return cache.get_or_set(SETTINGS_VERSION_KEY, lambda: uuid.uuid4().hex, None)
+
+
+def bump_settings_version():
+    cache.set(SETTINGS_VERSION_KEY, uuid.uuid4().hex, None)